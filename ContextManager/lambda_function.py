@@ -6,10 +6,14 @@ import requests
 import tiktoken
 # import Key
 from boto3.dynamodb.conditions import Key, Attr
+from common.embedding_client import EmbeddingClient
+from common.pinecone_client import get_pinecone_client
 
 
 encoding = tiktoken.get_encoding("cl100k_base")
 lambda_client = boto3.client('lambda')
+embedding_client = EmbeddingClient(os.environ['EMBEDDING_LAMBDA'], lambda_client)
+pinecone = get_pinecone_client()
 ddb = boto3.resource('dynamodb')
 convo_table = ddb.Table(os.environ['BLOCKS_DDB_TABLE'])
 twin_table = ddb.Table(os.environ['TWINS_DDB_TABLE'])
@@ -23,33 +27,6 @@ from aws_xray_sdk.core import patch_all
 # Patch boto3 and requests to enable them for tracing with X-Ray
 patch_all()
 
-def invoke_embedding_lambda(text):
-    with xray_recorder.in_subsegment('Invoke Embedding Lambda'):
-        event = {'body': json.dumps({'query': text})}
-        response = lambda_client.invoke(
-            FunctionName=os.environ['EMBEDDING_LAMBDA'],
-            InvocationType='RequestResponse',
-            Payload=json.dumps(event)
-        )
-        print(response)
-        # Parse the response from bytes to string
-        # Extract the payload from the response
-        payload = response['Payload']
-
-        # Read the payload and convert it from bytes to a string
-        payload_string = payload.read().decode('utf-8')
-
-        # Parse the payload string into a JSON object
-        payload_json = json.loads(payload_string)
-
-        # Now you can access the 'body' key from the payload JSON object
-        body_json = json.loads(payload_json['body'])
-
-        # Get the 'vector' from the 'body' JSON object
-        vector = body_json['vector']
-
-        return vector
-
 def openai_completion(messages: list[dict], model: str, max_tokens: int=500, temperature: float=0.0) -> dict:
     with xray_recorder.in_subsegment('OpenAI Completion'):
         url = "https://api.openai.com/v1/chat/completions"
@@ -73,44 +50,16 @@ def openai_completion(messages: list[dict], model: str, max_tokens: int=500, tem
 
 def add_to_pinecone(input: str, metadata: dict, namespace: str='default'):
     with xray_recorder.in_subsegment('Add to Pinecone'):
-        url = os.environ['PINECONE_URL']+"/vectors/upsert"
-
-        payload = {
-            "vectors":[{
-                "id": str(uuid.uuid4()),
-                "values": invoke_embedding_lambda(input),
-                "metadata": metadata,
-            }],
-            "namespace": namespace
-        }
-        headers = {
-            "accept": "application/json",
-            "content-type": "application/json",
-            "Api-Key": os.environ['PINECONE_KEY'],
-        }
-
-        response = requests.post(url, json=payload, headers=headers)
-        return response
+        vectors = [{
+            "id": str(uuid.uuid4()),
+            "values": embedding_client.embed(input),
+            "metadata": metadata,
+        }]
+        return pinecone.upsert(vectors, namespace)
 
 def query_pinecone(text: str, metadata_filters: dict, top_n: int, namespace: str='default'):
     with xray_recorder.in_subsegment('Query Pinecone'):
-        url = os.environ['PINECONE_URL']+"/query"
-
-        payload = {
-            "vector": invoke_embedding_lambda(text),
-            "filter": metadata_filters,
-            "topK": top_n,
-            "namespace": namespace,
-            "includeMetadata": True
-        }
-        headers = {
-            "accept": "application/json",
-            "content-type": "application/json",
-            "Api-Key": os.environ['PINECONE_KEY'],
-        }
-        print(payload)
-        response = requests.post(url, json=payload, headers=headers)
-        return response.json()
+        return pinecone.query(embedding_client.embed(text), top_n, namespace, filter=metadata_filters)
 
 def lambda_handler(event, context):
     with xray_recorder.in_subsegment('Lambda Handler'):
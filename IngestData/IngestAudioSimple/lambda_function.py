@@ -1,59 +1,27 @@
 import json
 import boto3
-import uuid
 import os
 import requests
+from common.chunker import Chunker, token_counter
+from common.embedding_client import EmbeddingClient
+from common.ingest_manifest import SourceManifest
+from common.ingest_pipeline import ingest
+from common.pinecone_client import get_pinecone_client
+from common.namespace_versions import NamespaceVersions
 
 lambda_client = boto3.client('lambda')
+embedding_client = EmbeddingClient(os.environ['EMBEDDING_LAMBDA'], lambda_client)
 s3 = boto3.client('s3')
-
-
-def invoke_embedding_lambda(text):
-    event = {'body': json.dumps({'query': text})}
-    response = lambda_client.invoke(
-        FunctionName=os.environ['EMBEDDING_LAMBDA'],
-        InvocationType='RequestResponse',
-        Payload=json.dumps(event)
-    )
-    print(response)
-    # Parse the response from bytes to string
-    # Extract the payload from the response
-    payload = response['Payload']
-
-    # Read the payload and convert it from bytes to a string
-    payload_string = payload.read().decode('utf-8')
-
-    # Parse the payload string into a JSON object
-    payload_json = json.loads(payload_string)
-
-    # Now you can access the 'body' key from the payload JSON object
-    body_json = json.loads(payload_json['body'])
-
-    # Get the 'vector' from the 'body' JSON object
-    vector = body_json['vector']
-
-    return vector
-
-
-def add_to_pinecone(input: str, metadata: dict, namespace: str='default'):
-    url = os.environ['PINECONE_URL']+"/vectors/upsert"
-
-    payload = {
-        "vectors":[{
-            "id": str(uuid.uuid4()),
-            "values": invoke_embedding_lambda(input),
-            "metadata": metadata,
-        }],
-        "namespace": namespace
-    }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "Api-Key": os.environ['PINECONE_KEY'],
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    return response
+ddb = boto3.resource('dynamodb')
+pinecone = get_pinecone_client()
+# vector ids written per (namespace, source), see common/ingest_manifest.py. Set
+# MANIFEST_LEGACY_CLEANUP=false once no document ingested before the manifest is left
+manifest = SourceManifest(ddb.Table(os.environ['MANIFEST_DDB_TABLE']), 'simple',
+                          legacy_cleanup=os.environ.get('MANIFEST_LEGACY_CLEANUP', 'true').lower() == 'true')
+namespace_versions = NamespaceVersions(ddb.Table(os.environ['NAMESPACE_VERSION_TABLE']))
+# paragraphs of up to CHUNK_SIZE words, or tokens of the tiktoken encoding CHUNK_ENCODING
+chunker = Chunker(int(os.environ.get('CHUNK_SIZE', 300)), int(os.environ.get('CHUNK_OVERLAP', 0)),
+                  token_counter(os.environ.get('CHUNK_ENCODING', 'words')))
 
 
 def transcribe(file_path: str):
@@ -69,18 +37,6 @@ def transcribe(file_path: str):
     response = requests.post(url, json=payload, headers=headers)
     return response.json()
 
-def text_splitter(text: str):
-    # split text by sentences, then join sentences until the length is ~300 words
-    sentences = text.split('.')
-    paragraphs = []
-    paragraph = ''
-    for sentence in sentences:
-        if len(paragraph.split(' ')) > 300:
-            paragraphs.append(paragraph)
-            paragraph = ''
-        paragraph += sentence + '.'
-    return paragraphs
-
 def lambda_handler(event, context):
     # Get s3 bucket&key, tenantid, twinid from event
     body = json.loads(event['body'])
@@ -103,29 +59,31 @@ def lambda_handler(event, context):
     # Transcribe file
     response = transcribe(url)
     print(response)
-    # Split into paragraphs of ~300 words, overlapping by a sentence
+    # Split into paragraphs of up to CHUNK_SIZE words, overlapping by CHUNK_OVERLAP sentences
     transcript = response['results']['channels'][0]['alternatives'][0]['transcript']
-    split_text = text_splitter(transcript)
-    # Assign metadata to paragraphs and add to pinecone index
-    for paragraph in split_text:
-        paragraph_id = str(uuid.uuid4())
-        # get namespace
-        namespace = f'{twin_id}'
-        # add type and source
-        _type = 'applicable_idea'
-        source = key
-        # add paragraph to pinecone index
-        metadata = {
+    # get namespace
+    namespace = f'{twin_id}'
+    # ids and manifest items are per embedding model, a model change re-embeds everything
+    source_manifest = manifest.with_model(embedding_client.model_id())
+    # add type and source
+    _type = 'applicable_idea'
+    source = key
+    def metadata(paragraph_id, paragraph):
+        return {
                 'namespace': namespace,
                 'type': _type,
                 'source': source,
+                'ingest': manifest.kind,
                 'id': paragraph_id,
                 'content': paragraph,
                 }
-        resp = add_to_pinecone(paragraph, metadata, namespace)
-        if resp.status_code != 200:
-            print(resp)
-            raise Exception('Adding to pinecone failed')
+    # paragraphs stream through chunking, embedding and upserting in batches of up to
+    # 100 vectors / 2MB, only the ones that changed since the last ingest of this key
+    # are embedded and upserted, see common/ingest_pipeline.py
+    stats = ingest(transcript, chunker, source_manifest, namespace, key, embedding_client, pinecone, metadata)
+    if stats['new'] or stats['deleted'] or stats['legacy']:
+        # invalidates cached retrieval results for the twin
+        namespace_versions.bump(namespace)
     return {
         'statusCode': 200,
         'body': json.dumps(f'Successfully added audio file: {key} from tenant: {tenant_id} for twin: {twin_id} to pinecone index')
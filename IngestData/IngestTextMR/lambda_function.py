@@ -1,136 +1,52 @@
 import json
 import boto3
-import uuid
 import os
-import requests
-import asyncio
-import aiohttp
-from pypdf import PdfReader
-from io import BytesIO
+from common.chunker import Chunker, token_counter
+from common.embedding_client import EmbeddingClient
+from common.ingest_manifest import SourceManifest
+from common.ingest_pipeline import S3RangeFile, pdf_pages, s3_text, upsert_stream
+from common.llm_executor import LLMExecutor
+from common.pdf_extract import PdfExtractor
+from common.pinecone_client import get_pinecone_client
+from common.namespace_versions import NamespaceVersions
 
 lambda_client = boto3.client('lambda')
+embedding_client = EmbeddingClient(os.environ['EMBEDDING_LAMBDA'], lambda_client)
 s3 = boto3.client('s3')
 ddb = boto3.resource('dynamodb')
 prompt_table = ddb.Table(os.environ['PROMPT_TABLE'])
+pinecone = get_pinecone_client()
+# vector ids written per (namespace, source), see common/ingest_manifest.py. Set
+# MANIFEST_LEGACY_CLEANUP=false once no document ingested before the manifest is left
+manifest = SourceManifest(ddb.Table(os.environ['MANIFEST_DDB_TABLE']), 'mr',
+                          legacy_cleanup=os.environ.get('MANIFEST_LEGACY_CLEANUP', 'true').lower() == 'true')
+namespace_versions = NamespaceVersions(ddb.Table(os.environ['NAMESPACE_VERSION_TABLE']))
+# completions share one session, at most LLM_MAX_IN_FLIGHT open at once and paced to the
+# account's LLM_REQUESTS_PER_MINUTE / LLM_TOKENS_PER_MINUTE, see common/llm_executor.py
+llm = LLMExecutor(os.environ['OPENAI_API_KEY'],
+                  max_in_flight=int(os.environ.get('LLM_MAX_IN_FLIGHT', 8)),
+                  requests_per_minute=int(os.environ.get('LLM_REQUESTS_PER_MINUTE', 3500)),
+                  tokens_per_minute=int(os.environ.get('LLM_TOKENS_PER_MINUTE', 90000)))
+# pdf pages are extracted with the PDF_BACKEND library, in-process unless PDF_WORKERS is above 1
+# (worth it with a vCPU per worker, from 1769MB), see common/pdf_extract.py
+pdf_extractor = PdfExtractor(os.environ.get('PDF_BACKEND', 'pypdf'), int(os.environ.get('PDF_WORKERS', 1)))
+# blocks of up to BLOCK_SIZE words (or tokens of the tiktoken encoding CHUNK_ENCODING), each
+# starting with the last OVERLAP_SIZE sentences of the previous one
+chunker = Chunker(int(os.environ['BLOCK_SIZE']), int(os.environ['OVERLAP_SIZE']),
+                  token_counter(os.environ.get('CHUNK_ENCODING', 'words')))
+
+def create_topics(blocks, prompt_template):
+    # (block id, result) of each block as its completion finishes, a failed completion doesn't fail the others
+    prompts = [[{'role':'user', 'content':prompt_template.format(document=block)}] for _, block in blocks]
+    for index, result in llm.as_completed(prompts, "gpt-3.5-turbo", 250, 0.0):
+        yield blocks[index][0], result
 
-async def async_openai_completion(messages: list, model: str, max_tokens: int=500, temperature: float=0.0) -> dict:
-    url = "https://api.openai.com/v1/chat/completions"
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}" 
-    }
-
-    data = {
-        "model": model, 
-        "messages": messages,
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=data) as resp:
-            result = await resp.json()
-            try:
-                return result['choices'][0]['message']
-            except:
-                raise Exception("OpenAI Completion failed: ", result)
-
-async def create_topics(docs, prompt_template):
-    tasks = []
-
-    for doc in docs:
-        doc_dict = {'document': doc}
-        prompt = prompt_template.format(**doc_dict)
-        tasks.append(async_openai_completion([{'role':'user', 'content':prompt}], "gpt-3.5-turbo", 250, 0.0))
-
-    results = await asyncio.gather(*tasks)
-    return results
-
-def invoke_embedding_lambda(text):
-    event = {'body': json.dumps({'query': text})}
-    response = lambda_client.invoke(
-        FunctionName=os.environ['EMBEDDING_LAMBDA'],
-        InvocationType='RequestResponse',
-        Payload=json.dumps(event)
-    )
-    print(response)
-    # Parse the response from bytes to string
-    # Extract the payload from the response
-    payload = response['Payload']
-
-    # Read the payload and convert it from bytes to a string
-    payload_string = payload.read().decode('utf-8')
-
-    # Parse the payload string into a JSON object
-    payload_json = json.loads(payload_string)
-
-    # Now you can access the 'body' key from the payload JSON object
-    body_json = json.loads(payload_json['body'])
-
-    # Get the 'vector' from the 'body' JSON object
-    vector = body_json['vector']
-
-    return vector
-
-
-def add_to_pinecone(input: str, metadata: dict, namespace: str='default'):
-    url = os.environ['PINECONE_URL']+"/vectors/upsert"
-
-    payload = {
-        "vectors":[{
-            "id": str(uuid.uuid4()),
-            "values": invoke_embedding_lambda(input),
-            "metadata": metadata,
-        }],
-        "namespace": namespace
-    }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "Api-Key": os.environ['PINECONE_KEY'],
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    return response
-
-def break_down_with_overlap(corpus: str, block_size: int, overlap_size: int):
-    """
-    corpus - the corpus to break down
-    block_size - number of words per block
-    overlap_size - number of sentences to overlap between blocks
-    """
-    # split corpus into sentences
-    sentences = corpus.split('.')
-    # split sentences into blocks
-    blocks = []
-    block = ''
-    for i, sentence in enumerate(sentences):
-        if len(block.split(' ')) > block_size:
-            blocks.append(block)
-            # set the block to the last overlap_size sentences
-            if overlap_size > 0:
-                if i+1 < overlap_size:
-                    # do not include overlap if it is the first block
-                    block = ''
-                else:
-                    block = ' '.join(sentences[i-overlap_size:i])
-            
-        block += sentence + '.'
-    return blocks
 def validate_input(input: dict, expected_input: list):
     for input_key in input.keys():
         if input_key not in expected_input:
             raise Exception(f"Invalid input key: {input_key}")
 
-def convert_pdf_to_txt(file_contents: bytes):
-    # split pdf into paragraphs
-    reader = PdfReader(BytesIO(file_contents))
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
-
 def lambda_handler(event, context):
     # Get s3 bucket&key, tenantid, twinid from event
     body = json.loads(event['body'])
@@ -142,18 +58,15 @@ def lambda_handler(event, context):
     # Ensure file is .txt or .pdf
     if key[-4:] != '.txt' and key[-4:] != '.pdf':
         raise Exception('File must be .txt or .pdf')
-    # get file from S3
-    s3_object = s3.get_object(Bucket=bucket, Key=key)
-    # get file contents, parse streamingBody
-    file_contents = s3_object['Body'].read()
-    # check file type, .pdf, .txt, .docx, .doc
+    # read the file from S3 as it is chunked, check file type, .pdf, .txt, .md
     if key[-4:] == '.pdf':
-        corpus = convert_pdf_to_txt(file_contents)
+        # ranged GETs, the reader seeks around the file
+        corpus = pdf_pages(S3RangeFile(s3, bucket, key, client_factory=lambda: boto3.client('s3')), pdf_extractor)
     elif key[-4:] == '.txt' or key[-3:] == '.md':
-        corpus = file_contents.decode('utf-8')
+        corpus = s3_text(s3, bucket, key)
     else:
         raise Exception('File must be .pdf, .txt, .md')
-    blocks = break_down_with_overlap(corpus, int(os.environ['BLOCK_SIZE']), int(os.environ['OVERLAP_SIZE']))
+    blocks = list(chunker.chunks(corpus))
     # Create topics for each block
     try:
         response = prompt_table.get_item(
@@ -168,28 +81,50 @@ def lambda_handler(event, context):
         validate_input(doc_dict, input_validation)
     except:
         raise Exception("Prompt template not found")
-    topics = asyncio.run(create_topics(blocks, prompt_template))
-    # Add topics to pinecone
-    for topic in topics:
-        topic_id = str(uuid.uuid4())
-        # get namespace
-        namespace = f'{twin_id}'
-        # add type and source
-        _type = 'applicable_idea'
-        source = key
-        # add paragraph to pinecone index
-        metadata = {
+    # get namespace
+    namespace = f'{twin_id}'
+    # ids and manifest items are per embedding model, a model change re-embeds everything
+    source_manifest = manifest.with_model(embedding_client.model_id())
+    # each block gets one topic, whose id comes from the block's content, so
+    # blocks unchanged since the last ingest of this key skip the completion too
+    new_blocks, stale_ids = source_manifest.diff(namespace, key, blocks)
+    # blocks whose completion failed stay out of the manifest, so the next ingest retries them
+    topic_ids = []
+    failed_blocks = []
+    def completed_topics():
+        for topic_id, result in create_topics(new_blocks, prompt_template):
+            if result['error'] is None:
+                topic_ids.append(topic_id)
+                yield topic_id, result['message']['content']
+            else:
+                failed_blocks.append(topic_id)
+                print(f"Topic for block {topic_id} failed after {result['attempts']} attempts: {result['error']}")
+    # add type and source
+    _type = 'applicable_idea'
+    source = key
+    def metadata(topic_id, topic):
+        return {
                 'namespace': namespace,
                 'type': _type,
                 'source': source,
+                'ingest': manifest.kind,
                 'id': topic_id,
-                'content': topic['content'],
+                'content': topic,
                 }
-        resp = add_to_pinecone(topic['content'], metadata, namespace)
-        if resp.status_code != 200:
-            print(resp)
-            raise Exception('Adding to pinecone failed')
+    # topics are embedded in batches of 16 and upserted (in batches of up to 100 vectors / 2MB)
+    # as their completions finish, while the other completions are still running
+    upsert_stream(completed_topics(), namespace, embedding_client, pinecone, metadata, embed_batch_size=16)
+    if new_blocks and not topic_ids:
+        # nothing to show for the document, fail the invocation (before any stale topics are deleted) so it is retried
+        raise Exception(f'All {len(new_blocks)} topic completions failed for {key}')
+    source_manifest.add(namespace, key, topic_ids)
+    # drop topics of blocks that are no longer in the document, now that the new ones are in
+    removed = source_manifest.cleanup(pinecone, namespace, key, stale_ids)
+    if topic_ids or removed['deleted'] or removed['legacy']:
+        # anything upserted or deleted, by id or by the pre-manifest filter, invalidates cached retrieval results for the twin
+        namespace_versions.bump(namespace)
     return {
         'statusCode': 200,
-        'body': json.dumps(f'Successfully added audio file: {key} from tenant: {tenant_id} for twin: {twin_id} to pinecone index')
+        'body': json.dumps(f'Successfully added audio file: {key} from tenant: {tenant_id} for twin: {twin_id} to pinecone index'
+                           + (f', {len(failed_blocks)} blocks failed and will be retried on the next ingest' if failed_blocks else ''))
     }
@@ -1,91 +1,32 @@
 import json
 import boto3
-import uuid
 import os
-import requests
-from pypdf import PdfReader
-from io import BytesIO
+from common.chunker import Chunker, token_counter
+from common.embedding_client import EmbeddingClient
+from common.ingest_manifest import SourceManifest
+from common.ingest_pipeline import S3RangeFile, ingest, pdf_pages, s3_text
+from common.pdf_extract import PdfExtractor
+from common.pinecone_client import get_pinecone_client
+from common.namespace_versions import NamespaceVersions
 
 lambda_client = boto3.client('lambda')
+embedding_client = EmbeddingClient(os.environ['EMBEDDING_LAMBDA'], lambda_client)
 s3 = boto3.client('s3')
+ddb = boto3.resource('dynamodb')
+pinecone = get_pinecone_client()
+# vector ids written per (namespace, source), see common/ingest_manifest.py. Set
+# MANIFEST_LEGACY_CLEANUP=false once no document ingested before the manifest is left
+manifest = SourceManifest(ddb.Table(os.environ['MANIFEST_DDB_TABLE']), 'simple',
+                          legacy_cleanup=os.environ.get('MANIFEST_LEGACY_CLEANUP', 'true').lower() == 'true')
+namespace_versions = NamespaceVersions(ddb.Table(os.environ['NAMESPACE_VERSION_TABLE']))
+# pdf pages are extracted with the PDF_BACKEND library, in-process unless PDF_WORKERS is above 1
+# (worth it with a vCPU per worker, from 1769MB), see common/pdf_extract.py
+pdf_extractor = PdfExtractor(os.environ.get('PDF_BACKEND', 'pypdf'), int(os.environ.get('PDF_WORKERS', 1)))
+# paragraphs of up to CHUNK_SIZE words, or tokens of the tiktoken encoding CHUNK_ENCODING
+chunker = Chunker(int(os.environ.get('CHUNK_SIZE', 300)), int(os.environ.get('CHUNK_OVERLAP', 0)),
+                  token_counter(os.environ.get('CHUNK_ENCODING', 'words')))
 
 
-def invoke_embedding_lambda(text):
-    event = {'body': json.dumps({'query': text})}
-    response = lambda_client.invoke(
-        FunctionName=os.environ['EMBEDDING_LAMBDA'],
-        InvocationType='RequestResponse',
-        Payload=json.dumps(event)
-    )
-    print(response)
-    # Parse the response from bytes to string
-    # Extract the payload from the response
-    payload = response['Payload']
-
-    # Read the payload and convert it from bytes to a string
-    payload_string = payload.read().decode('utf-8')
-
-    # Parse the payload string into a JSON object
-    payload_json = json.loads(payload_string)
-
-    # Now you can access the 'body' key from the payload JSON object
-    body_json = json.loads(payload_json['body'])
-
-    # Get the 'vector' from the 'body' JSON object
-    vector = body_json['vector']
-
-    return vector
-
-
-def add_to_pinecone(input: str, metadata: dict, namespace: str='default'):
-    url = os.environ['PINECONE_URL']+"/vectors/upsert"
-
-    payload = {
-        "vectors":[{
-            "id": str(uuid.uuid4()),
-            "values": invoke_embedding_lambda(input),
-            "metadata": metadata,
-        }],
-        "namespace": namespace
-    }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "Api-Key": os.environ['PINECONE_KEY'],
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    return response
-
-def pdf_splitter(file_contents: bytes):
-    # split pdf into paragraphs
-    reader = PdfReader(BytesIO(file_contents))
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    sentences = text.split('.')
-    paragraphs = []
-    paragraph = ''
-    for sentence in sentences:
-        if len(paragraph.split(' ')) > 300:
-            paragraphs.append(paragraph)
-            paragraph = ''
-        paragraph += sentence + '.'
-    return paragraphs
-    
-
-def text_splitter(text: str):
-    # split text by sentences, then join sentences until the length is ~300 words
-    sentences = text.split('.')
-    paragraphs = []
-    paragraph = ''
-    for sentence in sentences:
-        if len(paragraph.split(' ')) > 300:
-            paragraphs.append(paragraph)
-            paragraph = ''
-        paragraph += sentence + '.'
-    return paragraphs
-
 def lambda_handler(event, context):
     # Get s3 bucket&key, tenantid, twinid from event
     body = json.loads(event['body'])
@@ -97,38 +38,37 @@ def lambda_handler(event, context):
     # Ensure file is .txt or .pdf
     if key[-4:] != '.txt' and key[-4:] != '.pdf':
         raise Exception('File must be .txt or .pdf')
-    # get file from S3
-    s3_object = s3.get_object(Bucket=bucket, Key=key)
-    # get file contents, parse streamingBody
-    file_contents = s3_object['Body'].read()
-    # check file type, .pdf, .txt, .docx, .doc
+    # read the file from S3 as it is chunked, check file type, .pdf, .txt, .md
     if key[-4:] == '.pdf':
-        paragraphs = pdf_splitter(file_contents)
-        print("Paragraphs: ", paragraphs)
+        # ranged GETs, the reader seeks around the file
+        pages = pdf_pages(S3RangeFile(s3, bucket, key, client_factory=lambda: boto3.client('s3')), pdf_extractor)
     elif key[-4:] == '.txt' or key[-3:] == '.md':
-        paragraphs = text_splitter(file_contents)
-        print("Paragraphs: ", paragraphs)
+        pages = s3_text(s3, bucket, key)
     else: 
         raise Exception('File must be .pdf, .txt, .md')
-    for paragraph in paragraphs:
-        paragraph_id = str(uuid.uuid4())
-        # get namespace
-        namespace = f'{twin_id}'
-        # add type and source
-        _type = 'applicable_idea'
-        source = key
-        # add paragraph to pinecone index
-        metadata = {
+    # get namespace
+    namespace = f'{twin_id}'
+    # ids and manifest items are per embedding model, a model change re-embeds everything
+    source_manifest = manifest.with_model(embedding_client.model_id())
+    # add type and source
+    _type = 'applicable_idea'
+    source = key
+    def metadata(paragraph_id, paragraph):
+        return {
                 'namespace': namespace,
                 'type': _type,
                 'source': source,
+                'ingest': manifest.kind,
                 'id': paragraph_id,
                 'content': paragraph,
                 }
-        resp = add_to_pinecone(paragraph, metadata, namespace)
-        if resp.status_code != 200:
-            print(resp)
-            raise Exception('Adding to pinecone failed')
+    # paragraphs stream through chunking, embedding and upserting in batches of up to
+    # 100 vectors / 2MB, only the ones that changed since the last ingest of this key
+    # are embedded and upserted, see common/ingest_pipeline.py
+    stats = ingest(pages, chunker, source_manifest, namespace, key, embedding_client, pinecone, metadata)
+    if stats['new'] or stats['deleted'] or stats['legacy']:
+        # invalidates cached retrieval results for the twin
+        namespace_versions.bump(namespace)
     return {
         'statusCode': 200,
         'body': json.dumps(f'Successfully added audio file: {key} from tenant: {tenant_id} for twin: {twin_id} to pinecone index')
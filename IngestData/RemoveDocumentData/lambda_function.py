@@ -1,6 +1,17 @@
-import requests
 import json
 import os
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from common.ingest_manifest import SourceManifest
+from common.pinecone_client import get_pinecone_client
+from common.namespace_versions import NamespaceVersions
+
+pinecone = get_pinecone_client()
+ddb = boto3.resource('dynamodb')
+# vector ids written per (namespace, source) by the ingest lambdas, see common/ingest_manifest.py,
+# without a kind it covers the ids of every ingest kind and embedding model
+manifest = SourceManifest(ddb.Table(os.environ['MANIFEST_DDB_TABLE']))
+namespace_versions = NamespaceVersions(ddb.Table(os.environ['NAMESPACE_VERSION_TABLE']))
 
 """
 Example curl:
@@ -14,21 +25,34 @@ curl -i -X POST https://YOUR_INDEX-YOUR_PROJECT.svc.YOUR_ENVIRONMENT.pinecone.io
 """
 
 def delete_from_pinecone_using_metadata(filter: dict, namespace: str='default'):
-    url = os.environ['PINECONE_URL']+"/vectors/delete"
+    return pinecone.delete(namespace, filter=filter)
 
-    payload = {
-        "filter": filter,
-        "namespace": namespace
-    }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "Api-Key": os.environ['PINECONE_KEY'],
+def remove_documents(document_keys: list, namespace: str) -> dict:
+    """
+    Delete every vector of the given documents by id, looked up in the
+    manifest. Documents ingested before the manifest existed have no
+    entries and fall back to a single delete by metadata filter.
+    """
+    with ThreadPoolExecutor(max_workers=min(8, len(document_keys))) as executor:
+        document_ids = list(executor.map(lambda key: sorted(manifest.vector_ids(namespace, key)), document_keys))
+    ids = [id for key_ids in document_ids for id in key_ids]
+    batches = pinecone.delete_ids(ids, namespace)
+    for key, key_ids in zip(document_keys, document_ids):
+        if key_ids:
+            manifest.remove_source(namespace, key)
+    unindexed = [key for key, key_ids in zip(document_keys, document_ids) if not key_ids]
+    if unindexed:
+        delete_from_pinecone_using_metadata({"source": {"$in": unindexed}}, namespace)
+    # invalidates cached retrieval results for the twin
+    namespace_versions.bump(namespace)
+    print(f'Deleted {len(ids)} vectors of {len(document_keys)} documents from namespace {namespace} '
+          f'in {batches} batches, {len(unindexed)} documents deleted by filter')
+    return {
+        'deletedVectors': len(ids),
+        'deleteBatches': batches,
+        'deletedByFilter': unindexed,
     }
 
-    response = requests.post(url, json=payload, headers=headers)
-    return response
-
 def lambda_handler(event, context):
     # Parse the payload string into a JSON object
     payload_json = event
@@ -36,12 +60,15 @@ def lambda_handler(event, context):
     # Now you can access the 'body' key from the payload JSON object
     body_json = json.loads(payload_json['body'])
 
-    # Get the 'filter' from the 'body' JSON object
-    document_key = body_json['documentKey']
+    # 'documentKeys' removes several documents of a twin in one call
+    document_keys = body_json.get('documentKeys') or [body_json['documentKey']]
     tenant_id = body_json['tenantId']
     twin_id = body_json['twinId']
-    namespace = f'{tenant_id}-{twin_id}'
-    filter = {
-        "source": document_key
+    # same namespace the ingest lambdas write to
+    namespace = f'{twin_id}'
+    result = remove_documents(list(dict.fromkeys(document_keys)), namespace)
+    result['message'] = f'Successfully removed {len(document_keys)} documents from tenant: {tenant_id} for twin: {twin_id}'
+    return {
+        'statusCode': 200,
+        'body': json.dumps(result)
     }
-    return delete_from_pinecone_using_metadata(filter, namespace)
\ No newline at end of file
@@ -3,6 +3,7 @@ import os
 import time
 import boto3
 import requests
+from common.retrieval import retriever_from_environ
 
 MAX_RETRIES = 5
 RATE_LIMIT_DURATION = 61  # seconds
@@ -14,6 +15,11 @@ step_table = boto3.resource('dynamodb').Table(STEPS_TABLE)
 twin_table = boto3.resource('dynamodb').Table(TWIN_TABLE)
 lambda_client = boto3.client('lambda')
 prompt_table = boto3.resource('dynamodb').Table(os.environ['PROMPT_TABLE'])
+# cl100k_base tokens of retrieved content per prompt, 0 leaves it to final_set_size alone
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get('RETRIEVAL_TOKEN_BUDGET', 0))
+# 'local' runs retrieval in this process (common/retrieval.py) instead of invoking MMR_LAMBDA
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'lambda')
+retriever = retriever_from_environ(lambda_client) if RETRIEVAL_MODE == 'local' else None
 
 def openai_completion(messages: list[dict], model: str, max_tokens: int=500, temperature: float=0.0) -> dict:
     """
@@ -62,10 +68,19 @@ def validate_input(input: dict, expected_input: list[str]):
     for input_key in input.keys():
         if input_key not in expected_input:
             raise Exception(f"Invalid input key: {input_key}")
-def query_mmr(text: list[str], metadata_filters: dict, top_n: int, namespace: str='default'):
-
+def query_mmr(text: list[str], metadata_filters: dict, top_n: int, namespace: str='default', token_budget: int=RETRIEVAL_TOKEN_BUDGET):
+
+    if retriever is not None:
+        body_json = retriever.retrieve(text, metadata_filters, top_n, namespace, top_n, token_budget or None)
+        if isinstance(body_json, dict):
+            print(f"Retrieved {body_json['token_count']} tokens of content, budget {token_budget}")
+            return body_json['matches']
+        return body_json
     # query lambda function
-    event = {'body': json.dumps({'queries': text, 'metadata_filters': metadata_filters, 'top_n': top_n, 'namespace': namespace, 'final_set_size': top_n})}
+    request = {'queries': text, 'metadata_filters': metadata_filters, 'top_n': top_n, 'namespace': namespace, 'final_set_size': top_n}
+    if token_budget:
+        request['token_budget'] = token_budget
+    event = {'body': json.dumps(request)}
     response = lambda_client.invoke(
         FunctionName=os.environ['MMR_LAMBDA'],
         InvocationType='RequestResponse',
@@ -82,6 +97,9 @@ def query_mmr(text: list[str], metadata_filters: dict, top_n: int, namespace: st
     payload_json = json.loads(payload_string)
     # Now you can access the 'body' key from the payload JSON object
     body_json = json.loads(payload_json['body'])
+    if isinstance(body_json, dict) and 'matches' in body_json:
+        print(f"Retrieved {body_json['token_count']} tokens of content, budget {token_budget}")
+        return body_json['matches']
     return body_json # list of dict matches
 
 def validate_input(input: dict, expected_input: list[str]):
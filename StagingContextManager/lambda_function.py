@@ -3,6 +3,7 @@ import boto3
 import uuid
 import os
 import requests
+from common.retrieval import retriever_from_environ
 import tiktoken
 # import Key
 from decimal import Decimal
@@ -16,6 +17,11 @@ stage_blocks_table = ddb.Table(os.environ['STAGE_BLOCKS_DDB_TABLE'])
 stage_twin_table = ddb.Table(os.environ['STAGE_TWINS_DDB_TABLE'])
 user_twin_table = ddb.Table(os.environ['USER_TWINS_DDB_TABLE'])
 prompt_template_table = ddb.Table(os.environ['PROMPT_TEMPLATE_DDB_TABLE'])
+# cl100k_base tokens of retrieved content per prompt, 0 leaves it to final_set_size alone
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get('RETRIEVAL_TOKEN_BUDGET', 0))
+# 'local' runs retrieval in this process (common/retrieval.py) instead of invoking MMR_LAMBDA
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'lambda')
+retriever = retriever_from_environ(lambda_client) if RETRIEVAL_MODE == 'local' else None
 
 # Import AWS X-Ray SDK
 import aws_xray_sdk
@@ -36,10 +42,19 @@ def find_floats(obj, path=""):
             obj[key] = find_floats(value, path=f"{path}.{key}")
     return obj
 
-def query_mmr(text: list[str], metadata_filters: dict, top_n: int, namespace: str='default'):
+def query_mmr(text: list[str], metadata_filters: dict, top_n: int, namespace: str='default', token_budget: int=RETRIEVAL_TOKEN_BUDGET):
     with xray_recorder.in_subsegment('Query MMR'):
+        if retriever is not None:
+            body_json = retriever.retrieve(text, metadata_filters, top_n, namespace, top_n, token_budget or None)
+            if isinstance(body_json, dict):
+                print(f"Retrieved {body_json['token_count']} tokens of content, budget {token_budget}")
+                return body_json['matches']
+            return body_json
         # query lambda function
-        event = {'body': json.dumps({'queries': text, 'metadata_filters': metadata_filters, 'top_n': top_n, 'namespace': namespace, 'final_set_size': top_n})}
+        request = {'queries': text, 'metadata_filters': metadata_filters, 'top_n': top_n, 'namespace': namespace, 'final_set_size': top_n}
+        if token_budget:
+            request['token_budget'] = token_budget
+        event = {'body': json.dumps(request)}
         response = lambda_client.invoke(
             FunctionName=os.environ['MMR_LAMBDA'],
             InvocationType='RequestResponse',
@@ -60,6 +75,9 @@ def query_mmr(text: list[str], metadata_filters: dict, top_n: int, namespace: st
         body_json = json.loads(payload_json['body'])
         print(body_json)
 
+        if isinstance(body_json, dict) and 'matches' in body_json:
+            print(f"Retrieved {body_json['token_count']} tokens of content, budget {token_budget}")
+            return body_json['matches']
         return body_json # list of dict matches
 
 def validate_input(input: dict, expected_input: list[str]):
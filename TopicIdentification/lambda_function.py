@@ -5,39 +5,16 @@ import boto3
 from aws_xray_sdk.core import xray_recorder
 from aws_xray_sdk.core import patch_all
 import uuid
+from common.embedding_client import EmbeddingClient
+from common.pinecone_client import get_pinecone_client
 
 patch_all()
 
 TOPIC_PROMPT_TABLE = os.environ['TOPIC_PROMPT_TABLE']
 dynamodb = boto3.resource('dynamodb')
 lambda_client = boto3.client('lambda')
-
-def invoke_embedding_lambda(text):
-    with xray_recorder.in_subsegment('Invoke Embedding Lambda'):
-        event = {'body': json.dumps({'query': text})}
-        response = lambda_client.invoke(
-            FunctionName=os.environ['EMBEDDING_LAMBDA'],
-            InvocationType='RequestResponse',
-            Payload=json.dumps(event)
-        )
-        print(response)
-        # Parse the response from bytes to string
-        # Extract the payload from the response
-        payload = response['Payload']
-
-        # Read the payload and convert it from bytes to a string
-        payload_string = payload.read().decode('utf-8')
-
-        # Parse the payload string into a JSON object
-        payload_json = json.loads(payload_string)
-
-        # Now you can access the 'body' key from the payload JSON object
-        body_json = json.loads(payload_json['body'])
-
-        # Get the 'vector' from the 'body' JSON object
-        vector = body_json['vector']
-
-        return vector
+embedding_client = EmbeddingClient(os.environ['EMBEDDING_LAMBDA'], lambda_client)
+pinecone = get_pinecone_client()
 
 def openai_completion(messages: list[dict], model: str, max_tokens: int=500, temperature: float=0.0) -> dict:
     with xray_recorder.in_subsegment('OpenAI Completion'):
@@ -62,44 +39,16 @@ def openai_completion(messages: list[dict], model: str, max_tokens: int=500, tem
 
 def add_to_pinecone(input: str, metadata: dict, namespace: str='default'):
     with xray_recorder.in_subsegment('Add to Pinecone'):
-        url = os.environ['PINECONE_URL']+"/vectors/upsert"
-
-        payload = {
-            "vectors":[{
-                "id": str(uuid.uuid4()),
-                "values": invoke_embedding_lambda(input),
-                "metadata": metadata,
-            }],
-            "namespace": namespace
-        }
-        headers = {
-            "accept": "application/json",
-            "content-type": "application/json",
-            "Api-Key": os.environ['PINECONE_KEY'],
-        }
-
-        response = requests.post(url, json=payload, headers=headers)
-        return response
+        vectors = [{
+            "id": str(uuid.uuid4()),
+            "values": embedding_client.embed(input),
+            "metadata": metadata,
+        }]
+        return pinecone.upsert(vectors, namespace)
 
 def query_pinecone(text: str, metadata_filters: dict, top_n: int, namespace: str='default'):
     with xray_recorder.in_subsegment('Query Pinecone'):
-        url = os.environ['PINECONE_URL']+"/query"
-
-        payload = {
-            "vector": invoke_embedding_lambda(text),
-            "filter": metadata_filters,
-            "topK": top_n,
-            "namespace": namespace,
-            "includeMetadata": True
-        }
-        headers = {
-            "accept": "application/json",
-            "content-type": "application/json",
-            "Api-Key": os.environ['PINECONE_KEY'],
-        }
-        print(payload)
-        response = requests.post(url, json=payload, headers=headers)
-        return response.json()
+        return pinecone.query(embedding_client.embed(text), top_n, namespace, filter=metadata_filters)
 
 def lambda_handler(event, context):
     """
@@ -138,6 +87,8 @@ def lambda_handler(event, context):
 
     # Loop thru topics & query pinecone to find similar concepts
     final_topics = []
+    # embed every topic in one batched call, query_pinecone and add_to_pinecone below hit the client cache
+    embedding_client.embed_many(topics)
     for topic in topics:
         # Query pinecone to find similar concepts
         response = query_pinecone(topic, {'twinId':twinId}, 1)
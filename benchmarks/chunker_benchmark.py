@@ -0,0 +1,104 @@
+"""
+Compare common.chunker with the splitters the ingest lambdas used to ship.
+
+    python -m benchmarks.chunker_benchmark --megabytes 10 --block-size 300 --overlap 2
+
+Chunks generated text with the old text_splitter and break_down_with_overlap
+and with Chunker counting words, and with tiktoken tokens when the
+cl100k_base encoding can be loaded. The old loops re-split the growing block for every sentence, so
+their cost per block grows with the square of --block-size.
+"""
+import argparse
+import random
+import time
+
+from common.chunker import Chunker, token_counter
+
+WORDS = ('pricing onboarding revenue customers goals support latency ideas summary transcript '
+         'stage twin document context retrieval growth churn roadmap hiring budget the a of and to').split()
+
+
+def text_splitter(text):
+    # the previous IngestTextSimple / IngestAudioSimple splitter
+    sentences = text.split('.')
+    paragraphs = []
+    paragraph = ''
+    for sentence in sentences:
+        if len(paragraph.split(' ')) > 300:
+            paragraphs.append(paragraph)
+            paragraph = ''
+        paragraph += sentence + '.'
+    return paragraphs
+
+
+def break_down_with_overlap(corpus, block_size, overlap_size):
+    # the previous IngestTextMR / IngestAudioMR splitter
+    sentences = corpus.split('.')
+    blocks = []
+    block = ''
+    for i, sentence in enumerate(sentences):
+        if len(block.split(' ')) > block_size:
+            blocks.append(block)
+            if overlap_size > 0:
+                if i+1 < overlap_size:
+                    block = ''
+                else:
+                    block = ' '.join(sentences[i-overlap_size:i])
+        block += sentence + '.'
+    return blocks
+
+
+def make_text(megabytes: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    sentences = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 30))).capitalize() + '.'
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    return ' '.join(sentences)
+
+
+def timed(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--megabytes', type=float, default=10)
+    parser.add_argument('--block-size', type=int, default=300)
+    parser.add_argument('--overlap', type=int, default=2)
+    args = parser.parse_args()
+
+    text = make_text(args.megabytes)
+    print(f"{len(text) / 1024 / 1024:.1f}MB, {args.block_size} per chunk, {args.overlap} sentence overlap")
+    print("{:<40} {:>8} {:>10} {:>10}".format("Chunker", "Chunks", "Seconds", "MB/s"))
+    print("-" * 70)
+
+    def report(label, chunks, seconds):
+        print("{:<40} {:>8} {:>10.2f} {:>10.2f}".format(label, len(chunks), seconds, len(text) / 1024 / 1024 / seconds))
+
+    # text_splitter always used 300 words
+    old_chunks, seconds = timed(text_splitter, text)
+    report("text_splitter", old_chunks, seconds)
+    old_chunks, seconds = timed(break_down_with_overlap, text, args.block_size, args.overlap)
+    report("break_down_with_overlap", old_chunks, seconds)
+
+    chunks, seconds = timed(lambda: list(Chunker(args.block_size, args.overlap).chunks(text)))
+    report("Chunker words", chunks, seconds)
+    over = sum(len(chunk.split()) > args.block_size for chunk in chunks)
+    print(f"  {over} chunks over {args.block_size} words, last chunk ends with: {chunks[-1][-40:]!r}")
+    try:
+        count_tokens = token_counter('cl100k_base')
+    except Exception as e:
+        # tiktoken missing, or no network to download the encoding
+        print(f"Skipping Chunker cl100k_base: {type(e).__name__}")
+        return
+    chunks, seconds = timed(lambda: list(Chunker(args.block_size, args.overlap, count_tokens).chunks(text)))
+    report("Chunker cl100k_base", chunks, seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Stage overlap and peak memory of common.ingest_pipeline against the
+read-everything-then-chunk-then-embed-then-upsert flow the ingest lambdas
+used to run, on local stand-ins for S3, the embedding lambda and pinecone.
+
+    python -m benchmarks.ingest_pipeline_benchmark --pages 200 --extract-ms 20 --embed-ms 1000
+    python -m benchmarks.ingest_pipeline_benchmark --pdf some.pdf
+
+Pages are generated text that takes --extract-ms each to "extract", or
+with --pdf the pages of a real PDF read through S3RangeFile (needs pypdf).
+The embedding stand-in sleeps --embed-ms per round of up to 4 concurrent
+batches of 64 texts, pinecone is common.local_pinecone over HTTP. Peak memory is
+the tracemalloc peak of a run without the sleeps and with upserts thrown
+away, at --pages and 4x as many pages.
+"""
+import argparse
+import io
+import math
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+
+import numpy as np
+
+from common.chunker import Chunker
+from common.ingest_manifest import SourceManifest
+from common.ingest_pipeline import S3RangeFile, ingest, pdf_pages
+from common.local_pinecone import LocalPinecone, serve
+from common.pinecone_client import PineconeClient
+from common.pinecone_writer import PineconeWriter
+
+WORDS = ('pricing onboarding revenue customers goals support latency ideas summary transcript '
+         'stage twin document context retrieval growth churn roadmap hiring budget the a of and to').split()
+
+
+class StandInS3:
+    """
+    head_object and (ranged) get_object over an in-memory object.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.data), 'ETag': '"stand-in"'}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        data = self.data
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': io.BytesIO(data)}
+
+
+class StandInTable:
+    """
+    The query, get_item and batch_writer calls SourceManifest makes, on an
+    empty table.
+    """
+
+    def query(self, **kwargs):
+        return {'Items': []}
+
+    def get_item(self, **kwargs):
+        return {}
+
+    @contextmanager
+    def batch_writer(self):
+        yield self
+
+    def put_item(self, Item):
+        pass
+
+    def delete_item(self, Key):
+        pass
+
+
+class DiscardingPinecone:
+    """
+    Accepts upserts and deletes without keeping anything, so the memory runs
+    measure the ingest and not the index.
+    """
+
+    def upsert(self, vectors, namespace):
+        return {'upsertedCount': len(vectors)}
+
+    def delete_ids(self, ids, namespace):
+        return 0
+
+    def delete(self, namespace, ids=None, filter=None):
+        return {}
+
+
+class StandInEmbeddingClient:
+    def __init__(self, dim: int, embed_ms: float, batch_size: int = 64, max_concurrency: int = 4):
+        self.dim = dim
+        self.embed_ms = embed_ms
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.rng = np.random.default_rng(0)
+
+    def embed_many(self, texts: list) -> np.ndarray:
+        rounds = math.ceil(math.ceil(len(texts) / self.batch_size) / self.max_concurrency)
+        time.sleep(rounds * self.embed_ms / 1000)
+        return self.rng.standard_normal((len(texts), self.dim), dtype=np.float32)
+
+
+def generated_pages(count: int, extract_ms: float, words_per_page: int = 500):
+    rng = random.Random(0)
+    for _ in range(count):
+        time.sleep(extract_ms / 1000)
+        sentences = []
+        words = 0
+        while words < words_per_page:
+            length = rng.randint(4, 30)
+            sentences.append(' '.join(rng.choice(WORDS) for _ in range(length)).capitalize() + '.')
+            words += length
+        yield ' '.join(sentences) + "\n"
+
+
+def serial(pages, chunker, manifest, namespace, source, embedding_client, pinecone, metadata):
+    # the previous lambda flow: whole text, then all chunks, then all embeddings, then the upserts
+    text = ""
+    for page in pages:
+        text += page
+    new_chunks, stale_ids = manifest.diff(namespace, source, list(chunker.chunks(text)))
+    vectors = embedding_client.embed_many([chunk for _, chunk in new_chunks])
+    with PineconeWriter(namespace, client=pinecone) as writer:
+        for (id, chunk), vector in zip(new_chunks, vectors):
+            writer.add(id, vector.tolist(), metadata(id, chunk))
+    manifest.add(namespace, source, [id for id, _ in new_chunks])
+    manifest.cleanup(pinecone, namespace, source, stale_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--pdf', default='')
+    parser.add_argument('--extract-ms', type=float, default=20.0)
+    parser.add_argument('--embed-ms', type=float, default=1000.0)
+    parser.add_argument('--chunk-size', type=int, default=300)
+    parser.add_argument('--dim', type=int, default=768)
+    args = parser.parse_args()
+
+    _, url = serve(LocalPinecone(args.dim))
+    pinecone = PineconeClient(url, 'local')
+    manifest = SourceManifest(StandInTable())
+    chunker = Chunker(args.chunk_size)
+    pdf = open(args.pdf, 'rb').read() if args.pdf else None
+
+    def pages(count, extract_ms):
+        if pdf is not None:
+            return pdf_pages(S3RangeFile(StandInS3(pdf), 'bucket', args.pdf))
+        return generated_pages(count, extract_ms)
+
+    def run(flow, count, extract_ms, embed_ms, run_id, pinecone=pinecone):
+        namespace = f'benchmark-{run_id}'
+        with redirect_stdout(io.StringIO()):
+            start = time.time()
+            flow(pages(count, extract_ms), chunker, manifest, namespace, 'doc.pdf',
+                 StandInEmbeddingClient(args.dim, embed_ms), pinecone,
+                 lambda id, chunk: {'source': 'doc.pdf', 'content': chunk})
+            return time.time() - start
+
+    flows = (('serial', serial), ('pipeline', ingest))
+    source = args.pdf or f"{args.pages} generated pages, {args.extract_ms:.0f}ms to extract each"
+    print(f"{source}, {args.embed_ms:.0f}ms per embedding round")
+    print("{:<12} {:>10}".format("Flow", "Seconds"))
+    print("-" * 24)
+    for label, flow in flows:
+        print("{:<12} {:>10.2f}".format(label, run(flow, args.pages, args.extract_ms, args.embed_ms, f'time-{label}')))
+
+    print()
+    print("{:<12} {:>8} {:>14}".format("Flow", "Pages", "Peak MB"))
+    print("-" * 36)
+    for count in ((args.pages, args.pages * 4) if pdf is None else (args.pages,)):
+        for label, flow in flows:
+            tracemalloc.start()
+            run(flow, count, 0, 0, f'memory-{label}-{count}', DiscardingPinecone())
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("{:<12} {:>8} {:>14.1f}".format(label, count if pdf is None else 'pdf', peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
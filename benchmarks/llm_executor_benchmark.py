@@ -0,0 +1,133 @@
+"""
+common.llm_executor against the create_topics the MR ingest lambdas used
+to ship, on a local stand-in for the chat completions API.
+
+    python -m benchmarks.llm_executor_benchmark --prompts 300 --server-concurrency 16 --latency-ms 300
+
+The stand-in answers after --latency-ms, returns 429 with Retry-After while
+more than --server-concurrency requests are open, and fails --error-rate
+of the requests with a 500. The old create_topics opens a session per
+prompt and gathers them all, so the first error fails the whole run.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+
+from common.llm_executor import LLMExecutor
+
+
+def serve(latency_ms: float, concurrency: int, error_rate: float):
+    """
+    Runs the stand-in on a thread of its own, returns (url, counters).
+    """
+    from aiohttp import web
+
+    counters = {'requests': 0, 'throttled': 0, 'errors': 0, 'open': 0, 'max_open': 0}
+    rng = random.Random(0)
+
+    async def completions(request):
+        body = await request.json()
+        counters['requests'] += 1
+        counters['open'] += 1
+        counters['max_open'] = max(counters['max_open'], counters['open'])
+        try:
+            if counters['open'] > concurrency:
+                counters['throttled'] += 1
+                return web.json_response({'error': {'message': 'Rate limit reached'}}, status=429,
+                                         headers={'Retry-After': '0.5'})
+            await asyncio.sleep(latency_ms / 1000)
+            if rng.random() < error_rate:
+                counters['errors'] += 1
+                return web.json_response({'error': {'message': 'The server had an error'}}, status=500)
+            prompt = body['messages'][0]['content']
+            return web.json_response({
+                'choices': [{'message': {'role': 'assistant', 'content': f'Topic of {prompt[:40]}'}}],
+                'usage': {'total_tokens': len(prompt) // 4 + 20},
+            })
+        finally:
+            counters['open'] -= 1
+
+    ready = threading.Event()
+    state = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', completions)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        loop.run_until_complete(site.start())
+        state['port'] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{state['port']}/v1/chat/completions", counters
+
+
+async def old_completion(url, messages, model, max_tokens=500, temperature=0.0):
+    # the previous async_openai_completion, pointed at the stand-in
+    import aiohttp
+    data = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, headers={"Content-Type": "application/json"}, json=data) as resp:
+            result = await resp.json()
+            try:
+                return result['choices'][0]['message']
+            except:
+                raise Exception("OpenAI Completion failed: ", result)
+
+
+async def old_create_topics(url, prompts):
+    return await asyncio.gather(*[old_completion(url, messages, "gpt-3.5-turbo", 250, 0.0) for messages in prompts])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prompts', type=int, default=300)
+    parser.add_argument('--latency-ms', type=float, default=300)
+    parser.add_argument('--server-concurrency', type=int, default=16)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--max-in-flight', type=int, default=16)
+    parser.add_argument('--tokens-per-minute', type=int, default=1000000)
+    args = parser.parse_args()
+
+    url, counters = serve(args.latency_ms, args.server_concurrency, args.error_rate)
+    prompts = [[{'role': 'user', 'content': f'Summarize block {i}. ' + 'word ' * 300}] for i in range(args.prompts)]
+    print(f"{args.prompts} prompts, {args.latency_ms:.0f}ms per completion, server allows {args.server_concurrency} "
+          f"open requests, {args.error_rate:.0%} server errors")
+    print("{:<16} {:>9} {:>10} {:>10} {:>10} {:>10}".format("Executor", "Seconds", "Completed", "Failed", "Throttled", "Max open"))
+    print("-" * 70)
+
+    def report(label, seconds, completed, failed):
+        print("{:<16} {:>9.2f} {:>10} {:>10} {:>10} {:>10}".format(
+            label, seconds, completed, failed, counters['throttled'], counters['max_open']))
+        counters.update(requests=0, throttled=0, errors=0, max_open=0)
+
+    start = time.time()
+    try:
+        results = asyncio.run(old_create_topics(url, prompts))
+        report("gather", time.time() - start, len(results), 0)
+    except Exception as e:
+        print(f"gather failed after {time.time() - start:.2f}s: {str(e)[:100]}")
+        report("gather", time.time() - start, 0, args.prompts)
+
+    # let the requests the failed gather left open on the server finish
+    time.sleep(args.latency_ms / 1000 + 0.5)
+    counters.update(requests=0, throttled=0, errors=0, max_open=0)
+    llm = LLMExecutor('local', url=url, max_in_flight=args.max_in_flight, tokens_per_minute=args.tokens_per_minute)
+    start = time.time()
+    results = llm.complete_all(prompts, "gpt-3.5-turbo", 250)
+    failed = sum(result['error'] is not None for result in results)
+    report("LLMExecutor", time.time() - start, len(results) - failed, failed)
+    print(json.dumps(results[0]['message']))
+
+
+if __name__ == '__main__':
+    main()
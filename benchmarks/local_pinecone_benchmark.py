@@ -0,0 +1,64 @@
+"""
+Upsert, query and delete against common.local_pinecone over HTTP, with the
+same PineconeClient and PineconeWriter the lambdas use.
+
+    python -m benchmarks.local_pinecone_benchmark --vectors 50000 --dim 768
+
+Prints upsert throughput, query latency percentiles with and without a
+metadata filter, and the time of a delete by filter. Pass --url to point
+at an already running local server instead of starting one in-process.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from common.local_pinecone import LocalPinecone, serve
+from common.pinecone_client import PineconeClient
+from common.pinecone_writer import PineconeWriter
+
+
+def percentiles(samples: list) -> str:
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+    return f"p50 {p50:.1f}ms  p95 {p95:.1f}ms  p99 {p99:.1f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--sources', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--namespace', default='benchmark')
+    parser.add_argument('--url', default='')
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        _, url = serve(LocalPinecone(args.dim))
+    client = PineconeClient(url, 'local')
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.vectors, args.dim), dtype=np.float32)
+
+    with PineconeWriter(args.namespace, client=client) as writer:
+        for i, vector in enumerate(vectors):
+            writer.add(f'vec-{i}', vector.tolist(), {'source': f'doc-{i % args.sources}', 'chunk': i})
+    print(f"Upsert: {writer.stats['vectors_per_second']:.0f} vectors/sec")
+
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    for label, filter in (('Query', None), ('Filtered query', {'source': {'$in': ['doc-0', 'doc-1']}})):
+        samples = []
+        for query in queries:
+            start = time.time()
+            client.query(query.tolist(), args.top_k, args.namespace, filter=filter)
+            samples.append(time.time() - start)
+        print(f"{label}: {percentiles(samples)}")
+
+    start = time.time()
+    client.delete(args.namespace, filter={'source': 'doc-0'})
+    print(f"Delete by filter: {(time.time() - start) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compare common.mmr with the pure-Python MMR the query lambda used to ship.
+
+    python -m benchmarks.mmr_benchmark --dim 768 --final-set-size 10
+
+For 100, 1000 and 5000 candidates prints the time of the old rerank cut at
+final_set_size and of the vectorized version, and checks they agree on the
+picks. The old full rerank is cubic in the candidate count, so it only runs
+up to --full-max candidates, and the speedup is against the cut version.
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from common.mmr import max_marginal_relevance
+
+
+def cosine_similarity(vec_a, vec_b):
+    dot_product = sum(p*q for p, q in zip(vec_a, vec_b))
+    magnitude_a = math.sqrt(sum([val**2 for val in vec_a]))
+    magnitude_b = math.sqrt(sum([val**2 for val in vec_b]))
+    if not magnitude_a or not magnitude_b:
+        return 0
+    return dot_product / (magnitude_a * magnitude_b)
+
+
+def reference_mmr(matches, lambda_param=0.5, limit=None):
+    # the previous QueryMaxMarginalRelevance implementation, optionally stopped after limit picks
+    selected = []
+    reranked_matches = []
+    remaining_matches = matches.copy()
+    while remaining_matches and (limit is None or len(reranked_matches) < limit):
+        mmr_scores = []
+        for match in remaining_matches:
+            max_sim = max([cosine_similarity(match['values'], vec) for vec in selected]) if selected else 0
+            mmr_scores.append(lambda_param * match['score'] - (1 - lambda_param) * max_sim)
+        best_match = remaining_matches.pop(mmr_scores.index(max(mmr_scores)))
+        reranked_matches.append(best_match)
+        selected.append(best_match['values'])
+    return reranked_matches
+
+
+def candidates(count: int, dim: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    # a few clusters, so diversity actually changes the order
+    centers = rng.standard_normal((8, dim))
+    vectors = centers[rng.integers(0, 8, count)] + 0.5 * rng.standard_normal((count, dim))
+    scores = np.sort(rng.uniform(0.5, 0.9, count))[::-1]
+    return [{'id': str(i), 'score': float(score), 'values': vector.tolist()}
+            for i, (score, vector) in enumerate(zip(scores, vectors))]
+
+
+def timed(fn):
+    start = time.time()
+    result = fn()
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--final-set-size', type=int, default=10)
+    parser.add_argument('--lambda-param', type=float, default=0.5)
+    parser.add_argument('--sizes', default='100,1000,5000')
+    parser.add_argument('--full-max', type=int, default=100)
+    args = parser.parse_args()
+
+    print("{:<12} {:>14} {:>14} {:>14} {:>10}".format("Candidates", "Old full (s)", "Old top-k (s)", "NumPy (s)", "Speedup"))
+    print("-" * 68)
+    for count in [int(size) for size in args.sizes.split(',')]:
+        matches = candidates(count, args.dim)
+        full = '-'
+        if count <= args.full_max:
+            reranked, seconds = timed(lambda: reference_mmr(matches, args.lambda_param))
+            full = f"{seconds:.3f}"
+        old, old_seconds = timed(lambda: reference_mmr(matches, args.lambda_param, args.final_set_size))
+        new, new_seconds = timed(lambda: max_marginal_relevance(matches, args.final_set_size, args.lambda_param))
+        if [m['id'] for m in old] != [m['id'] for m in new]:
+            raise SystemExit(f"Picks differ at {count} candidates")
+        if count <= args.full_max and [m['id'] for m in reranked[:args.final_set_size]] != [m['id'] for m in new]:
+            raise SystemExit(f"Picks differ from the full rerank at {count} candidates")
+        print("{:<12} {:>14} {:>14.3f} {:>14.4f} {:>9.0f}x".format(
+            count, full, old_seconds, new_seconds, old_seconds / max(new_seconds, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
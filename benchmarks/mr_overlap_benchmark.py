@@ -0,0 +1,86 @@
+"""
+Wall clock of the MR ingest's topic, embedding and upsert stages run one
+after the other versus overlapped, on local stand-ins for the completions
+API, the embedding lambda and pinecone.
+
+    python -m benchmarks.mr_overlap_benchmark --blocks 200 --latency-ms 800 --embed-ms 400
+
+The sequential flow waits for every completion (LLMExecutor.complete_all),
+embeds all topics and then upserts them. The overlapped flow is the one the
+MR lambdas run: completions as they finish (LLMExecutor.as_completed) into
+upsert_stream. Each stage is also timed on its own, for the sum and the max.
+"""
+import argparse
+import io
+import time
+from contextlib import redirect_stdout
+
+from benchmarks.ingest_pipeline_benchmark import StandInEmbeddingClient
+from benchmarks.llm_executor_benchmark import serve as serve_completions
+from common.ingest_pipeline import upsert_stream
+from common.llm_executor import LLMExecutor
+from common.local_pinecone import LocalPinecone, serve
+from common.pinecone_client import PineconeClient
+from common.pinecone_writer import PineconeWriter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=800)
+    parser.add_argument('--max-in-flight', type=int, default=16)
+    parser.add_argument('--embed-ms', type=float, default=400)
+    parser.add_argument('--embed-batch-size', type=int, default=16)
+    parser.add_argument('--dim', type=int, default=768)
+    args = parser.parse_args()
+
+    url, _ = serve_completions(args.latency_ms, args.max_in_flight, 0.0)
+    llm = LLMExecutor('local', url=url, max_in_flight=args.max_in_flight, tokens_per_minute=10000000)
+    _, pinecone_url = serve(LocalPinecone(args.dim))
+    pinecone = PineconeClient(pinecone_url, 'local')
+    # the stand-in takes embed_ms for up to 4 concurrent batches of 64, like EmbeddingClient.embed_many
+    embedding_client = StandInEmbeddingClient(args.dim, args.embed_ms)
+    blocks = [(f'block-{i}', f'Block {i}. ' + 'transcript words ' * 150) for i in range(args.blocks)]
+    prompts = [[{'role': 'user', 'content': f'Topic of: {block}'}] for _, block in blocks]
+
+    def metadata(topic_id, topic):
+        return {'source': 'doc.txt', 'content': topic}
+
+    def timed(fn):
+        with redirect_stdout(io.StringIO()):
+            start = time.time()
+            result = fn()
+            return result, time.time() - start
+
+    results, llm_seconds = timed(lambda: llm.complete_all(prompts, "gpt-3.5-turbo", 250))
+    topics = [(id, result['message']['content']) for (id, _), result in zip(blocks, results)]
+    vectors, embed_seconds = timed(lambda: embedding_client.embed_many([topic for _, topic in topics]))
+
+    def upsert(namespace):
+        with PineconeWriter(namespace, client=pinecone) as writer:
+            for (id, topic), vector in zip(topics, vectors):
+                writer.add(id, vector.tolist(), metadata(id, topic))
+    _, upsert_seconds = timed(lambda: upsert('sequential'))
+    sequential = llm_seconds + embed_seconds + upsert_seconds
+
+    def overlapped():
+        def completed_topics():
+            for index, result in llm.as_completed(prompts, "gpt-3.5-turbo", 250):
+                yield blocks[index][0], result['message']['content']
+        upsert_stream(completed_topics(), 'overlapped', embedding_client, pinecone, metadata,
+                      embed_batch_size=args.embed_batch_size)
+    _, overlapped_seconds = timed(overlapped)
+
+    print(f"{args.blocks} blocks, {args.latency_ms:.0f}ms per completion with {args.max_in_flight} in flight, "
+          f"{args.embed_ms:.0f}ms per embedding round")
+    print("{:<28} {:>10}".format("Stage", "Seconds"))
+    print("-" * 40)
+    for label, seconds in (("completions", llm_seconds), ("embedding", embed_seconds), ("upsert", upsert_seconds),
+                           ("sequential (sum)", sequential),
+                           ("max of the stages", max(llm_seconds, embed_seconds, upsert_seconds)),
+                           ("overlapped", overlapped_seconds)):
+        print("{:<28} {:>10.2f}".format(label, seconds))
+
+
+if __name__ == '__main__':
+    main()
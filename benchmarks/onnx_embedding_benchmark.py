@@ -0,0 +1,63 @@
+"""
+Compare the pytorch and onnx embedding backends on a fixed corpus.
+
+    python -m benchmarks.onnx_embedding_benchmark /opt/models/embedding --count 512
+
+The model dir must hold weights baked with common.model_loading and
+exported with common.onnx_encoder. Prints texts/sec per backend and the
+cosine agreement of each onnx variant with the pytorch vectors.
+"""
+import argparse
+import random
+import time
+
+from common.onnx_encoder import MIN_COSINE, OnnxSentenceEncoder, cosine_agreement
+
+WORDS = ('the model retrieves relevant context from documents uploaded by each twin and the '
+         'conversation moves through stages while gathering information about goals pricing '
+         'customers onboarding revenue support latency ideas summary transcript').split()
+
+
+def fixed_corpus(count: int, seed: int = 0) -> list:
+    # same texts on every run, lengths spread like ingest chunks and query questions
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 300))) + '.' for _ in range(count)]
+
+
+def timed_encode(model, texts: list, batch_size: int):
+    model.encode(texts[:batch_size], batch_size=batch_size)
+    start = time.time()
+    vectors = model.encode(texts, batch_size=batch_size)
+    return vectors, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_dir')
+    parser.add_argument('--count', type=int, default=512)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    texts = fixed_corpus(args.count)
+    reference, seconds = timed_encode(SentenceTransformer(args.model_dir, device='cpu'), texts, args.batch_size)
+    print("{:<12} {:>12} {:>12} {:>12}".format("Backend", "Texts/sec", "Min cosine", "Mean cosine"))
+    print("-" * 51)
+    print("{:<12} {:>12.1f} {:>12} {:>12}".format("torch", len(texts)/seconds, "-", "-"))
+
+    failed = False
+    for name, quantized in (('onnx-fp32', False), ('onnx-int8', True)):
+        encoder = OnnxSentenceEncoder(args.model_dir, quantized=quantized, threads=args.threads)
+        vectors, seconds = timed_encode(encoder, texts, args.batch_size)
+        cosines = cosine_agreement(reference, vectors)
+        failed = failed or cosines.min() < MIN_COSINE
+        print("{:<12} {:>12.1f} {:>12.4f} {:>12.4f}".format(name, len(texts)/seconds, cosines.min(), cosines.mean()))
+
+    if failed:
+        raise SystemExit(f"onnx embeddings fell below cosine {MIN_COSINE}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Page extraction time of common.pdf_extract backends and worker counts on
+the same corpus.
+
+    python -m benchmarks.pdf_extract_benchmark --pages 300 --workers 1 2 4
+    python -m benchmarks.pdf_extract_benchmark --pdf a.pdf b.pdf
+
+The corpus is the given PDFs, or one generated PDF of --pages pages of
+text. Every backend whose library is installed (pypdf, pypdfium2) runs with
+each worker count, and the text of each run is checked against the
+single worker run of the same backend. Speedups are against pypdf on one
+worker, and only show with as many CPUs as workers.
+
+Memory is the peak PSS of a fresh process and its workers while pypdf
+extracts the generated PDF, above what it was before, for each worker
+count with the PDF passed as bytes and as an S3RangeFile that each worker
+reopens. PSS splits pages shared after the fork between the processes, so
+forked copies of the parent aren't counted twice.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from benchmarks.ingest_pipeline_benchmark import StandInS3
+from common.ingest_pipeline import S3RangeFile
+from common.pdf_extract import BACKENDS, PdfExtractor
+
+WORDS = ('pricing onboarding revenue customers goals support latency ideas summary transcript '
+         'stage twin document context retrieval growth churn roadmap hiring budget the a of and to').split()
+
+
+def make_pdf(pages: int, lines_per_page: int = 60, seed: int = 0) -> bytes:
+    """
+    A minimal PDF of pages pages of Helvetica text, written by hand so the
+    benchmark needs no PDF writer.
+    """
+    rng = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(pages):
+        lines = [' '.join(rng.choice(WORDS) for _ in range(14)).capitalize() + '.' for _ in range(lines_per_page)]
+        content = b"BT /F1 10 Tf 12 TL 40 780 Td " + b" ".join(f"({line}) '".encode('latin-1') for line in lines) + b" ET"
+        stream = zlib.compress(content)
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_number = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                       b"/Contents %d 0 R >>" % content_number)
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % pages
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(data)
+
+
+def available_backends() -> list:
+    names = []
+    for name, backend in BACKENDS.items():
+        try:
+            backend().open(make_pdf(1))
+        except ImportError:
+            print(f"Skipping {name}, its library is not installed")
+            continue
+        names.append(name)
+    return names
+
+
+def pss_kb(pid: int) -> int:
+    # Pss from smaps_rollup, VmRSS on kernels without it
+    for path, field in ((f'/proc/{pid}/smaps_rollup', 'Pss:'), (f'/proc/{pid}/status', 'VmRSS:')):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1])
+        except OSError:
+            continue
+    return 0
+
+
+def peak_memory_mb(fn) -> float:
+    """
+    Peak PSS of this process and its children while fn runs, above the PSS
+    before it, in MB.
+    """
+    def total():
+        return sum(pss_kb(pid) for pid in [os.getpid()] + [child.pid for child in multiprocessing.active_children()])
+
+    baseline = total()
+    peak = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, total())
+            time.sleep(0.01)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        fn()
+    finally:
+        done.set()
+        sampler.join()
+    return (peak - baseline) / 1024
+
+
+def memory_case(pages: int, workers: int, source: str):
+    data = make_pdf(pages)
+    extractor = PdfExtractor('pypdf', workers)
+    if source == 'bytes':
+        run = lambda: sum(1 for _ in extractor.pages(data))
+    else:
+        run = lambda: sum(1 for _ in extractor.pages(S3RangeFile(StandInS3(data), 'bucket', 'doc.pdf')))
+    print(f"{peak_memory_mb(run):.1f}")
+
+
+def memory_runs(pages: int, worker_counts: list):
+    print(f"\npypdf, {len(make_pdf(pages)) / 1024 / 1024:.1f}MB PDF of {pages} pages")
+    print("{:<8} {:>14} {:>16}".format("Workers", "Bytes peak MB", "Ranges peak MB"))
+    print("-" * 40)
+    for workers in worker_counts:
+        peaks = []
+        for source in ('bytes', 'ranges'):
+            # a process per run, so one run's allocations don't hide the next one's
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.pdf_extract_benchmark', '--pages', str(pages),
+                                     '--memory-case', str(workers), source],
+                                    check=True, capture_output=True, text=True).stdout
+            peaks.append(float(output.split()[-1]))
+        print("{:<8} {:>14.1f} {:>16.1f}".format(workers, *peaks))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', nargs='*', default=[])
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4])
+    parser.add_argument('--memory-case', nargs=2, metavar=('WORKERS', 'SOURCE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.memory_case:
+        memory_case(args.pages, int(args.memory_case[0]), args.memory_case[1])
+        return
+
+    corpus = [open(path, 'rb').read() for path in args.pdf] or [make_pdf(args.pages)]
+    print(f"{len(corpus)} PDFs, {sum(len(data) for data in corpus) / 1024:.0f}KB, {os.cpu_count()} CPUs")
+    print("{:<8} {:>8} {:>8} {:>10} {:>10} {:>12} {:>12} {:>9}".format(
+        "Backend", "Workers", "Pages", "Seconds", "Pages/s", "Page p50 ms", "Page max ms", "Speedup"))
+    print("-" * 86)
+    baseline = None
+    for name in available_backends():
+        reference = None
+        for workers in args.workers:
+            extractor = PdfExtractor(name, workers)
+            start = time.time()
+            pages = [page for data in corpus for page in extractor.pages(data)]
+            seconds = time.time() - start
+            texts = [page['text'] for page in pages]
+            if reference is None:
+                reference = texts
+            elif texts != reference:
+                raise AssertionError(f"{name} on {workers} workers extracted different text than on {args.workers[0]}")
+            if baseline is None:
+                baseline = seconds
+            page_ms = np.array([page['seconds'] for page in pages]) * 1000
+            print("{:<8} {:>8} {:>8} {:>10.2f} {:>10.1f} {:>12.1f} {:>12.1f} {:>8.1f}x".format(
+                name, workers, len(pages), seconds, len(pages) / seconds, np.percentile(page_ms, 50), page_ms.max(),
+                baseline / seconds))
+
+    # pdfium opens its own copy of a file object, the range reads only apply to pypdf
+    if 'pypdf' in available_backends():
+        memory_runs(args.pages, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Latency of retrieval through the MMR lambda versus in-process
+(RETRIEVAL_MODE=local), on local stand-ins for pinecone and lambda.
+
+    python -m benchmarks.retrieval_mode_benchmark --vectors 20000 --invoke-ms 15
+
+Pinecone is common.local_pinecone over HTTP. Lambda invokes go through a
+stand-in client that JSON encodes the event and the response like the real
+one and sleeps --invoke-ms per invoke to stand for the invoke overhead. In
+lambda mode the caller invokes an MMR "lambda" that invokes the embedding
+"lambda"; in local mode the caller embeds and queries itself. The retrieval
+result cache is off in both, so every request does the full retrieval.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import random
+import time
+
+import numpy as np
+
+from common.embedding_client import EmbeddingClient
+from common.local_pinecone import LocalPinecone, serve
+from common.pinecone_client import PineconeClient
+from common.pinecone_writer import PineconeWriter
+from common.retrieval import Retriever
+from common.vector_cache import VectorCache
+from common.vector_codec import encode_vectors
+
+WORDS = ('pricing onboarding revenue customers goals support latency ideas summary transcript '
+         'stage twin document context retrieval growth churn roadmap hiring budget').split()
+
+
+class StandInLambdaClient:
+    """
+    lambda_client.invoke over in-process handlers, with a fixed delay per invoke.
+    """
+
+    def __init__(self, handlers: dict, invoke_ms: float):
+        self.handlers = handlers
+        self.invoke_ms = invoke_ms
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        time.sleep(self.invoke_ms / 1000)
+        response = self.handlers[FunctionName](json.loads(Payload), None)
+        return {'Payload': io.BytesIO(json.dumps(response).encode('utf-8'))}
+
+
+def embedding_handler(dim: int):
+    # deterministic pseudo embeddings, the same text always gets the same vector
+    def handler(event, context):
+        body = json.loads(event['body'])
+        vectors = np.stack([
+            np.random.default_rng(int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:8], 16)).standard_normal(dim)
+            for text in body['queries']
+        ])
+        packed = encode_vectors(vectors, body.get('dtype', 'float32'))
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'vectors': packed['data'], 'format': 'base64', 'dtype': packed['dtype'], 'dim': packed['dim']})
+        }
+    return handler
+
+
+def percentiles(samples: list) -> str:
+    p50, p95 = np.percentile(np.array(samples) * 1000, [50, 95])
+    return f"p50 {p50:.1f}ms  p95 {p95:.1f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=4, help="query questions per request")
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument('--invoke-ms', type=float, default=15.0)
+    args = parser.parse_args()
+
+    _, url = serve(LocalPinecone(args.dim))
+    namespace = 'benchmark-twin'
+    rng = np.random.default_rng(0)
+    with PineconeWriter(namespace, client=PineconeClient(url, 'local')) as writer:
+        for i, vector in enumerate(rng.standard_normal((args.vectors, args.dim), dtype=np.float32)):
+            writer.add(f'vec-{i}', vector.tolist(), {'source': f'doc-{i % 50}', 'content': f'chunk {i}'})
+
+    def make_retriever(lambda_client):
+        return Retriever(EmbeddingClient('embedding', lambda_client), PineconeClient(url, 'local'), VectorCache())
+
+    handlers = {'embedding': embedding_handler(args.dim)}
+    lambda_client = StandInLambdaClient(handlers, args.invoke_ms)
+    # the MMR lambda is its own container, with its own clients and caches
+    handlers['mmr'] = lambda event, context: mmr_retriever.handle_event(event)
+    mmr_retriever = make_retriever(lambda_client)
+    local_retriever = make_retriever(lambda_client)
+
+    def via_lambda(queries):
+        event = {'body': json.dumps({'queries': queries, 'metadata_filters': {}, 'top_n': args.top_n,
+                                     'namespace': namespace, 'final_set_size': args.top_n})}
+        response = lambda_client.invoke(FunctionName='mmr', InvocationType='RequestResponse', Payload=json.dumps(event))
+        return json.loads(json.loads(response['Payload'].read().decode('utf-8'))['body'])
+
+    def in_process(queries):
+        return local_retriever.retrieve(queries, {}, args.top_n, namespace, args.top_n)
+
+    words = random.Random(0)
+    requests = [[' '.join(words.choice(WORDS) for _ in range(8)) for _ in range(args.queries)]
+                for _ in range(args.requests)]
+    timings = {}
+    for label, retrieve in (('lambda', via_lambda), ('local', in_process)):
+        samples = []
+        # keep the retrieval logging out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            for queries in requests:
+                start = time.time()
+                retrieve(queries)
+                samples.append(time.time() - start)
+        timings[label] = samples
+
+    print(f"{args.requests} requests of {args.queries} queries, {args.vectors} vectors, {args.invoke_ms:.0f}ms per invoke")
+    for label, samples in timings.items():
+        print(f"RETRIEVAL_MODE={label:<7} {percentiles(samples)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+"""
+Code shared between the lambda images.
+
+Images that use it are built with the repo's common/ folder passed in as a
+named build context, e.g. from inside a lambda folder:
+
+    docker build --build-context common=../common -t <image> .
+"""
@@ -0,0 +1,203 @@
+"""
+Sentence based chunking shared by the ingest lambdas.
+
+Sentences are streamed out of the text and packed into chunks of up to
+max_tokens, keeping a running token count per chunk, so every sentence is
+counted once and chunking is linear in the size of the text. The last
+overlap sentences of a chunk start the next one.
+
+    chunker = Chunker(max_tokens=300, overlap=1, count_tokens=token_counter('cl100k_base'))
+    chunks = list(chunker.chunks(text))
+"""
+import re
+from collections import deque
+
+# a sentence ends at ., ! or ? followed by whitespace, so 3.5 or e.g.foo stay whole
+SENTENCE_END = re.compile(r'[.!?]+(?=\s)')
+# text without sentence ends is cut at a space after this many characters (right at it when there is
+# no space, e.g. CJK text), so it is not carried forever
+MAX_SENTENCE_CHARS = 100000
+
+
+def word_count(text: str) -> int:
+    return len(text.split())
+
+
+def token_counter(encoding: str = 'words'):
+    """
+    count_tokens for Chunker: 'words' counts whitespace separated words,
+    anything else is a tiktoken encoding name (e.g. cl100k_base).
+    """
+    if not encoding or encoding == 'words':
+        return word_count
+    import tiktoken
+    return TiktokenCounter(tiktoken.get_encoding(encoding))
+
+
+class TiktokenCounter:
+    """
+    count_tokens of a tiktoken encoding. split lets Chunker cut a word
+    longer than a chunk into runs of tokens instead of characters.
+    """
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def __call__(self, text: str) -> int:
+        return len(self.encoder.encode(text, disallowed_special=()))
+
+    def split(self, text: str, max_tokens: int):
+        # (text, tokens) runs of max_tokens tokens, a character split over two tokens goes to the later run
+        ids = self.encoder.encode(text, disallowed_special=())
+        text, offsets = self.encoder.decode_with_offsets(ids)
+        cuts = [0] + [offsets[i] for i in range(max_tokens, len(ids), max_tokens)] + [len(text)]
+        for start, end in zip(cuts, cuts[1:]):
+            if end > start:
+                yield text[start:end], self(text[start:end])
+
+
+def split_sentences(pieces):
+    """
+    Yield the sentences of a str, or of an iterable of str (e.g. pdf pages)
+    without joining it first. A sentence cut across two pieces comes out
+    whole.
+    """
+    if isinstance(pieces, str):
+        pieces = (pieces,)
+    # the text read since the last sentence end, joined once it ends instead of copied on every piece
+    pending = []
+    pending_chars = 0
+    for piece in pieces:
+        # pending has no sentence end, except maybe punctuation at its very end that the next piece
+        # decides, so that punctuation is moved over to the piece
+        carry = ''
+        if pending:
+            last = pending[-1].rstrip('.!?')
+            carry = pending[-1][len(last):]
+            pending[-1] = last
+            pending_chars -= len(carry)
+        text = carry + piece
+        start = 0
+        for end in SENTENCE_END.finditer(text):
+            sentence = (''.join(pending) + text[start:end.end()]).strip()
+            pending = []
+            pending_chars = 0
+            if sentence:
+                yield sentence
+            start = end.end()
+        if start < len(text):
+            pending.append(text[start:])
+            pending_chars += len(text) - start
+        if pending_chars > MAX_SENTENCE_CHARS:
+            rest = ''.join(pending)
+            # cut down to half the limit, so the next cut is at least that many characters away
+            while len(rest) > MAX_SENTENCE_CHARS // 2:
+                cut = rest.rfind(' ', 0, MAX_SENTENCE_CHARS)
+                if cut <= 0:
+                    cut = min(len(rest), MAX_SENTENCE_CHARS)
+                if rest[:cut].strip():
+                    yield rest[:cut].strip()
+                rest = rest[cut:]
+            pending = [rest]
+            pending_chars = len(rest)
+    rest = ''.join(pending).strip()
+    if rest:
+        yield rest
+
+
+class Chunker:
+    """
+    Packs sentences into chunks of at most max_tokens as counted by
+    count_tokens (words by default, see token_counter). Each chunk after the
+    first starts with up to overlap sentences of the previous one, as many
+    as fit. A sentence longer than max_tokens is cut into runs of words,
+    and a word longer than max_tokens (e.g. text without spaces) into runs
+    of tokens when count_tokens has a split method (see TiktokenCounter),
+    of characters otherwise.
+    Token counts are summed per sentence, which is within a token or two
+    per sentence of counting the joined chunk.
+    """
+
+    def __init__(self, max_tokens: int = 300, overlap: int = 0, count_tokens=word_count):
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1")
+        self.max_tokens = max_tokens
+        self.overlap = max(0, overlap)
+        self.count_tokens = count_tokens
+
+    def _pieces(self, sentence: str):
+        # (text, tokens) of a sentence, cut into runs of words when it is over max_tokens
+        tokens = self.count_tokens(sentence)
+        if tokens <= self.max_tokens:
+            yield sentence, tokens
+            return
+        words = []
+        used = 0
+        for word in sentence.split():
+            word_tokens = self.count_tokens(word)
+            if word_tokens > self.max_tokens:
+                if words:
+                    yield ' '.join(words), used
+                parts = list(self._split_word(word, word_tokens))
+                yield from parts[:-1]
+                words = [parts[-1][0]]
+                used = parts[-1][1]
+                continue
+            if words and used + word_tokens > self.max_tokens:
+                yield ' '.join(words), used
+                words = []
+                used = 0
+            words.append(word)
+            used += word_tokens
+        if words:
+            yield ' '.join(words), used
+
+    def _split_word(self, word: str, tokens: int):
+        # (text, tokens) runs of a word over max_tokens
+        split = getattr(self.count_tokens, 'split', None)
+        if split is not None:
+            yield from split(word, self.max_tokens)
+            return
+        # runs of characters, sized from the word's characters per token and halved until they fit
+        step = max(1, len(word) * self.max_tokens // tokens)
+        start = 0
+        while start < len(word):
+            size = step
+            part_tokens = self.count_tokens(word[start:start + size])
+            while part_tokens > self.max_tokens and size > 1:
+                size //= 2
+                part_tokens = self.count_tokens(word[start:start + size])
+            yield word[start:start + size], part_tokens
+            start += size
+
+    def chunks(self, text):
+        """
+        Yield the chunks of a str or of an iterable of str, including the
+        trailing partial chunk.
+        """
+        chunk = []
+        used = 0
+        # the sentences carried into the next chunk
+        recent = deque(maxlen=self.overlap)
+        fresh = False
+        for sentence in split_sentences(text):
+            for piece, tokens in self._pieces(sentence):
+                if fresh and used + tokens > self.max_tokens:
+                    yield ' '.join(part for part, _ in chunk)
+                    chunk = list(recent)
+                    used = sum(count for _, count in chunk)
+                    # drop the oldest overlap sentences until the new one fits
+                    while chunk and used + tokens > self.max_tokens:
+                        used -= chunk.pop(0)[1]
+                    fresh = False
+                chunk.append((piece, tokens))
+                used += tokens
+                fresh = True
+                if self.overlap:
+                    recent.append((piece, tokens))
+        if fresh:
+            yield ' '.join(part for part, _ in chunk)
+
+
+def chunk_text(text, max_tokens: int = 300, overlap: int = 0, count_tokens=word_count) -> list:
+    return list(Chunker(max_tokens, overlap, count_tokens).chunks(text))
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from common.lru import LRUCache
+
+
+def cache_key(model_name: str, instruction: str, text: str) -> str:
+    """
+    Key of an embedding: hash of the model (ModelSpec.cache_name, which
+    includes the backend and quantization), the instruction and the raw text.
+    """
+    data = '\x00'.join([model_name, instruction or '', text])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class DiskVectorStore:
+    """
+    Size bounded store of float32 vectors, one file per key, under a local
+    directory such as /tmp. The least recently used files are deleted once
+    the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._sizes = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # pick up files left by a previous container on the same /tmp, oldest first
+        entries = []
+        for name in os.listdir(directory):
+            if not name.endswith('.f32'):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.f32')
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._sizes:
+                return None
+            self._sizes.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                vector = np.frombuffer(f.read(), dtype='<f4')
+            os.utime(self._path(key))
+            return vector
+        except OSError:
+            with self._lock:
+                self.total_bytes -= self._sizes.pop(key, 0)
+            return None
+
+    def put(self, key: str, vector: np.ndarray):
+        data = np.asarray(vector, dtype='<f4').tobytes()
+        tmp_path = self._path(key) + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            # a full /tmp should not fail the request, the vector is still in memory
+            print(f'Could not write embedding to disk cache: {e}')
+            return
+        with self._lock:
+            self.total_bytes += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+class EmbeddingCache:
+    """
+    Two tier embedding cache: an in-process LRU in front of an optional
+    DiskVectorStore. Both tiers are keyed by cache_key(model, instruction, text).
+    """
+
+    def __init__(self, model_name: str, instruction: str = '', memory_size: int = 10000,
+                 disk_dir: str = '', disk_max_bytes: int = 256 * 1024 * 1024):
+        self.model_name = model_name
+        self.instruction = instruction
+        self.memory = LRUCache(memory_size)
+        self.disk = DiskVectorStore(disk_dir, disk_max_bytes) if disk_dir else None
+
+    def encode(self, texts: list, encode_fn, model_name: str = None, instruction: str = None, sources: list = None):
+        """
+        Return (vectors, stats) for texts, in input order. Only texts found in
+        neither tier are passed to encode_fn, once each, as a single batch.
+        model_name and instruction default to the ones the cache was built with.
+        A sources list is filled with 'memory', 'disk' or 'miss' per text.
+        """
+        stats = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32), stats
+        model_name = self.model_name if model_name is None else model_name
+        instruction = self.instruction if instruction is None else instruction
+        keys = [cache_key(model_name, instruction, text) for text in texts]
+        found = {}
+        origin = {}
+        missing = OrderedDict()
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            vector = self.memory.get(key)
+            if vector is not None:
+                stats['memory_hits'] += 1
+                found[key] = vector
+                origin[key] = 'memory'
+                continue
+            if self.disk is not None:
+                vector = self.disk.get(key)
+                if vector is not None:
+                    stats['disk_hits'] += 1
+                    self.memory.put(key, vector)
+                    found[key] = vector
+                    origin[key] = 'disk'
+                    continue
+            missing[key] = text
+            origin[key] = 'miss'
+        stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+        stats['misses'] = len(missing)
+
+        if missing:
+            vectors = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            for key, vector in zip(missing.keys(), vectors):
+                found[key] = vector
+                self.memory.put(key, vector)
+                if self.disk is not None:
+                    self.disk.put(key, vector)
+
+        if sources is not None:
+            sources.extend(origin[key] for key in keys)
+        return np.stack([found[key] for key in keys]), stats
@@ -0,0 +1,116 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+from common.lru import LRUCache
+from common.vector_codec import decode_embedding_response
+
+# lambda invoke errors worth retrying, everything else is raised straight away
+THROTTLE_CODES = {
+    'TooManyRequestsException',
+    'ThrottlingException',
+    'EC2ThrottledException',
+    'ServiceException',
+}
+
+
+class EmbeddingClient:
+    """
+    Client for the embedding lambda shared by every caller.
+
+    embed_many dedupes its texts, serves repeats from a per-container LRU,
+    splits the rest into batches of batch_size and invokes the lambda for
+    several batches at once. Throttled invokes are retried with jittered
+    exponential backoff.
+    """
+
+    def __init__(self, function_name: str, lambda_client, batch_size: int = 64, max_concurrency: int = 4,
+                 cache_size: int = 10000, max_retries: int = 5, model: str = None, instruction: str = None):
+        self.function_name = function_name
+        self.lambda_client = lambda_client
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.model = model
+        self.instruction = instruction
+        self.cache = LRUCache(cache_size)
+
+    def _invoke(self, texts: list) -> np.ndarray:
+        return decode_embedding_response(self._call(texts))
+
+    def _call(self, texts: list) -> dict:
+        body = {'queries': texts, 'format': 'base64', 'dtype': 'float32'}
+        if self.model is not None:
+            body['model'] = self.model
+        if self.instruction is not None:
+            body['instruction'] = self.instruction
+        payload = json.dumps({'body': json.dumps(body)})
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.lambda_client.invoke(
+                    FunctionName=self.function_name,
+                    InvocationType='RequestResponse',
+                    Payload=payload
+                )
+                break
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code not in THROTTLE_CODES or attempt == self.max_retries:
+                    raise
+                delay = random.uniform(0, min(10.0, 0.2 * 2 ** attempt))
+                print(f"Embedding lambda throttled ({code}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+        payload_json = json.loads(response['Payload'].read().decode('utf-8'))
+        if 'FunctionError' in response or payload_json.get('statusCode') != 200:
+            raise Exception(f"Embedding lambda failed: {payload_json}")
+        return json.loads(payload_json['body'])
+
+    def model_id(self) -> str:
+        """
+        The model and backend the lambda embeds with (ModelSpec.cache_name),
+        asked with an empty batch. Ingest keys its vector ids on it.
+        """
+        return self._call([])['model_id']
+
+    def embed_many(self, texts: list) -> np.ndarray:
+        """
+        Returns a float32 (len(texts), dim) matrix, in input order.
+        """
+        unique = list(dict.fromkeys(texts))
+        vectors = {}
+        missing = []
+        for text in unique:
+            vector = self.cache.get(text)
+            if vector is None:
+                missing.append(text)
+            else:
+                vectors[text] = vector
+
+        if missing:
+            start = time.time()
+            batches = [missing[i:i+self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            if len(batches) == 1:
+                results = [self._invoke(batches[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                    results = list(executor.map(self._invoke, batches))
+            for batch, batch_vectors in zip(batches, results):
+                for text, vector in zip(batch, batch_vectors):
+                    vectors[text] = vector
+                    self.cache.put(text, vector)
+            print(f"Embedded {len(missing)} texts in {len(batches)} batches in {(time.time()-start)*1000:.0f} milliseconds, "
+                  f"{len(unique)-len(missing)} served from cache")
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[text] for text in texts])
+
+    def embed(self, text: str) -> list:
+        """
+        Vector of a single text as a list of floats, ready for a JSON payload.
+        """
+        return self.embed_many([text])[0].tolist()
@@ -0,0 +1,296 @@
+"""
+Run an embedding image as a long-lived HTTP service instead of a lambda.
+
+    docker run -p 8080:8080 --entrypoint python <embedding image> \
+        -m common.embedding_server --port 8080 --workers 2
+
+POST / takes the same {"query": ...} / {"queries": [...]} bodies, with the
+same optional "model" / "instruction", as lambda_handler and returns the
+same response body. GET /metrics returns the worker's throughput and
+queue depth, GET /health returns 200.
+
+The container's lambda_function module (and with it the model) is
+imported once in the parent, then workers are forked so the weights are
+shared copy-on-write. Each worker coalesces concurrent requests into
+micro-batches and single-flights identical texts that are already queued
+or being encoded.
+"""
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Collects texts from concurrent callers and encodes them together once
+    max_batch texts are queued or the oldest has waited max_wait_ms.
+    encode_fn(texts) returns (vectors, metadata), metadata holding one dict
+    per text.
+    """
+
+    def __init__(self, encode_fn, max_batch: int = 64, max_wait_ms: float = 5.0):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._cond = threading.Condition()
+        # text -> futures waiting on it, queued and currently encoding
+        self._pending = OrderedDict()
+        self._inflight = {}
+        self.started = time.time()
+        self.metrics = {
+            'requests': 0,
+            'texts': 0,
+            'single_flight_hits': 0,
+            'batches': 0,
+            'encoded_texts': 0,
+            'encode_seconds': 0.0,
+            'errors': 0,
+        }
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: list) -> list:
+        """
+        Returns one Future per text, resolving to its (vector, metadata).
+        """
+        futures = []
+        with self._cond:
+            self.metrics['requests'] += 1
+            self.metrics['texts'] += len(texts)
+            for text in texts:
+                future = Future()
+                futures.append(future)
+                waiters = self._inflight.get(text) or self._pending.get(text)
+                if waiters is not None:
+                    waiters.append(future)
+                    self.metrics['single_flight_hits'] += 1
+                else:
+                    self._pending[text] = [future]
+            self._cond.notify()
+        return futures
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            texts = list(self._pending.keys())[:self.max_batch]
+            for text in texts:
+                self._inflight[text] = self._pending.pop(text)
+            return texts
+
+    def _run(self):
+        while True:
+            texts = self._next_batch()
+            start = time.time()
+            try:
+                vectors, metadata = self.encode_fn(texts)
+                error = None
+            except Exception as e:
+                print(f"Encoding a batch of {len(texts)} texts failed: {e}")
+                vectors, metadata, error = None, None, e
+            seconds = time.time() - start
+            with self._cond:
+                for i, text in enumerate(texts):
+                    for future in self._inflight.pop(text):
+                        if error is None:
+                            future.set_result((vectors[i], metadata[i]))
+                        else:
+                            future.set_exception(error)
+                self.metrics['batches'] += 1
+                self.metrics['encoded_texts'] += len(texts)
+                self.metrics['encode_seconds'] += seconds
+                if error is not None:
+                    self.metrics['errors'] += 1
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            metrics = dict(self.metrics)
+            metrics['queue_depth'] = len(self._pending)
+            metrics['inflight'] = len(self._inflight)
+        uptime = time.time() - self.started
+        metrics['pid'] = os.getpid()
+        metrics['uptime_seconds'] = uptime
+        metrics['texts_per_second'] = metrics['texts'] / uptime if uptime else 0.0
+        metrics['avg_batch_size'] = metrics['encoded_texts'] / metrics['batches'] if metrics['batches'] else 0.0
+        return metrics
+
+
+def cache_stats(queries: list, metadata: list) -> dict:
+    """
+    The lambda's cache stats for one request, counted over its distinct texts.
+    """
+    sources = dict(zip(queries, (meta['cache'] for meta in metadata)))
+    stats = {
+        'memory_hits': sum(source == 'memory' for source in sources.values()),
+        'disk_hits': sum(source == 'disk' for source in sources.values()),
+        'misses': sum(source == 'miss' for source in sources.values()),
+    }
+    return {'hits': stats['memory_hits'] + stats['disk_hits'], **stats}
+
+
+def make_handler(service, max_batch: int, max_wait_ms: float, timeout: float):
+    # one batcher per (model, instruction), texts only coalesce with texts encoded the same way
+    batchers = {}
+    batchers_lock = threading.Lock()
+
+    def encoder(model_name: str, instruction: str):
+        # tokens are counted on the batcher thread, once per batch, for the token report and the length buckets
+        def encode(texts: list):
+            sources = []
+            report = service.token_report(texts, model_name, instruction)
+            vectors, _ = service.encode_texts(texts, model_name=model_name, instruction=instruction, sources=sources,
+                                              counts=report['token_counts'])
+            return vectors, [{'cache': source, 'token_count': count, 'truncated': truncated}
+                             for source, count, truncated in zip(sources, report['token_counts'], report['truncated'])]
+        return encode
+
+    def batcher_for(model_name: str, instruction: str) -> MicroBatcher:
+        with batchers_lock:
+            key = (model_name, instruction)
+            if key not in batchers:
+                batchers[key] = MicroBatcher(encoder(model_name, instruction), max_batch, max_wait_ms)
+            return batchers[key]
+
+    def metrics() -> dict:
+        with batchers_lock:
+            snapshots = {f'{model_name}|{instruction}': batcher.snapshot()
+                         for (model_name, instruction), batcher in batchers.items()}
+        return {
+            'pid': os.getpid(),
+            'loaded_models': service.model_registry.loaded(),
+            'queue_depth': sum(snapshot['queue_depth'] for snapshot in snapshots.values()),
+            'texts_per_second': sum(snapshot['texts_per_second'] for snapshot in snapshots.values()),
+            'batchers': snapshots,
+        }
+
+    class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: dict):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send(200, metrics())
+            elif self.path == '/health':
+                self._send(200, {'status': 'ok'})
+            else:
+                self._send(404, {'error': f'Unknown path: {self.path}'})
+
+        def do_POST(self):
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                is_batch, queries = service.parse_queries(payload)
+                model_name, instruction = service.resolve_model(payload)
+            except (ValueError, KeyError) as e:
+                self._send(400, {'error': f'Invalid request body: {e}'})
+                return
+            try:
+                futures = batcher_for(model_name, instruction).submit(queries)
+                results = [future.result(timeout=timeout) for future in futures]
+                metadata = [meta for _, meta in results]
+                vectors = np.stack([vector for vector, _ in results]) if results else np.zeros((0, 0), dtype=np.float32)
+                response = service.format_response(payload, vectors, is_batch)
+                response['model'] = model_name
+                response['model_id'] = service.model_registry.spec(model_name).cache_name()
+                response['cache'] = cache_stats(queries, metadata)
+                if is_batch:
+                    response['token_counts'] = [meta['token_count'] for meta in metadata]
+                    response['truncated'] = [meta['truncated'] for meta in metadata]
+                self._send(200, response)
+            except Exception as e:
+                self._send(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            # one line per request is too much at batch throughput
+            pass
+
+    return EmbeddingRequestHandler
+
+
+def serve_worker(sock: socket.socket, service, threads: int, max_batch: int, max_wait_ms: float, timeout: float):
+    if threads:
+        service.model_registry.after_fork(threads)
+    handler = make_handler(service, max_batch, max_wait_ms, timeout)
+    server = ThreadingHTTPServer(sock.getsockname()[:2], handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.daemon_threads = True
+    print(f"Embedding worker {os.getpid()} serving on {sock.getsockname()}")
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds a request waits for its vectors')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+    # loads the default model, before any fork
+    import lambda_function as service
+    # keep the loaded objects out of the collector so workers don't touch their pages
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+
+    if args.workers <= 1:
+        serve_worker(sock, service, 0, args.max_batch, args.max_wait_ms, args.timeout)
+        return
+
+    # split the cores between workers so they don't oversubscribe the CPU
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    threads = max(1, cores // args.workers)
+    children = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve_worker(sock, service, threads, args.max_batch, args.max_wait_ms, args.timeout)
+            finally:
+                os._exit(1)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for child in children:
+        os.waitpid(child, 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import hashlib
+
+from boto3.dynamodb.conditions import Key
+
+# sort key of the item recording that a source's pre-manifest vectors are gone, sorts before every vector item
+MIGRATED_MARKER = '#migrated'
+
+
+def chunk_vector_id(namespace: str, source: str, chunk: str, kind: str = '', model: str = '') -> str:
+    """
+    Deterministic vector id of a chunk: the same text from the same source
+    in the same namespace, ingested the same kind of way (e.g. 'simple' or
+    'mr') and embedded by the same model, always maps to the same id.
+    """
+    content_hash = hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+    data = '\x00'.join([namespace, source, kind, model, content_hash])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class SourceManifest:
+    """
+    Vector ids written for each (namespace, source), one DynamoDB item per
+    vector: partition key sourceKey ('{namespace}#{source}'), sort key
+    vectorId ('{kind}#{model}#{id}'). kind tells the ingest lambdas apart,
+    so the simple and MR ingests of one key don't take each other's vectors
+    for stale ones. model is the embedding model's cache name (see
+    EmbeddingClient.model_id), so after a model change every chunk is new
+    and is embedded again.
+
+    A re-ingest diffs the source's current chunks against the manifest, so
+    only new chunks are embedded and upserted and only vanished ones are
+    deleted:
+
+        manifest = SourceManifest(table, 'simple').with_model(embedding_client.model_id())
+        new_chunks, stale_ids = manifest.diff(namespace, key, chunks)
+        ... embed and upsert new_chunks ...
+        manifest.add(namespace, key, [id for id, _ in new_chunks])
+        manifest.cleanup(pinecone, namespace, key, stale_ids)
+
+    That saves the most on edits that keep chunk boundaries in place. The
+    chunker packs sentences greedily, so text inserted or removed early in
+    a document shifts every later boundary and most chunks come out new.
+
+    cleanup runs once the new vectors are in. Besides the stale ids it
+    deletes the vectors this kind wrote with other models, and, once per
+    source, the vectors ingested before the manifest existed. Those have
+    uuid ids and no 'ingest' metadata, so they are deleted by filter and a
+    marker item records that it's done. Set legacy_cleanup to False once
+    every pre-manifest document has been re-ingested or removed, to save
+    the filter delete on new uploads.
+    """
+
+    def __init__(self, table, kind: str = '', model: str = '', legacy_cleanup: bool = True):
+        self.table = table
+        self.kind = kind
+        self.model = model
+        self.legacy_cleanup = legacy_cleanup
+
+    def with_model(self, model: str) -> 'SourceManifest':
+        return SourceManifest(self.table, self.kind, model, self.legacy_cleanup)
+
+    @staticmethod
+    def source_key(namespace: str, source: str) -> str:
+        return f'{namespace}#{source}'
+
+    def _prefix(self) -> str:
+        return f'{self.kind}#{self.model}#'
+
+    def _items(self, namespace: str, source: str, prefix: str = '') -> list:
+        """
+        Vector items of a source whose sort key starts with prefix.
+        """
+        condition = Key('sourceKey').eq(self.source_key(namespace, source))
+        if prefix:
+            condition = condition & Key('vectorId').begins_with(prefix)
+        items = []
+        query = {
+            'KeyConditionExpression': condition,
+            'ConsistentRead': True,
+        }
+        while True:
+            response = self.table.query(**query)
+            items.extend(item for item in response['Items'] if item['vectorId'] != MIGRATED_MARKER)
+            if 'LastEvaluatedKey' not in response:
+                return items
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def vector_ids(self, namespace: str, source: str) -> set:
+        """
+        Ids this kind and model wrote for a source, or every id written for it
+        by a manifest without a kind.
+        """
+        items = self._items(namespace, source, self._prefix() if self.kind else '')
+        return {item.get('id', item['vectorId']) for item in items}
+
+    def diff(self, namespace: str, source: str, chunks: list):
+        """
+        Returns (new_chunks, stale_ids): (vector id, chunk) pairs not in the
+        manifest yet, in document order and without repeats, and the ids in
+        the manifest that no chunk maps to anymore.
+        """
+        source_diff = self.diff_stream(namespace, source)
+        new_chunks = list(source_diff.new_chunks(chunks))
+        stale_ids = source_diff.stale_ids()
+        print(f'Manifest for {source} in {namespace}: {len(source_diff.current)} chunks, {source_diff.unchanged} unchanged, '
+              f'{len(new_chunks)} new, {len(stale_ids)} stale')
+        return new_chunks, stale_ids
+
+    def diff_stream(self, namespace: str, source: str) -> 'SourceDiff':
+        """
+        diff for chunks that arrive one at a time, see SourceDiff.
+        """
+        return SourceDiff(namespace, source, self.vector_ids(namespace, source), self.kind, self.model)
+
+    def add(self, namespace: str, source: str, ids: list):
+        source_key = self.source_key(namespace, source)
+        with self.table.batch_writer() as batch:
+            for id in ids:
+                batch.put_item(Item={
+                    'sourceKey': source_key,
+                    'vectorId': self._prefix() + id,
+                    'id': id,
+                    'kind': self.kind,
+                    'model': self.model,
+                    'namespace': namespace,
+                    'source': source,
+                })
+
+    def _delete_items(self, namespace: str, source: str, sort_keys: list):
+        source_key = self.source_key(namespace, source)
+        with self.table.batch_writer() as batch:
+            for sort_key in sort_keys:
+                batch.delete_item(Key={'sourceKey': source_key, 'vectorId': sort_key})
+
+    def remove(self, namespace: str, source: str, ids: list):
+        self._delete_items(namespace, source, [self._prefix() + id for id in ids])
+
+    def remove_vectors(self, pinecone, namespace: str, source: str, ids: list):
+        """
+        Delete ids from the index, then from the manifest, so a failed delete
+        is retried by the next ingest instead of leaving orphaned vectors.
+        """
+        pinecone.delete_ids(ids, namespace)
+        self.remove(namespace, source, ids)
+
+    def remove_source(self, namespace: str, source: str):
+        """
+        Delete every item of a source, whatever kind and model wrote it, once
+        its vectors are out of the index.
+        """
+        items = self._items(namespace, source)
+        self._delete_items(namespace, source, [item['vectorId'] for item in items] + [MIGRATED_MARKER])
+
+    def cleanup(self, pinecone, namespace: str, source: str, stale_ids: list) -> dict:
+        """
+        After the new vectors are upserted and added: delete the stale ids,
+        the vectors this kind wrote with other models and, once per source,
+        the pre-manifest vectors. Returns the number of vectors deleted by id
+        and whether the pre-manifest filter delete ran.
+        """
+        self.remove_vectors(pinecone, namespace, source, stale_ids)
+        other_models = [item for item in self._items(namespace, source, f'{self.kind}#') if item['model'] != self.model]
+        if other_models:
+            pinecone.delete_ids([item['id'] for item in other_models], namespace)
+            self._delete_items(namespace, source, [item['vectorId'] for item in other_models])
+            print(f'Deleted {len(other_models)} vectors of {source} in {namespace} embedded by other models than {self.model}')
+        legacy = False
+        if self.legacy_cleanup:
+            marker_key = {'sourceKey': self.source_key(namespace, source), 'vectorId': MIGRATED_MARKER}
+            if 'Item' not in self.table.get_item(Key=marker_key, ConsistentRead=True):
+                # only vectors written before the manifest lack the 'ingest' metadata
+                pinecone.delete(namespace, filter={'source': source, 'ingest': {'$exists': False}})
+                self.table.put_item(Item={**marker_key, 'namespace': namespace, 'source': source})
+                legacy = True
+                print(f'Deleted pre-manifest vectors of {source} in {namespace} by filter')
+        return {'deleted': len(stale_ids) + len(other_models), 'legacy': legacy}
+
+
+class SourceDiff:
+    """
+    Streaming form of SourceManifest.diff. new_chunks passes on the
+    (vector id, chunk) pairs not in the manifest yet as the chunks come in,
+    stale_ids is complete once every chunk has gone through it.
+    """
+
+    def __init__(self, namespace: str, source: str, existing: set, kind: str = '', model: str = ''):
+        self.namespace = namespace
+        self.source = source
+        self.existing = existing
+        self.kind = kind
+        self.model = model
+        self.current = set()
+        self.new_ids = []
+        self.unchanged = 0
+
+    def new_chunks(self, chunks):
+        for chunk in chunks:
+            id = chunk_vector_id(self.namespace, self.source, chunk, self.kind, self.model)
+            if id in self.current:
+                continue
+            self.current.add(id)
+            if id in self.existing:
+                self.unchanged += 1
+                continue
+            self.new_ids.append(id)
+            yield id, chunk
+
+    def stale_ids(self) -> list:
+        return sorted(self.existing - self.current)
@@ -0,0 +1,278 @@
+"""
+Streaming ingest: S3 object -> pages -> chunks -> embeddings -> pinecone.
+
+Each stage is a generator running in its own thread behind a bounded
+queue, so pages are chunked, embedded and upserted while later pages are
+still being read and extracted, and memory holds a few pages and batches
+rather than the whole document:
+
+    pages = pdf_pages(S3RangeFile(s3, bucket, key))
+    stats = ingest(pages, chunker, manifest, namespace, key, embedding_client, pinecone,
+                   lambda id, chunk: {'source': key, 'content': chunk})
+
+upsert_stream is the embedding and upsert half on its own, the MR lambdas
+feed it topics as their completions finish.
+"""
+import codecs
+import io
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from common.pdf_extract import PdfExtractor
+from common.pinecone_writer import PineconeWriter
+from common.tracing import in_current_trace
+
+# ranged GETs of 1MB, a handful of them cached for the reader's seeks back and forth
+RANGE_SIZE = 1024 * 1024
+RANGE_CACHE_BLOCKS = 8
+
+_DONE = object()
+
+
+class S3RangeFile(io.RawIOBase):
+    """
+    Seekable read-only file over an S3 object that fetches it in ranged GETs
+    of block_size bytes as they are read, keeping the last max_blocks of
+    them. PdfReader seeks to the trailer and then to each object it needs,
+    so a PDF is parsed without ever holding all of it.
+
+    Every GET is pinned to the object head_object saw (IfMatch on its ETag,
+    and VersionId in versioned buckets), so an object overwritten mid-read
+    fails the read instead of mixing blocks of two versions.
+
+    reopen() gives a forked PDF worker a reader of its own, with a client
+    from client_factory: a boto3 client's connections can't be shared
+    across a fork.
+    """
+
+    def __init__(self, s3, bucket: str, key: str, block_size: int = RANGE_SIZE, max_blocks: int = RANGE_CACHE_BLOCKS,
+                 client_factory=None, size: int = None, etag: str = None, version_id: str = None):
+        super().__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.client_factory = client_factory
+        if size is None:
+            head = s3.head_object(Bucket=bucket, Key=key)
+            size, etag, version_id = head['ContentLength'], head.get('ETag'), head.get('VersionId')
+        self.size = size
+        self.etag = etag
+        self.version_id = version_id
+        self.position = 0
+        self.requests = 0
+        self._blocks = OrderedDict()
+
+    def reopen(self) -> 'S3RangeFile':
+        s3 = self.client_factory() if self.client_factory is not None else self.s3
+        return S3RangeFile(s3, self.bucket, self.key, self.block_size, self.max_blocks, self.client_factory, self.size,
+                           self.etag, self.version_id)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self.position = max(0, self.position)
+        return self.position
+
+    def _block(self, index: int) -> bytes:
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+            return block
+        start = index * self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        pinned = {}
+        if self.etag:
+            pinned['IfMatch'] = self.etag
+        if self.version_id:
+            pinned['VersionId'] = self.version_id
+        response = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={start}-{end}', **pinned)
+        block = response['Body'].read()
+        self.requests += 1
+        if len(block) != end - start + 1:
+            raise IOError(f'Expected bytes {start}-{end} of s3://{self.bucket}/{self.key}, got {len(block)} bytes')
+        self._blocks[index] = block
+        if len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        count = 0
+        while count < len(view) and self.position < self.size:
+            index, offset = divmod(self.position, self.block_size)
+            data = self._block(index)[offset:offset + len(view) - count]
+            view[count:count + len(data)] = data
+            count += len(data)
+            self.position += len(data)
+        return count
+
+
+def s3_text(s3, bucket: str, key: str, piece_size: int = RANGE_SIZE, encoding: str = 'utf-8'):
+    """
+    Yield the text of an S3 object in pieces of about piece_size bytes,
+    streamed from a single GET and decoded as it arrives.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    for data in body.iter_chunks(piece_size):
+        text = decoder.decode(data)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def pdf_pages(stream, extractor: PdfExtractor = None):
+    """
+    Yield the extracted text of each page of the PDF in stream, by default
+    with pypdf in this process.
+    """
+    extractor = extractor or PdfExtractor('pypdf', workers=1)
+    yield from extractor.texts(stream)
+
+
+def stage(items, maxsize: int = 4):
+    """
+    Run the generator items in a thread of its own, handing its items over
+    through a queue of maxsize. Errors in the thread are raised in the
+    consumer, and a consumer that stops early stops the thread.
+    """
+    handoff = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                handoff.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            put((_DONE, e))
+
+    thread = threading.Thread(target=in_current_trace(run), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = handoff.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def batched(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_batches(batches, embedding_client, max_in_flight: int = 4):
+    """
+    Yield (batch, vectors) in order, with up to max_in_flight batches being
+    embedded at once.
+    """
+    embed = in_current_trace(lambda batch: embedding_client.embed_many([chunk for _, chunk in batch]))
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for batch in batches:
+            pending.append((batch, executor.submit(embed, batch)))
+            if len(pending) == max_in_flight:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+
+def upsert_stream(records, namespace: str, embedding_client, pinecone, metadata, embed_batch_size: int = 64,
+                  embed_concurrency: int = 4, queue_size: int = 4) -> dict:
+    """
+    Embed and upsert (id, text) records as they come, in batches of
+    embed_batch_size with up to embed_concurrency of them being embedded at
+    a time, each upserted with metadata(id, text). Returns the
+    PineconeWriter stats.
+    """
+    embedded = stage(embed_batches(batched(records, embed_batch_size), embedding_client, embed_concurrency),
+                     queue_size)
+    with PineconeWriter(namespace, client=pinecone) as writer:
+        for batch, vectors in embedded:
+            for (id, text), vector in zip(batch, vectors):
+                writer.add(id, vector.tolist(), metadata(id, text))
+    return writer.stats
+
+
+def ingest(pieces, chunker, manifest, namespace: str, source: str, embedding_client, pinecone, metadata,
+           embed_batch_size: int = 64, embed_concurrency: int = 4, queue_size: int = 4) -> dict:
+    """
+    Chunk the text pieces (pages, pieces of a text or one str), embed the
+    chunks not in the manifest yet and upsert them with metadata(id, chunk),
+    then record them in the manifest and delete the source's stale vectors
+    (SourceManifest.cleanup). Chunks are embedded in batches of
+    embed_batch_size, up to embed_concurrency of them at a time. Returns
+    counts of chunks, new, unchanged, stale and deleted vectors, whether the
+    pre-manifest vectors were deleted, the seconds taken and the
+    PineconeWriter stats.
+    """
+    start = time.time()
+    if isinstance(pieces, str):
+        pieces = (pieces,)
+    source_diff = manifest.diff_stream(namespace, source)
+    pages = stage(pieces, queue_size)
+    new_chunks = stage(source_diff.new_chunks(chunker.chunks(pages)), embed_batch_size)
+    upsert_stats = upsert_stream(new_chunks, namespace, embedding_client, pinecone, metadata,
+                                 embed_batch_size, embed_concurrency, queue_size)
+    manifest.add(namespace, source, source_diff.new_ids)
+    stale_ids = source_diff.stale_ids()
+    # drop chunks that are no longer in the document, now that their replacements are in
+    removed = manifest.cleanup(pinecone, namespace, source, stale_ids)
+    stats = {
+        'chunks': len(source_diff.current),
+        'new': len(source_diff.new_ids),
+        'unchanged': source_diff.unchanged,
+        'stale': len(stale_ids),
+        'deleted': removed['deleted'],
+        'legacy': removed['legacy'],
+        'seconds': time.time() - start,
+        'upsert': upsert_stats,
+    }
+    print(f"Ingested {source} into {namespace}: {stats['chunks']} chunks, {stats['unchanged']} unchanged, "
+          f"{stats['new']} new, {stats['stale']} stale in {stats['seconds']:.2f}s")
+    return stats
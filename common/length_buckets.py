@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def token_counts(tokenizer, texts: list) -> list:
+    """
+    Number of model tokens in each text, special tokens included and
+    before any truncation.
+    """
+    if not texts:
+        return []
+    input_ids = tokenizer(texts, add_special_tokens=True, truncation=False, verbose=False)['input_ids']
+    return [len(ids) for ids in input_ids]
+
+
+def encode_length_bucketed(model, texts: list, batch_size: int, counts: list = None) -> np.ndarray:
+    """
+    Encode texts in buckets of batch_size texts of similar token length so
+    short texts are not padded up to the longest text in the request.
+    Vectors are returned in input order.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    if counts is None:
+        counts = token_counts(model.tokenizer, texts)
+    order = sorted(range(len(texts)), key=counts.__getitem__)
+    vectors = [None] * len(texts)
+    for start in range(0, len(order), batch_size):
+        bucket = order[start:start+batch_size]
+        encoded = model.encode([texts[i] for i in bucket], batch_size=len(bucket))
+        for i, vector in zip(bucket, encoded):
+            vectors[i] = vector
+    return np.stack(vectors)
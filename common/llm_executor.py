@@ -0,0 +1,230 @@
+"""
+Chat completions for many prompts at once, within the account's rate limits.
+
+One aiohttp session is shared by every request of a run, at most
+max_in_flight requests are open at a time, and token buckets keep the
+requests and tokens sent per minute under the account's limits. 429s, 5xx
+and connection errors are retried with jittered backoff, waiting at least
+as long as the response's Retry-After. Each prompt gets its own result, so
+one failed completion doesn't lose the others:
+
+    llm = LLMExecutor(os.environ['OPENAI_API_KEY'])
+    for result in llm.complete_all(prompts, "gpt-3.5-turbo", 250):
+        if result['error'] is None:
+            print(result['message']['content'])
+"""
+import asyncio
+import queue
+import random
+import threading
+import time
+
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def estimate_tokens(text: str) -> int:
+    # about 4 characters per token for English, good enough to pace requests
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_minute, holding up to capacity (a minute's worth by
+    default). acquire waits until amount is available and takes it. clock
+    and sleep are the time source and the coroutine acquire waits with.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None, clock=time.monotonic, sleep=asyncio.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        # no await between the check and the take, so this is atomic on the event loop
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await self.sleep((amount - self.tokens) / self.rate)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def retry_after(headers) -> float:
+    """
+    Seconds the response asks to wait, from retry-after-ms or Retry-After.
+    """
+    for name, scale in (('retry-after-ms', 1000.0), ('Retry-After', 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return float(value) / scale
+        except ValueError:
+            continue
+    return 0.0
+
+
+class LLMExecutor:
+    """
+    Runs chat completions against url with bounded concurrency, rate
+    limiting and retries. The token buckets live on the executor, so a warm
+    container keeps pacing across invocations. session_factory(headers)
+    returns the session to post with (an aiohttp.ClientSession by default),
+    sleep is the coroutine retries and the buckets wait with.
+    """
+
+    def __init__(self, api_key: str, url: str = OPENAI_URL, max_in_flight: int = 8, requests_per_minute: int = 3500,
+                 tokens_per_minute: int = 90000, max_retries: int = 5, timeout: float = 60.0, count_tokens=estimate_tokens,
+                 session_factory=None, sleep=asyncio.sleep):
+        self.api_key = api_key
+        self.url = url
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.count_tokens = count_tokens
+        self.session_factory = session_factory or self._session
+        self.sleep = sleep
+        self.request_bucket = TokenBucket(requests_per_minute, sleep=sleep)
+        self.token_bucket = TokenBucket(tokens_per_minute, sleep=sleep)
+
+    def _session(self, headers: dict):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+        return aiohttp.ClientSession(headers=headers, connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def _complete(self, session, semaphore, messages: list, model: str, max_tokens: int, temperature: float) -> dict:
+        import aiohttp
+
+        # the token limit counts the prompt and max_tokens up front, the unused part is refunded
+        estimate = sum(self.count_tokens(message['content']) for message in messages) + max_tokens
+        data = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+        start = time.time()
+        error = None
+        for attempt in range(self.max_retries + 1):
+            wait = 0.0
+            try:
+                async with semaphore:
+                    await self.request_bucket.acquire(1)
+                    await self.token_bucket.acquire(estimate)
+                    async with session.post(self.url, json=data) as resp:
+                        if resp.status == 200:
+                            result = await resp.json()
+                            used = result.get('usage', {}).get('total_tokens')
+                            if used is not None and used < estimate:
+                                self.token_bucket.refund(estimate - used)
+                            return {'message': result['choices'][0]['message'], 'error': None,
+                                    'attempts': attempt + 1, 'seconds': time.time() - start}
+                        body = await resp.text()
+                        error = f"OpenAI Completion failed with status {resp.status}: {body[:500]}"
+                        if resp.status not in RETRY_STATUS_CODES:
+                            break
+                        wait = retry_after(resp.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"OpenAI Completion failed: {type(e).__name__}: {e}"
+            except (KeyError, IndexError, ValueError) as e:
+                # a 200 without a completion in it, retrying won't change that
+                error = f"OpenAI Completion failed: unexpected response, {type(e).__name__}: {e}"
+                break
+            if attempt < self.max_retries:
+                delay = max(wait, random.uniform(0, min(30.0, 2 ** attempt)))
+                print(f"Retrying completion in {delay:.2f}s after attempt {attempt + 1}: {error[:200]}")
+                await self.sleep(delay)
+        return {'message': None, 'error': error, 'attempts': attempt + 1, 'seconds': time.time() - start}
+
+    async def completions(self, prompts: list, model: str, max_tokens: int = 500, temperature: float = 0.0):
+        """
+        Async iterator of (index, result) in the order the completions
+        finish, prompts being lists of chat messages. A result is
+        {'message', 'error', 'attempts', 'seconds'} with exactly one of
+        message and error set.
+        """
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        async with self.session_factory(headers) as session:
+            async def indexed(index, messages):
+                return index, await self._complete(session, semaphore, messages, model, max_tokens, temperature)
+
+            tasks = [asyncio.ensure_future(indexed(index, messages)) for index, messages in enumerate(prompts)]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield await task
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    def as_completed(self, prompts: list, model: str, max_tokens: int = 500, temperature: float = 0.0):
+        """
+        Yield (index, result) as each completion finishes, for callers that
+        aren't async. The event loop runs on a thread of its own, stopping
+        early cancels the completions still in flight.
+        """
+        if not prompts:
+            return
+        finished = queue.Queue()
+        stopped = threading.Event()
+
+        async def run():
+            async for item in self.completions(prompts, model, max_tokens, temperature):
+                finished.put(item)
+                if stopped.is_set():
+                    break
+
+        def loop():
+            try:
+                asyncio.run(run())
+                finished.put((None, None))
+            except BaseException as e:
+                finished.put((None, e))
+
+        start = time.time()
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        failed = 0
+        retries = 0
+        try:
+            while True:
+                index, result = finished.get()
+                if index is None:
+                    if result is not None:
+                        raise result
+                    break
+                failed += result['error'] is not None
+                retries += result['attempts'] - 1
+                yield index, result
+        finally:
+            stopped.set()
+        print(f"Completed {len(prompts) - failed} of {len(prompts)} prompts in {time.time()-start:.2f}s, "
+              f"{retries} retries, {failed} failed")
+
+    def complete_all(self, prompts: list, model: str, max_tokens: int = 500, temperature: float = 0.0) -> list:
+        """
+        The results of every prompt, in prompt order.
+        """
+        results = [None] * len(prompts)
+        for index, result in self.as_completed(prompts, model, max_tokens, temperature):
+            results[index] = result
+        return results
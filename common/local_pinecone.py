@@ -0,0 +1,310 @@
+"""
+Local stand-in for the subset of the Pinecone REST API this repo uses, for
+load tests and benchmarks that must not touch the real index.
+
+    python -m common.local_pinecone --port 8100 --dim 768
+    PINECONE_URL=http://127.0.0.1:8100 PINECONE_KEY=local ...
+
+Implements POST /vectors/upsert, POST /query (vector, topK, namespace,
+filter, includeValues, includeMetadata), GET /vectors/fetch (ids,
+namespace), POST /vectors/delete (ids, filter or deleteAll) and
+GET /describe_index_stats. Each namespace is a NumPy
+matrix and queries are an exact top-k over it, so results are the ground
+truth an approximate index is measured against.
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+METRICS = ('cosine', 'dotproduct', 'euclidean')
+
+
+def _compare(value, op: str, operand) -> bool:
+    if op == '$eq':
+        return value == operand or (isinstance(value, list) and operand in value)
+    if op == '$ne':
+        return not _compare(value, '$eq', operand)
+    if op == '$in':
+        if isinstance(value, list):
+            return any(item in operand for item in value)
+        return value in operand
+    if op == '$nin':
+        return not _compare(value, '$in', operand)
+    if value is None or isinstance(value, (list, str, bool)):
+        return False
+    if op == '$gt':
+        return value > operand
+    if op == '$gte':
+        return value >= operand
+    if op == '$lt':
+        return value < operand
+    if op == '$lte':
+        return value <= operand
+    raise ValueError(f'Unsupported filter operator {op}')
+
+
+def matches_filter(metadata: dict, filter: dict) -> bool:
+    """
+    Pinecone metadata filter semantics: bare values mean $eq, list metadata
+    matches when any element does, and top level keys are and-ed.
+    """
+    for key, condition in filter.items():
+        if key == '$and':
+            if not all(matches_filter(metadata, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_filter(metadata, clause) for clause in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for op, operand in condition.items():
+                if op == '$exists':
+                    if (value is not None) != bool(operand):
+                        return False
+                    continue
+                if value is None and op not in ('$ne', '$nin'):
+                    return False
+                if not _compare(value, op, operand):
+                    return False
+    return True
+
+
+class Namespace:
+    """
+    Vectors of one namespace as rows of a float32 matrix that grows by
+    doubling. Deletes move the last row into the hole.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.matrix = np.zeros((64, dim), dtype=np.float32)
+        self.ids = []
+        self.metadata = []
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, id: str, values: np.ndarray, metadata: dict):
+        row = self.rows.get(id)
+        if row is None:
+            row = len(self.ids)
+            if row == len(self.matrix):
+                self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+            self.rows[id] = row
+            self.ids.append(id)
+            self.metadata.append(metadata)
+        else:
+            self.metadata[row] = metadata
+        self.matrix[row] = values
+
+    def delete(self, id: str):
+        row = self.rows.pop(id, None)
+        if row is None:
+            return
+        last = len(self.ids) - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.ids[row] = self.ids[last]
+            self.metadata[row] = self.metadata[last]
+            self.rows[self.ids[row]] = row
+        self.ids.pop()
+        self.metadata.pop()
+
+    def filtered_rows(self, filter: dict) -> np.ndarray:
+        return np.array([row for row, metadata in enumerate(self.metadata) if matches_filter(metadata, filter)],
+                        dtype=np.int64)
+
+
+class LocalPinecone:
+    """
+    In-process fake index with the same request and response shapes as the
+    REST API, usable directly or behind serve().
+    """
+
+    def __init__(self, dim: int = None, metric: str = 'cosine'):
+        if metric not in METRICS:
+            raise ValueError(f'metric must be one of {METRICS}')
+        self.dim = dim
+        self.metric = metric
+        self.namespaces = {}
+        self._lock = threading.Lock()
+
+    def _vector(self, values) -> np.ndarray:
+        vector = np.asarray(values, dtype=np.float32)
+        if self.dim is None:
+            self.dim = len(vector)
+        if vector.shape != (self.dim,):
+            raise ValueError(f'Vector dimension {len(vector)} does not match the index dimension {self.dim}')
+        return vector
+
+    def upsert(self, body: dict) -> dict:
+        namespace_name = body.get('namespace', '')
+        vectors = [(record['id'], self._vector(record['values']), record.get('metadata') or {})
+                   for record in body['vectors']]
+        if not vectors:
+            return {'upsertedCount': 0}
+        with self._lock:
+            namespace = self.namespaces.get(namespace_name)
+            if namespace is None:
+                namespace = self.namespaces[namespace_name] = Namespace(self.dim)
+            for id, values, metadata in vectors:
+                namespace.upsert(id, values, metadata)
+        return {'upsertedCount': len(vectors)}
+
+    def _scores(self, matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
+        if self.metric == 'dotproduct':
+            return matrix @ vector
+        if self.metric == 'euclidean':
+            # pinecone reports squared distance, smaller is closer
+            return -((matrix - vector) ** 2).sum(axis=1)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+        return (matrix @ vector) / np.where(norms == 0, 1, norms)
+
+    def query(self, body: dict) -> dict:
+        namespace_name = body.get('namespace', '')
+        vector = self._vector(body['vector'])
+        top_k = int(body['topK'])
+        with self._lock:
+            namespace = self.namespaces.get(namespace_name)
+            if namespace is None or not len(namespace):
+                return {'matches': [], 'namespace': namespace_name}
+            rows = np.arange(len(namespace)) if not body.get('filter') else namespace.filtered_rows(body['filter'])
+            scores = self._scores(namespace.matrix[rows], vector)
+            if top_k < len(rows):
+                best = np.argpartition(-scores, top_k)[:top_k]
+            else:
+                best = np.arange(len(rows))
+            best = best[np.argsort(-scores[best], kind='stable')]
+            matches = []
+            for index in best:
+                row = rows[index]
+                score = float(scores[index])
+                match = {'id': namespace.ids[row], 'score': -score if self.metric == 'euclidean' else score}
+                if body.get('includeValues'):
+                    match['values'] = namespace.matrix[row].tolist()
+                if body.get('includeMetadata'):
+                    match['metadata'] = dict(namespace.metadata[row])
+                matches.append(match)
+        return {'matches': matches, 'namespace': namespace_name}
+
+    def fetch(self, ids: list, namespace_name: str = '') -> dict:
+        vectors = {}
+        with self._lock:
+            namespace = self.namespaces.get(namespace_name)
+            rows = namespace.rows if namespace is not None else {}
+            for id in ids:
+                row = rows.get(id)
+                if row is not None:
+                    vectors[id] = {'id': id, 'values': namespace.matrix[row].tolist(),
+                                   'metadata': dict(namespace.metadata[row])}
+        return {'vectors': vectors, 'namespace': namespace_name}
+
+    def delete(self, body: dict) -> dict:
+        namespace_name = body.get('namespace', '')
+        with self._lock:
+            namespace = self.namespaces.get(namespace_name)
+            if namespace is None:
+                return {}
+            if body.get('deleteAll'):
+                del self.namespaces[namespace_name]
+                return {}
+            ids = list(body.get('ids') or [])
+            if body.get('filter'):
+                ids.extend(namespace.ids[row] for row in namespace.filtered_rows(body['filter']))
+            for id in ids:
+                namespace.delete(id)
+        return {}
+
+    def describe_index_stats(self) -> dict:
+        with self._lock:
+            namespaces = {name: {'vectorCount': len(namespace)} for name, namespace in self.namespaces.items()}
+        return {
+            'dimension': self.dim,
+            'namespaces': namespaces,
+            'totalVectorCount': sum(namespace['vectorCount'] for namespace in namespaces.values()),
+        }
+
+
+def make_handler(index: LocalPinecone):
+    routes = {
+        '/vectors/upsert': index.upsert,
+        '/query': index.query,
+        '/vectors/delete': index.delete,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, so the clients' connection pools behave like against the real index
+        protocol_version = 'HTTP/1.1'
+        # headers and body go out in separate writes, don't let them wait on delayed acks
+        disable_nagle_algorithm = True
+
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/describe_index_stats':
+                self._reply(200, index.describe_index_stats())
+            elif url.path == '/vectors/fetch':
+                params = parse_qs(url.query)
+                self._reply(200, index.fetch(params.get('ids', []), params.get('namespace', [''])[0]))
+            else:
+                self._reply(404, {'message': f'Unknown path {self.path}'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            route = routes.get(self.path.split('?')[0])
+            if route is None:
+                self._reply(404, {'message': f'Unknown path {self.path}'})
+                return
+            try:
+                self._reply(200, route(body))
+            except (KeyError, ValueError, TypeError) as e:
+                self._reply(400, {'message': str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(index: LocalPinecone = None, host: str = '127.0.0.1', port: int = 0):
+    """
+    Start the HTTP server on a daemon thread, returns (server, url). Port 0
+    picks a free port.
+    """
+    index = index or LocalPinecone()
+    server = ThreadingHTTPServer((host, port), make_handler(index))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--dim', type=int, default=None)
+    parser.add_argument('--metric', default='cosine', choices=METRICS)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(LocalPinecone(args.dim, args.metric)))
+    server.daemon_threads = True
+    print(f'Local pinecone listening on http://{args.host}:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import numpy as np
+
+from common.vector_codec import l2_normalize
+
+
+def mmr_select(scores, vectors, k: int, lambda_param: float = 0.5) -> np.ndarray:
+    """
+    Indices of the k candidates picked by maximal marginal relevance, in pick
+    order. Each pick maximizes
+
+        lambda_param * score - (1 - lambda_param) * max cosine to the picks so far
+
+    The candidate matrix is normalized once and a running max-similarity
+    vector is updated with one matrix-vector product per pick, so the cost is
+    O(k * n * d) instead of re-scoring every pair on every iteration.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    unit = l2_normalize(vectors)
+    relevance = lambda_param * scores
+    # nothing picked yet, so the diversity penalty starts at zero
+    max_sim = np.zeros(len(scores), dtype=np.float32)
+    available = np.ones(len(scores), dtype=bool)
+    picks = np.empty(k, dtype=np.int64)
+    for i in range(k):
+        mmr = np.where(available, relevance - (1 - lambda_param) * max_sim, -np.inf)
+        best = int(np.argmax(mmr))
+        picks[i] = best
+        available[best] = False
+        sims = unit @ unit[best]
+        max_sim = sims if i == 0 else np.maximum(max_sim, sims)
+    return picks
+
+
+def max_marginal_relevance(matches: list, final_set_size: int, lambda_param: float = 0.5, vectors=None) -> list:
+    """
+    Rerank pinecone matches and keep the first final_set_size. vectors is a
+    (len(matches), dim) matrix and defaults to each match's 'values'.
+    """
+    if not matches:
+        return []
+    if vectors is None:
+        vectors = np.array([match['values'] for match in matches], dtype=np.float32)
+    picks = mmr_select([match['score'] for match in matches], vectors, final_set_size, lambda_param)
+    return [matches[i] for i in picks]
@@ -0,0 +1,84 @@
+import glob
+import json
+import os
+import sys
+import time
+
+# Lambda images are read-only outside of /tmp
+WRITABLE_CACHE_DIRS = {
+    'XDG_CACHE_HOME': '/tmp/.cache/',
+    'HF_HOME': '/tmp/.cache/huggingface/',
+    'TRANSFORMERS_CACHE': '/tmp/.cache/huggingface/',
+    'HF_DATASETS_CACHE': '/tmp/.cache/huggingface/',
+}
+
+OFFLINE_FLAGS = {
+    'HF_HUB_OFFLINE': '1',
+    'TRANSFORMERS_OFFLINE': '1',
+    'HF_DATASETS_OFFLINE': '1',
+}
+
+
+def bake_model(model_name: str, target_dir: str):
+    """
+    Download model_name and save it to target_dir as safetensors. Run at
+    image build time so the lambda never fetches weights on a cold start.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device='cpu')
+    model.save(target_dir, safe_serialization=True)
+    if not glob.glob(os.path.join(target_dir, '**', '*.safetensors'), recursive=True):
+        raise Exception(f"No safetensors weights were written to {target_dir} for {model_name}")
+    print(f"Saved {model_name} to {target_dir}")
+
+
+def load_encoder(model_name: str, model_dir: str = '', backend: str = 'torch', warmup_text: str = 'warmup',
+                 quantized: bool = True, threads: int = 0):
+    """
+    Load the model baked into model_dir with network access disabled, and
+    log how long the import, the weight load and a first encode took.
+
+    backend 'torch' loads a SentenceTransformer and falls back to
+    downloading model_name into /tmp when the image has no baked weights.
+    backend 'onnx' loads the OnnxSentenceEncoder exported at build time,
+    int8 quantized unless quantized is False, on threads intra-op threads.
+
+    Returns (model, timings)
+    """
+    os.environ.update(WRITABLE_CACHE_DIRS)
+    baked = bool(model_dir) and os.path.isdir(model_dir)
+    if baked:
+        os.environ.update(OFFLINE_FLAGS)
+    elif backend == 'onnx':
+        raise Exception(f"The onnx backend needs weights baked into '{model_dir}'")
+    else:
+        print(f"WARNING: no baked weights at '{model_dir}', downloading {model_name} on cold start")
+
+    timings = {'model': model_name, 'backend': backend, 'baked': baked}
+    start = time.time()
+    if backend == 'onnx':
+        from common.onnx_encoder import OnnxSentenceEncoder
+    else:
+        from sentence_transformers import SentenceTransformer
+    timings['import_ms'] = (time.time() - start) * 1000
+
+    start = time.time()
+    if backend == 'onnx':
+        model = OnnxSentenceEncoder(model_dir, quantized=quantized, threads=threads)
+    else:
+        # safetensors weights are memory-mapped from the read-only image layer
+        model = SentenceTransformer(model_dir if baked else model_name, device='cpu')
+    timings['load_ms'] = (time.time() - start) * 1000
+
+    start = time.time()
+    model.encode([warmup_text])
+    timings['warmup_ms'] = (time.time() - start) * 1000
+
+    print(f"Model startup timings: {json.dumps(timings)}")
+    return model, timings
+
+
+if __name__ == '__main__':
+    # python -m common.model_loading <model name> <target dir>
+    bake_model(sys.argv[1], sys.argv[2])
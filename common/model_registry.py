@@ -0,0 +1,179 @@
+"""
+Several named embedding models in one container.
+
+The models come from EMBEDDING_MODELS, a JSON object of registry name to
+spec, e.g.
+
+    {"mpnet": {"model": "sentence-transformers/all-mpnet-base-v2"},
+     "instructor": {"model": "hkunlp/instructor-base", "instruction": "Represent the document",
+                    "backend": "onnx"}}
+
+Each spec may also set "dir", the path its weights are baked into
+(default /opt/models/<name>). Without EMBEDDING_MODELS the registry holds
+a single model named "default" built from EMBEDDING_MODEL,
+EMBEDDING_MODEL_DIR and INSTRUCTION, as the single-model images did.
+
+At build time `python -m common.model_registry` bakes every model.
+"""
+import gc
+import glob
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from common.model_loading import bake_model, load_encoder
+
+MODELS_ROOT = '/opt/models'
+
+
+class ModelSpec:
+    def __init__(self, name: str, model: str, dir: str = '', instruction: str = '', backend: str = ''):
+        self.name = name
+        self.model = model
+        self.dir = dir or os.path.join(MODELS_ROOT, name)
+        self.instruction = instruction
+        self.backend = backend or os.environ.get('EMBEDDING_BACKEND', 'torch')
+        self.quantized = self.backend == 'onnx' and os.environ.get('EMBEDDING_ONNX_QUANTIZED', 'true').lower() == 'true'
+
+    def cache_name(self) -> str:
+        """
+        Names the vectors this spec produces, for embedding cache keys: the
+        same model on another backend or quantized gives different vectors.
+        """
+        return f"{self.model}|{self.backend}{'|int8' if self.quantized else ''}"
+
+    def weight_bytes(self) -> int:
+        """
+        Size of the baked weights the backend loads, 0 if nothing is baked.
+        """
+        if self.backend == 'onnx':
+            from common.onnx_encoder import FP32_FILE, INT8_FILE, ONNX_SUBDIR
+            files = [os.path.join(self.dir, ONNX_SUBDIR, INT8_FILE if self.quantized else FP32_FILE)]
+        else:
+            files = glob.glob(os.path.join(self.dir, '**', '*.safetensors'), recursive=True)
+        return sum(os.path.getsize(path) for path in files if os.path.exists(path))
+
+
+def specs_from_environ() -> OrderedDict:
+    specs = OrderedDict()
+    if os.environ.get('EMBEDDING_MODELS'):
+        for name, spec in json.loads(os.environ['EMBEDDING_MODELS']).items():
+            specs[name] = ModelSpec(name, **spec)
+    else:
+        specs['default'] = ModelSpec('default', os.environ['EMBEDDING_MODEL'],
+                                     dir=os.environ.get('EMBEDDING_MODEL_DIR', ''),
+                                     instruction=os.environ.get('INSTRUCTION', ''))
+    return specs
+
+
+class ModelRegistry:
+    """
+    Loads models on first use and unloads the least recently used ones once
+    the loaded weights would exceed max_bytes. The model in use is never
+    unloaded, so a single model larger than the cap still loads. Loads run
+    outside the registry lock, so a cold model doesn't hold up requests for
+    loaded ones, and concurrent requests for the same cold model wait for
+    one load.
+    """
+
+    def __init__(self, specs: OrderedDict, default: str = '', max_bytes: int = 0, threads: int = 0):
+        self.specs = specs
+        self.default = default or next(iter(specs))
+        self.max_bytes = max_bytes
+        self.threads = threads
+        self.startup_timings = {}
+        self._loaded = OrderedDict()
+        self._sizes = {}
+        # name -> Event set when its load finishes
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def spec(self, name: str = None) -> ModelSpec:
+        name = name or self.default
+        if name not in self.specs:
+            raise KeyError(f"Unknown embedding model: {name}, expected one of {list(self.specs)}")
+        return self.specs[name]
+
+    def get(self, name: str = None):
+        """
+        Returns (model, spec), loading the model if needed.
+        """
+        spec = self.spec(name)
+        while True:
+            with self._lock:
+                if spec.name in self._loaded:
+                    self._loaded.move_to_end(spec.name)
+                    return self._loaded[spec.name], spec
+                loading = self._loading.get(spec.name)
+                if loading is None:
+                    loading = self._loading[spec.name] = threading.Event()
+                    break
+            # another thread is loading it, if that load failed the next pass tries again
+            loading.wait()
+
+        try:
+            size = spec.weight_bytes()
+            with self._lock:
+                self._evict(size)
+            model, timings = load_encoder(spec.model, spec.dir, spec.backend, quantized=spec.quantized,
+                                          threads=self.threads)
+            if not size and hasattr(model, 'parameters'):
+                size = sum(p.numel() * p.element_size() for p in model.parameters())
+            with self._lock:
+                # other models may have loaded meanwhile
+                self._evict(size)
+                self._loaded[spec.name] = model
+                self._sizes[spec.name] = size
+                self.startup_timings[spec.name] = timings
+            return model, spec
+        finally:
+            with self._lock:
+                self._loading.pop(spec.name)
+            loading.set()
+
+    def _evict(self, incoming_bytes: int):
+        if not self.max_bytes:
+            return
+        evicted = False
+        while self._loaded and sum(self._sizes.values()) + incoming_bytes > self.max_bytes:
+            name, _ = self._loaded.popitem(last=False)
+            self._sizes.pop(name)
+            evicted = True
+            print(f"Unloading embedding model {name} to stay under {self.max_bytes} bytes")
+        if evicted:
+            gc.collect()
+
+    def loaded(self) -> list:
+        with self._lock:
+            return list(self._loaded)
+
+    def after_fork(self, threads: int):
+        """
+        Give each forked worker its share of the cores. onnxruntime thread
+        pools do not survive os.fork, so loaded onnx sessions are rebuilt.
+        """
+        self.threads = threads
+        with self._lock:
+            for model in self._loaded.values():
+                if hasattr(model, 'after_fork'):
+                    model.after_fork(threads)
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+
+
+def bake_all(specs: OrderedDict):
+    for spec in specs.values():
+        bake_model(spec.model, spec.dir)
+        if spec.backend == 'onnx':
+            from common.onnx_encoder import ACCURACY_TEXTS, check_accuracy, export_onnx
+            export_onnx(spec.dir)
+            check_accuracy(spec.dir, ACCURACY_TEXTS, quantized=False)
+            check_accuracy(spec.dir, ACCURACY_TEXTS, quantized=True)
+
+
+if __name__ == '__main__':
+    bake_all(specs_from_environ())
@@ -0,0 +1,24 @@
+class NamespaceVersions:
+    """
+    Per-namespace content version in a DynamoDB table (partition key
+    namespace, number attribute version). Every lambda that writes to or
+    deletes from a namespace bumps it, and retrieval results are cached
+    under the version they were computed at, so a result is never served
+    after the namespace changed.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, namespace: str) -> int:
+        item = self.table.get_item(Key={'namespace': namespace}, ConsistentRead=True).get('Item')
+        return int(item['version']) if item else 0
+
+    def bump(self, namespace: str) -> int:
+        response = self.table.update_item(
+            Key={'namespace': namespace},
+            UpdateExpression='ADD version :one',
+            ExpressionAttributeValues={':one': 1},
+            ReturnValues='UPDATED_NEW',
+        )
+        return int(response['Attributes']['version'])
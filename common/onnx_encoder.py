@@ -0,0 +1,200 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+ONNX_SUBDIR = 'onnx'
+FP32_FILE = 'model.onnx'
+INT8_FILE = 'model_int8.onnx'
+# minimum per-vector cosine between the onnx and pytorch embeddings
+MIN_COSINE = 0.99
+
+
+def _sentence_transformer_config(model_dir: str):
+    """
+    Read the pooling mode, normalization and max sequence length of a model
+    saved with SentenceTransformer.save.
+    """
+    with open(os.path.join(model_dir, 'modules.json')) as f:
+        modules = json.load(f)
+    pooling_mode = 'mean'
+    normalize = False
+    for module in modules[1:]:
+        module_type = module['type'].rsplit('.', 1)[-1]
+        if module_type == 'Pooling':
+            with open(os.path.join(model_dir, module['path'], 'config.json')) as f:
+                pooling = json.load(f)
+            if pooling.get('pooling_mode_cls_token'):
+                pooling_mode = 'cls'
+            elif pooling.get('pooling_mode_max_tokens'):
+                pooling_mode = 'max'
+        elif module_type == 'Normalize':
+            normalize = True
+        else:
+            raise Exception(f"Module {module['type']} is not supported by the onnx backend")
+    max_seq_length = None
+    config_path = os.path.join(model_dir, 'sentence_bert_config.json')
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            max_seq_length = json.load(f).get('max_seq_length')
+    return pooling_mode, normalize, max_seq_length
+
+
+def export_onnx(model_dir: str, quantize: bool = True, opset: int = 14):
+    """
+    Export the transformer of the SentenceTransformer saved in model_dir to
+    <model_dir>/onnx/model.onnx, plus a dynamic int8 quantized copy. Pooling
+    and normalization are done in numpy by OnnxSentenceEncoder.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_dir, device='cpu')
+    transformer = model[0].auto_model.eval()
+    sample = model.tokenizer(['onnx export sample'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, *inputs):
+            return self.inner(*inputs, return_dict=False)[0]
+
+    onnx_dir = os.path.join(model_dir, ONNX_SUBDIR)
+    os.makedirs(onnx_dir, exist_ok=True)
+    fp32_path = os.path.join(onnx_dir, FP32_FILE)
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenStates(transformer),
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    print(f"Exported {model_dir} to {fp32_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(onnx_dir, INT8_FILE)
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"Quantized {fp32_path} to {int8_path}")
+    return onnx_dir
+
+
+def default_thread_count() -> int:
+    # cpu_count reports the host, the affinity mask reports the lambda's vCPUs
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class OnnxSentenceEncoder:
+    """
+    onnxruntime replacement for SentenceTransformer.encode on models exported
+    with export_onnx.
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = True, threads: int = 0):
+        from transformers import AutoTokenizer
+
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.pooling_mode, self.normalize, self.max_seq_length = _sentence_transformer_config(model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        if self.max_seq_length is None:
+            self.max_seq_length = self.tokenizer.model_max_length
+
+        self._create_session(threads)
+
+    def _create_session(self, threads: int):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads or default_thread_count()
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        path = os.path.join(self.model_dir, ONNX_SUBDIR, INT8_FILE if self.quantized else FP32_FILE)
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def after_fork(self, threads: int):
+        """
+        onnxruntime thread pools do not survive os.fork, forked workers
+        rebuild the session with their share of the cores.
+        """
+        self._create_session(threads)
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        mask = attention_mask[..., None].astype(np.float32)
+        if self.pooling_mode == 'cls':
+            return hidden[:, 0]
+        if self.pooling_mode == 'max':
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        embeddings = []
+        for i in range(0, len(sentences), batch_size):
+            tokens = self.tokenizer(sentences[i:i+batch_size], padding=True, truncation=True,
+                                    max_length=self.max_seq_length, return_tensors='np')
+            feed = {name: tokens[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            embeddings.append(self._pool(hidden, tokens['attention_mask']))
+        vectors = np.concatenate(embeddings).astype(np.float32) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        if self.normalize:
+            vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors[0] if single else vectors
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """
+    Row-wise cosine similarity between two (count, dim) matrices.
+    """
+    reference = reference / np.clip(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12, None)
+    candidate = candidate / np.clip(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12, None)
+    return (reference * candidate).sum(axis=1)
+
+
+def check_accuracy(model_dir: str, texts: list, quantized: bool = True) -> float:
+    """
+    Encode texts with pytorch and onnx and raise if any pair of vectors has
+    a cosine below MIN_COSINE. Returns the lowest cosine.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(model_dir, device='cpu').encode(texts)
+    candidate = OnnxSentenceEncoder(model_dir, quantized=quantized).encode(texts)
+    lowest = float(cosine_agreement(reference, candidate).min())
+    print(f"Lowest onnx {'int8' if quantized else 'fp32'} cosine vs pytorch: {lowest:.4f}")
+    if lowest < MIN_COSINE:
+        raise Exception(f"onnx embeddings drifted from pytorch: cosine {lowest:.4f} < {MIN_COSINE}")
+    return lowest
+
+
+ACCURACY_TEXTS = [
+    'What did the speaker say about pricing?',
+    'The quarterly report shows revenue growth across every region.',
+    'hello',
+    'Customers asked for faster onboarding and clearer documentation on the API limits.',
+    'A long sentence that keeps going to exercise padding, ' * 8,
+]
+
+
+if __name__ == '__main__':
+    # python -m common.onnx_encoder <model dir>, run at image build time
+    export_onnx(sys.argv[1])
+    check_accuracy(sys.argv[1], ACCURACY_TEXTS, quantized=False)
+    check_accuracy(sys.argv[1], ACCURACY_TEXTS, quantized=True)
@@ -0,0 +1,191 @@
+"""
+PDF page text extraction, spread over worker processes.
+
+A backend knows how to open a PDF and pull the text of one page out of it
+(pypdf, or pdfium when pypdfium2 is installed). PdfExtractor runs a backend
+in-process or hands ranges of pages out to worker processes, and yields
+the pages in order either way:
+
+    extractor = PdfExtractor('pypdf', workers=4)
+    for page in extractor.pages(data):
+        print(page['page'], page['seconds'], page['text'][:80])
+
+Workers are plain multiprocessing.Process with a Pipe each, Lambda has no
+/dev/shm for the semaphores a multiprocessing.Pool needs.
+
+Extraction runs in-process unless workers is set above 1. Every worker
+parses the PDF and caches its objects on its own, so peak memory grows
+about linearly with workers: pypdf took 37MB on one process and 168MB on
+four for a 2400 page PDF (benchmarks/pdf_extract_benchmark.py). Bytes are
+shared with the forked workers. A file with a reopen() method
+(S3RangeFile) is reopened in each worker and read in ranges there, so the
+parent never holds the whole file. Any other file is read in full once in
+the parent first.
+"""
+import multiprocessing
+import time
+from io import BytesIO
+
+# pages handed to a worker at a time, workers take turns so the first pages come back first
+RANGE_SIZE = 8
+
+
+class PdfExtractionError(Exception):
+    pass
+
+
+class PypdfBackend:
+    name = 'pypdf'
+
+    def open(self, data):
+        # bytes or a binary file
+        from pypdf import PdfReader
+        return PdfReader(BytesIO(data) if isinstance(data, (bytes, bytearray)) else data)
+
+    def page_count(self, document) -> int:
+        return len(document.pages)
+
+    def page_text(self, document, number: int) -> str:
+        return document.pages[number].extract_text()
+
+
+class PdfiumBackend:
+    """
+    pdfium through pypdfium2, several times faster than pypdf on most
+    documents. pypdfium2 is not in the ingest requirements, add it to use
+    PDF_BACKEND=pdfium.
+    """
+    name = 'pdfium'
+
+    def open(self, data):
+        import pypdfium2
+        return pypdfium2.PdfDocument(data)
+
+    def page_count(self, document) -> int:
+        return len(document)
+
+    def page_text(self, document, number: int) -> str:
+        page = document[number]
+        try:
+            text_page = page.get_textpage()
+            try:
+                return text_page.get_text_range()
+            finally:
+                text_page.close()
+        finally:
+            page.close()
+
+
+BACKENDS = {
+    'pypdf': PypdfBackend,
+    'pdfium': PdfiumBackend,
+}
+
+
+def _extract_range(backend, document, numbers, worker: int):
+    for number in numbers:
+        start = time.time()
+        text = backend.page_text(document, number)
+        yield {'page': number, 'text': text, 'seconds': time.time() - start, 'worker': worker}
+
+
+def _worker(backend, data, ranges: list, worker: int, conn):
+    # no printing here, the parent's stdout lock may have been held by another thread at fork
+    try:
+        if hasattr(data, 'reopen'):
+            data = data.reopen()
+        document = backend.open(data)
+        for numbers in ranges:
+            for page in _extract_range(backend, document, numbers, worker):
+                conn.send(page)
+    except Exception as e:
+        conn.send({'error': f'{type(e).__name__}: {e}', 'worker': worker})
+    finally:
+        conn.close()
+
+
+class PdfExtractor:
+    """
+    Extracts page text with backend (a name in BACKENDS or a backend
+    instance) on up to workers processes, in-process by default. Documents
+    of fewer than two ranges of pages are always extracted in-process.
+
+    Workers are forked, from whatever thread calls pages(), so they only
+    pay off with a vCPU each (Lambda gives 2 from 1769MB) and cost memory
+    as described above.
+    """
+
+    def __init__(self, backend='pypdf', workers: int = 1, range_size: int = RANGE_SIZE):
+        self.backend = BACKENDS[backend]() if isinstance(backend, str) else backend
+        self.workers = max(1, workers or 1)
+        self.range_size = range_size
+
+    def pages(self, data):
+        """
+        Yield {'page', 'text', 'seconds', 'worker'} for every page of the PDF
+        in data (bytes or a binary file), in page order.
+        """
+        document = self.backend.open(data)
+        count = self.backend.page_count(document)
+        ranges = [range(start, min(start + self.range_size, count)) for start in range(0, count, self.range_size)]
+        workers = min(self.workers, len(ranges))
+        if workers < 2:
+            for numbers in ranges:
+                yield from _extract_range(self.backend, document, numbers, 0)
+            return
+        del document
+        if not isinstance(data, (bytes, bytearray)) and not hasattr(data, 'reopen'):
+            # every worker parses its own copy, a file that can't be reopened is read in full once here
+            data.seek(0)
+            data = data.read()
+
+        # worker w takes ranges w, w + workers, ... and sends its pages in order, so the
+        # next page is always the next message from the worker that owns its range
+        processes = []
+        connections = []
+        try:
+            for worker in range(workers):
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=_worker, daemon=True,
+                                                  args=(self.backend, data, ranges[worker::workers], worker, sender))
+                process.start()
+                sender.close()
+                processes.append(process)
+                connections.append(receiver)
+            for index, numbers in enumerate(ranges):
+                conn = connections[index % workers]
+                for _ in numbers:
+                    try:
+                        page = conn.recv()
+                    except EOFError:
+                        raise PdfExtractionError(f"Worker {index % workers} exited before sending its pages")
+                    if 'error' in page:
+                        raise PdfExtractionError(f"Worker {page['worker']} failed: {page['error']}")
+                    yield page
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            for conn in connections:
+                conn.close()
+
+    def texts(self, data):
+        """
+        Yield the text of each page followed by a newline, then print the
+        page timings.
+        """
+        start = time.time()
+        page_seconds = 0.0
+        slowest = None
+        count = 0
+        for page in self.pages(data):
+            count += 1
+            page_seconds += page['seconds']
+            if slowest is None or page['seconds'] > slowest['seconds']:
+                slowest = {'page': page['page'], 'seconds': page['seconds']}
+            yield page['text'] + "\n"
+        if count:
+            print(f"Extracted {count} pages with {self.backend.name} (workers={self.workers}) in "
+                  f"{time.time()-start:.2f}s, {page_seconds:.2f}s of page time, "
+                  f"slowest page {slowest['page']} took {slowest['seconds']*1000:.0f} milliseconds")
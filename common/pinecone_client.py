@@ -0,0 +1,166 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.tracing import in_current_trace, subsegment
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# pinecone accepts at most 1000 ids per delete request
+DELETE_BATCH_SIZE = 1000
+# fetch ids travel in the query string, keep the url well under its length limit
+FETCH_BATCH_SIZE = 100
+
+
+class PineconeError(requests.RequestException):
+    """
+    Pinecone answered with an error status, or kept failing after retries.
+    """
+
+
+class PineconeClient:
+    """
+    Pinecone REST client meant to be created once per container, see
+    get_pinecone_client. Requests go over a keep-alive connection pool with
+    explicit connect/read timeouts, at most max_concurrency at a time, and
+    429/5xx responses or connection errors are retried with jittered
+    exponential backoff. Each call is an X-Ray subsegment annotated with
+    its latency.
+    """
+
+    def __init__(self, url: str = None, api_key: str = None, max_concurrency: int = 8,
+                 timeout: tuple = (3.05, 10), max_retries: int = 3):
+        self.url = url or os.environ['PINECONE_URL']
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.headers.update({
+            'accept': 'application/json',
+            'content-type': 'application/json',
+            'Api-Key': api_key or os.environ['PINECONE_KEY'],
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def post(self, path: str, payload: dict) -> dict:
+        return self.request('POST', path, json=payload)
+
+    def request(self, method: str, path: str, **kwargs) -> dict:
+        operation = path.strip('/').replace('/', ' ')
+        with subsegment(f'Pinecone {operation}') as segment:
+            start = time.time()
+            attempt = 0
+            while True:
+                error = None
+                try:
+                    with self._slots:
+                        response = self.session.request(method, self.url + path, timeout=self.timeout, **kwargs)
+                    if response.status_code == 200:
+                        break
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        raise PineconeError(f"Pinecone {operation} failed ({response.status_code}): {response.text}",
+                                            response=response)
+                    error = PineconeError(f"Pinecone {operation} failed ({response.status_code}): {response.text[:200]}",
+                                          response=response)
+                except PineconeError:
+                    raise
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                if attempt == self.max_retries:
+                    raise error
+                attempt += 1
+                delay = random.uniform(0, min(8.0, 0.25 * 2 ** attempt))
+                print(f"Retrying pinecone {operation} in {delay:.2f}s: {error}")
+                time.sleep(delay)
+            latency_ms = (time.time() - start) * 1000
+            if segment is not None:
+                segment.put_annotation('pinecone_latency_ms', latency_ms)
+                segment.put_annotation('pinecone_attempts', attempt + 1)
+            return response.json()
+
+    def query(self, vector: list, top_k: int, namespace: str = 'default', filter: dict = None,
+              include_values: bool = False, include_metadata: bool = True) -> dict:
+        payload = {
+            'vector': vector,
+            'topK': top_k,
+            'namespace': namespace,
+            'includeMetadata': include_metadata,
+            'includeValues': include_values,
+        }
+        if filter:
+            payload['filter'] = filter
+        return self.post('/query', payload)
+
+    def upsert(self, vectors: list, namespace: str = 'default') -> dict:
+        return self.post('/vectors/upsert', {'vectors': vectors, 'namespace': namespace})
+
+    def delete(self, namespace: str = 'default', ids: list = None, filter: dict = None) -> dict:
+        payload = {'namespace': namespace}
+        if ids is not None:
+            payload['ids'] = ids
+        if filter is not None:
+            payload['filter'] = filter
+        return self.post('/vectors/delete', payload)
+
+    def fetch(self, ids: list, namespace: str = 'default', batch_size: int = FETCH_BATCH_SIZE,
+              max_concurrency: int = 4) -> dict:
+        """
+        Vectors by id, as {id: {'id', 'values', 'metadata'}}. Ids that are not
+        in the index are missing from the result.
+        """
+        batches = [ids[i:i+batch_size] for i in range(0, len(ids), batch_size)]
+
+        def fetch_batch(batch):
+            return self.request('GET', '/vectors/fetch', params={'ids': batch, 'namespace': namespace})['vectors']
+
+        vectors = {}
+        if len(batches) <= 1:
+            results = [fetch_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+                results = list(executor.map(in_current_trace(fetch_batch), batches))
+        for result in results:
+            vectors.update(result)
+        return vectors
+
+    def delete_ids(self, ids: list, namespace: str = 'default', batch_size: int = DELETE_BATCH_SIZE,
+                   max_concurrency: int = 4) -> int:
+        """
+        Delete any number of ids, in batches of batch_size sent up to
+        max_concurrency at a time. Returns the number of batches.
+        """
+        batches = [ids[i:i+batch_size] for i in range(0, len(ids), batch_size)]
+        if len(batches) <= 1:
+            for batch in batches:
+                self.delete(namespace, ids=batch)
+            return len(batches)
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+            list(executor.map(in_current_trace(lambda batch: self.delete(namespace, ids=batch)), batches))
+        return len(batches)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_pinecone_client() -> PineconeClient:
+    """
+    The container's PineconeClient, created on first use from PINECONE_URL,
+    PINECONE_KEY and the optional PINECONE_MAX_CONCURRENCY,
+    PINECONE_CONNECT_TIMEOUT and PINECONE_READ_TIMEOUT.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PineconeClient(
+                max_concurrency=int(os.environ.get('PINECONE_MAX_CONCURRENCY', 8)),
+                timeout=(float(os.environ.get('PINECONE_CONNECT_TIMEOUT', 3.05)),
+                         float(os.environ.get('PINECONE_READ_TIMEOUT', 10))),
+            )
+        return _client
@@ -0,0 +1,112 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.pinecone_client import PineconeClient, PineconeError, get_pinecone_client
+
+# pinecone caps an upsert request at 2MB, 100 vectors per request is its recommended batch
+MAX_BATCH_VECTORS = 100
+MAX_BATCH_BYTES = 2 * 1024 * 1024
+
+
+class PineconeWriter:
+    """
+    Collects (id, values, metadata) records for one namespace and upserts
+    them in batches bounded by max_vectors and max_bytes. Up to
+    max_concurrency batches are in flight at once through the container's
+    PineconeClient, which retries failed requests, and a batch that is only
+    partially upserted is sent again on its own.
+
+        with PineconeWriter(namespace) as writer:
+            for id, values, metadata in records:
+                writer.add(id, values, metadata)
+        print(writer.stats)
+    """
+
+    def __init__(self, namespace: str, client: PineconeClient = None, max_vectors: int = MAX_BATCH_VECTORS,
+                 max_bytes: int = MAX_BATCH_BYTES, max_concurrency: int = 4, max_retries: int = 3):
+        self.namespace = namespace
+        self.client = client or get_pinecone_client()
+        self.max_vectors = max_vectors
+        # leave room for the namespace and the request envelope
+        self.max_bytes = max_bytes - 1024
+        self.max_retries = max_retries
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        # bounds the batches held in memory to the ones being sent plus one per worker
+        self._slots = threading.BoundedSemaphore(max_concurrency * 2)
+        self._futures = []
+        self._batch = []
+        self._batch_bytes = 0
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.stats = {'vectors': 0, 'batches': 0, 'retries': 0, 'seconds': 0.0, 'vectors_per_second': 0.0}
+
+    def add(self, id: str, values: list, metadata: dict):
+        record = {'id': id, 'values': values, 'metadata': metadata}
+        size = len(json.dumps(record))
+        if self._batch and (len(self._batch) >= self.max_vectors or self._batch_bytes + size > self.max_bytes):
+            self.flush()
+        self._batch.append(record)
+        self._batch_bytes += size
+
+    def flush(self):
+        """
+        Send the records collected so far, without waiting for the response.
+        """
+        if not self._batch:
+            return
+        batch, self._batch, self._batch_bytes = self._batch, [], 0
+        self._slots.acquire()
+        future = self._executor.submit(self._upsert, batch)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _upsert(self, batch: list):
+        # request level failures are retried by the client, this only covers partial upserts
+        for attempt in range(self.max_retries + 1):
+            upserted = self.client.upsert(batch, self.namespace).get('upsertedCount', len(batch))
+            if upserted == len(batch):
+                with self._lock:
+                    self.stats['vectors'] += len(batch)
+                    self.stats['batches'] += 1
+                return
+            if attempt == self.max_retries:
+                raise PineconeError(f"Adding to pinecone failed after {self.max_retries} retries: "
+                                    f"{upserted} of {len(batch)} vectors upserted")
+            with self._lock:
+                self.stats['retries'] += 1
+            delay = random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+            print(f"Retrying upsert of {len(batch)} vectors in {delay:.2f}s, only {upserted} were upserted")
+            time.sleep(delay)
+
+    def close(self) -> dict:
+        """
+        Flush, wait for every batch and raise the first failure, if any.
+        """
+        self.flush()
+        try:
+            errors = [future.exception() for future in self._futures]
+        finally:
+            self._executor.shutdown(wait=True)
+        self.stats['seconds'] = time.time() - self.started
+        if self.stats['seconds'] > 0:
+            self.stats['vectors_per_second'] = self.stats['vectors'] / self.stats['seconds']
+        print(f"Upserted {self.stats['vectors']} vectors in {self.stats['batches']} batches to namespace {self.namespace} "
+              f"in {self.stats['seconds']:.2f}s ({self.stats['vectors_per_second']:.1f} vectors/sec, {self.stats['retries']} retries)")
+        for error in errors:
+            if error is not None:
+                raise error
+        return self.stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't mask the original error, just let in-flight batches finish
+            self._executor.shutdown(wait=True)
+        return False
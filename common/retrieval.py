@@ -0,0 +1,197 @@
+"""
+MMR retrieval as a library: embed the queries, query pinecone for each,
+rerank the union with MMR and optionally pack it into a token budget.
+
+QueryMaxMarginalRelevance wraps it in a lambda, and callers that set
+RETRIEVAL_MODE=local (StagingContextManager, PlanLambda) run it in their
+own process instead of invoking that lambda:
+
+    retriever = retriever_from_environ()
+    matches = retriever.retrieve(queries, {}, 3, namespace, 3)
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common.mmr import max_marginal_relevance, mmr_select
+from common.token_budget import pack_to_budget
+from common.tracing import in_current_trace, subsegment
+
+
+class Retriever:
+    """
+    Holds the per-container clients and caches of the retrieval path.
+    retrieval_cache and namespace_versions are optional, without them
+    every request goes to pinecone. encoding (a tiktoken encoding) is only
+    needed for requests with a token_budget.
+    """
+
+    def __init__(self, embedding_client, pinecone, vector_cache, retrieval_cache=None, namespace_versions=None,
+                 encoding=None, query_fanout: int = 4, lambda_param: float = 0.5, duplicate_threshold: float = 0.95):
+        self.embedding_client = embedding_client
+        self.pinecone = pinecone
+        self.vector_cache = vector_cache
+        self.retrieval_cache = retrieval_cache if namespace_versions is not None else None
+        self.namespace_versions = namespace_versions
+        self.encoding = encoding
+        self.query_fanout = query_fanout
+        self.lambda_param = lambda_param
+        self.duplicate_threshold = duplicate_threshold
+
+    def query_all(self, vectors, metadata_filters: dict, top_n: int, namespace: str):
+        """
+        Run the pinecone queries of every query vector, up to query_fanout at
+        a time. Returns one (response, milliseconds) per query.
+        """
+        def timed_query(vector):
+            start = time.time()
+            # ids, scores and metadata only, MMR's vectors come from vector_cache
+            response = self.pinecone.query(vector.tolist(), top_n, namespace, filter=metadata_filters)
+            return response, (time.time() - start) * 1000
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.query_fanout, len(vectors)))) as executor:
+            return list(executor.map(in_current_trace(timed_query), vectors))
+
+    def retrieve(self, queries: list, metadata_filters: dict, top_n: int, namespace: str, final_set_size: int,
+                 token_budget: int = None, duplicate_threshold: float = None):
+        """
+        The MMR reranked matches, or with token_budget
+        {'matches': [...], 'token_count', 'token_budget', 'dropped_duplicates', 'dropped_over_budget'}.
+        """
+        if top_n < final_set_size:
+            raise ValueError("final_set_size must be smaller than the number of matches returned by queries * top_n")
+        if duplicate_threshold is None:
+            duplicate_threshold = self.duplicate_threshold
+        lambda_param = self.lambda_param
+
+        cache = self.retrieval_cache
+        if cache is not None:
+            version = self.namespace_versions.get(namespace)
+            params = {'filter': metadata_filters, 'top_n': top_n, 'final_set_size': final_set_size, 'lambda': lambda_param,
+                      'token_budget': token_budget, 'duplicate_threshold': duplicate_threshold if token_budget else None}
+            exact_key = cache.exact_key(namespace, version, queries, params)
+            cached = cache.get_exact(exact_key)
+            if cached is not None:
+                print(f"Exact retrieval cache hit for namespace {namespace} at version {version}")
+                return cached
+        # embed every query in one batch
+        with subsegment('Embed Queries'):
+            query_vectors = self.embedding_client.embed_many(queries)
+        if cache is not None:
+            params_key = cache.params_key(namespace, version, params)
+            cached = cache.get_similar(params_key, query_vectors)
+            if cached is not None:
+                print(f"Semantic retrieval cache hit for namespace {namespace} at version {version}")
+                cache.put(exact_key, params_key, query_vectors, cached)
+                return cached
+
+        # Accumulate matches from all queries
+        full_matches = []
+        start = time.time()
+        with subsegment('Query Pinecone'):
+            results = self.query_all(query_vectors, metadata_filters, top_n, namespace)
+        print("{:<60} {:>8} {:>10}".format("Query", "Matches", "Millis"))
+        print("-" * 80)
+        for query, (response, millis) in zip(queries, results):
+            if 'matches' not in response:
+                raise Exception(f"Error querying Pinecone: {response}")
+            full_matches.extend(response['matches'])
+            print("{:<60} {:>8} {:>10.1f}".format(query[:60], len(response['matches']), millis))
+        print(f"Retrieved {len(full_matches)} matches for {len(queries)} queries in {(time.time()-start)*1000:.1f} milliseconds")
+
+        # Deduplicate matches and sort them by score
+        deduplicated_matches = {}
+        for match in full_matches:
+            deduplicated_matches.setdefault(match['id'], match)
+        matches = sorted(deduplicated_matches.values(), key=lambda k: k['score'], reverse=True)
+
+        with subsegment('Candidate Vectors'):
+            vectors, vector_stats = self.vector_cache.vectors_for(namespace, matches, self.pinecone.fetch)
+        print(f"Candidate vectors: {vector_stats['hits']} cached, {vector_stats['fetched']} fetched")
+        # skip matches deleted between the query and the fetch
+        matches = [match for match in matches if match['id'] in vectors]
+
+        start = time.time()
+        candidate_vectors = np.stack([vectors[match['id']] for match in matches]) if matches else None
+        if token_budget and matches:
+            # rank every candidate, so dropped duplicates and oversized matches make room for the next ones
+            order = mmr_select([match['score'] for match in matches], candidate_vectors, len(matches), lambda_param)
+            reranked_matches, budget_report = pack_to_budget(
+                [matches[i] for i in order], candidate_vectors[order],
+                lambda match: len(self.encoding.encode(match['metadata']['content'])),
+                int(token_budget), final_set_size, duplicate_threshold)
+            print(f"Packed {len(reranked_matches)} matches into {budget_report['token_count']} of {token_budget} tokens, "
+                  f"dropped {budget_report['dropped_duplicates']} near duplicates and {budget_report['dropped_over_budget']} over budget")
+        else:
+            reranked_matches = max_marginal_relevance(matches, final_set_size, lambda_param, candidate_vectors)
+            budget_report = {'token_count': 0, 'token_budget': token_budget, 'dropped_duplicates': 0, 'dropped_over_budget': 0}
+        print(f"MMR picked {len(reranked_matches)} of {len(matches)} matches in {(time.time()-start)*1000:.1f} milliseconds")
+
+        print("{:<50} {:<10}".format("Content", "Score"))
+        print("-" * 60)
+        for match in reranked_matches:
+            print("{:<50} {:<10.2f}".format(match['metadata']['content'], match['score']))
+        result = dict(budget_report, matches=reranked_matches) if token_budget else reranked_matches
+        if cache is not None:
+            cache.put(exact_key, params_key, query_vectors, result)
+        return result
+
+    def handle_event(self, event: dict) -> dict:
+        """
+        Lambda style request/response around retrieve, the body is the one
+        QueryMaxMarginalRelevance has always taken.
+        """
+        try:
+            body = json.loads(event['body'])
+            print(body)
+            result = self.retrieve(body['queries'], body['metadata_filters'], body['top_n'], body['namespace'],
+                                   body['final_set_size'], body.get('token_budget'), body.get('duplicate_threshold'))
+            return {
+                'statusCode': 200,
+                'body': json.dumps(result)
+            }
+        except Exception as e:
+            # A general error handler; refine as needed.
+            return {
+                'statusCode': 500,
+                'body': json.dumps({"error": str(e)})
+            }
+
+
+def retriever_from_environ(lambda_client=None) -> Retriever:
+    """
+    Retriever configured like the QueryMaxMarginalRelevance lambda:
+    EMBEDDING_LAMBDA, PINECONE_URL / PINECONE_KEY, NAMESPACE_VERSION_TABLE
+    (leave unset to skip the retrieval cache), QUERY_FANOUT, LAMBDA_PARAM,
+    DUPLICATE_THRESHOLD, VECTOR_CACHE_* and RETRIEVAL_CACHE_*.
+    """
+    import boto3
+    import tiktoken
+
+    from common.embedding_client import EmbeddingClient
+    from common.pinecone_client import get_pinecone_client
+    from common.namespace_versions import NamespaceVersions
+    from common.retrieval_cache import RetrievalCache
+    from common.vector_cache import VectorCache
+
+    embedding_client = EmbeddingClient(os.environ['EMBEDDING_LAMBDA'], lambda_client or boto3.client('lambda'))
+    # candidate vectors by id, set VECTOR_CACHE_MMAP (e.g. /tmp/vector-cache.f16) to add a float16 file tier
+    vector_cache = VectorCache(memory_size=int(os.environ.get('VECTOR_CACHE_SIZE', 20000)),
+                               mmap_path=os.environ.get('VECTOR_CACHE_MMAP', ''),
+                               mmap_capacity=int(os.environ.get('VECTOR_CACHE_MMAP_ROWS', 200000)))
+    namespace_versions = None
+    if os.environ.get('NAMESPACE_VERSION_TABLE'):
+        namespace_versions = NamespaceVersions(boto3.resource('dynamodb').Table(os.environ['NAMESPACE_VERSION_TABLE']))
+    # results by exact and by near-identical queries, keyed by the namespace's version so content changes invalidate them
+    retrieval_cache = RetrievalCache(max_size=int(os.environ.get('RETRIEVAL_CACHE_SIZE', 1000)),
+                                     similarity_threshold=float(os.environ.get('RETRIEVAL_CACHE_SIMILARITY', 0.97)))
+    return Retriever(embedding_client, get_pinecone_client(), vector_cache,
+                     retrieval_cache=retrieval_cache,
+                     namespace_versions=namespace_versions,
+                     encoding=tiktoken.get_encoding("cl100k_base"),
+                     query_fanout=int(os.environ.get('QUERY_FANOUT', 4)),
+                     lambda_param=float(os.environ.get('LAMBDA_PARAM', 0.5)),
+                     duplicate_threshold=float(os.environ.get('DUPLICATE_THRESHOLD', 0.95)))
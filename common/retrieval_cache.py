@@ -0,0 +1,72 @@
+import hashlib
+import json
+import threading
+
+from common.lru import LRUCache
+from common.vector_codec import l2_normalize
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+class RetrievalCache:
+    """
+    Two layer cache of retrieval results.
+
+    The exact layer is keyed by the namespace and its version, the
+    normalized, sorted queries and every retrieval parameter. The semantic
+    layer keeps the query embeddings of recent results per (namespace,
+    version, parameters) and reuses a result when every new query has a
+    cached query within similarity_threshold cosine, and the other way
+    round. A threshold of 0 turns the semantic layer off.
+    """
+
+    def __init__(self, max_size: int = 1000, similarity_threshold: float = 0.97, entries_per_key: int = 32):
+        self.exact = LRUCache(max_size)
+        self.semantic = LRUCache(max_size)
+        self.similarity_threshold = similarity_threshold
+        self.entries_per_key = entries_per_key
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(data) -> str:
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def params_key(self, namespace: str, version: int, params: dict) -> str:
+        return self._hash({'namespace': namespace, 'version': version, 'params': params})
+
+    def exact_key(self, namespace: str, version: int, queries: list, params: dict) -> str:
+        return self._hash({
+            'namespace': namespace,
+            'version': version,
+            'queries': sorted({normalize_query(query) for query in queries}),
+            'params': params,
+        })
+
+    def get_exact(self, key: str):
+        return self.exact.get(key)
+
+    def get_similar(self, params_key: str, query_vectors):
+        if self.similarity_threshold <= 0 or not len(query_vectors):
+            return None
+        unit = l2_normalize(query_vectors)
+        with self._lock:
+            entries = list(self.semantic.get(params_key) or [])
+        for cached_unit, result in reversed(entries):
+            sims = unit @ cached_unit.T
+            if min(sims.max(axis=1).min(), sims.max(axis=0).min()) >= self.similarity_threshold:
+                return result
+        return None
+
+    def put(self, exact_key: str, params_key: str, query_vectors, result):
+        self.exact.put(exact_key, result)
+        if self.similarity_threshold <= 0 or not len(query_vectors):
+            return
+        with self._lock:
+            entries = self.semantic.get(params_key) or []
+            entries = (entries + [(l2_normalize(query_vectors), result)])[-self.entries_per_key:]
+            self.semantic.put(params_key, entries)
+
+    def stats(self) -> dict:
+        return {'exact': self.exact.stats(), 'semantic': self.semantic.stats()}
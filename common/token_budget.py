@@ -0,0 +1,41 @@
+import numpy as np
+
+from common.vector_codec import l2_normalize
+
+
+def pack_to_budget(matches: list, vectors, count_tokens, token_budget: int, max_items: int,
+                   duplicate_threshold: float = 0.95):
+    """
+    Walk matches in order (MMR order) and keep each one that is not a near
+    duplicate of a kept match and still fits in token_budget, until
+    max_items are kept. vectors is the (len(matches), dim) matrix of the
+    matches, a match is a near duplicate when its cosine to a kept match is
+    at least duplicate_threshold, which catches the overlapping blocks of
+    the MR ingest lambdas. count_tokens(match) is only called for matches
+    that get that far. Returns (kept matches, report).
+    """
+    unit = l2_normalize(vectors) if len(matches) else np.zeros((0, 0), dtype=np.float32)
+    kept = []
+    used = 0
+    duplicates = 0
+    over_budget = 0
+    for i, match in enumerate(matches):
+        if len(kept) == max_items:
+            break
+        if kept and float((unit[kept] @ unit[i]).max()) >= duplicate_threshold:
+            duplicates += 1
+            continue
+        tokens = count_tokens(match)
+        if used + tokens > token_budget:
+            # a shorter match further down may still fit
+            over_budget += 1
+            continue
+        kept.append(i)
+        used += tokens
+    report = {
+        'token_count': used,
+        'token_budget': token_budget,
+        'dropped_duplicates': duplicates,
+        'dropped_over_budget': over_budget,
+    }
+    return [matches[i] for i in kept], report
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+
+try:
+    from aws_xray_sdk.core import xray_recorder
+except ImportError:
+    # the ingest images don't ship the X-Ray SDK
+    xray_recorder = None
+
+
+@contextmanager
+def subsegment(name: str):
+    """
+    X-Ray subsegment of the current trace, or None when the SDK is missing
+    or there is no trace to attach to (local runs, benchmarks).
+    """
+    segment = None
+    if xray_recorder is not None:
+        try:
+            segment = xray_recorder.begin_subsegment(name)
+        except Exception:
+            segment = None
+    try:
+        yield segment
+    finally:
+        if segment is not None:
+            xray_recorder.end_subsegment()
+
+
+def in_current_trace(fn):
+    """
+    Wrap fn for a worker thread, which doesn't inherit the caller's X-Ray
+    trace entity.
+    """
+    if xray_recorder is None:
+        return fn
+    try:
+        entity = xray_recorder.get_trace_entity()
+    except Exception:
+        return fn
+
+    def traced(*args):
+        xray_recorder.set_trace_entity(entity)
+        return fn(*args)
+    return traced
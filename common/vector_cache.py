@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from common.lru import LRUCache
+
+
+class MmapVectorStore:
+    """
+    Fixed capacity float16 matrix memory-mapped from a file in /tmp. Rows are
+    handed out in order and, once the file is full, reused oldest first.
+    The row index lives in memory, so the file only outlives the process
+    as scratch space.
+    """
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        self.capacity = capacity
+        self.matrix = None
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _open(self, dim: int):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.matrix = np.memmap(self.path, dtype='<f2', mode='w+', shape=(self.capacity, dim))
+
+    def get(self, key):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return None
+            return np.asarray(self.matrix[row], dtype=np.float32)
+
+    def put(self, key, vector: np.ndarray):
+        with self._lock:
+            if self.matrix is None:
+                self._open(len(vector))
+            elif len(vector) != self.matrix.shape[1]:
+                return
+            row = self._rows.get(key)
+            if row is None:
+                if len(self._rows) < self.capacity:
+                    row = len(self._rows)
+                else:
+                    _, row = self._rows.popitem(last=False)
+                self._rows[key] = row
+            self.matrix[row] = vector
+
+
+def content_digest(match: dict) -> str:
+    """
+    Digest of the text a query match's vector was embedded from.
+    """
+    content = (match.get('metadata') or {}).get('content', '')
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class VectorCache:
+    """
+    Vectors of index entries keyed by (namespace, vector id, digest of the
+    embedded text): an in-memory LRU of float32 vectors in front of an
+    optional MmapVectorStore. The id alone isn't enough: an MR id hashes
+    the block while the vector is of the topic generated for it, and a
+    block that drops out of a document and comes back gets a new topic
+    under the same id. Ingest ids include the embedding model, so a model
+    change gives new ids. Entries of replaced vectors are never hit again
+    and age out of the LRU.
+    """
+
+    def __init__(self, memory_size: int = 20000, mmap_path: str = '', mmap_capacity: int = 200000):
+        self.memory = LRUCache(memory_size)
+        self.disk = MmapVectorStore(mmap_path, mmap_capacity) if mmap_path else None
+
+    def get_many(self, namespace: str, entries: list):
+        """
+        entries are (id, content digest) pairs. Returns ({id: vector} for
+        the cached ones, [ids not cached]).
+        """
+        found = {}
+        missing = []
+        for id, digest in entries:
+            key = (namespace, id, digest)
+            vector = self.memory.get(key)
+            if vector is None and self.disk is not None:
+                vector = self.disk.get(key)
+                if vector is not None:
+                    self.memory.put(key, vector)
+            if vector is None:
+                missing.append(id)
+            else:
+                found[id] = vector
+        return found, missing
+
+    def put(self, namespace: str, id: str, digest: str, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        self.memory.put((namespace, id, digest), vector)
+        if self.disk is not None:
+            self.disk.put((namespace, id, digest), vector)
+
+    def vectors_for(self, namespace: str, matches: list, fetch_fn):
+        """
+        Returns ({id: vector}, stats) for query matches (with metadata).
+        Ids missing from both tiers are loaded with
+        fetch_fn(missing_ids, namespace), which returns
+        {id: {'values': [...]}} like PineconeClient.fetch. Ids deleted from
+        the index since they were queried are left out.
+        """
+        digests = {match['id']: content_digest(match) for match in matches}
+        found, missing = self.get_many(namespace, list(digests.items()))
+        if missing:
+            fetched = fetch_fn(missing, namespace)
+            for id in missing:
+                if id in fetched:
+                    found[id] = np.asarray(fetched[id]['values'], dtype=np.float32)
+                    self.put(namespace, id, digests[id], found[id])
+        return found, {'hits': len(digests) - len(missing), 'fetched': len(missing)}
@@ -0,0 +1,57 @@
+import base64
+
+import numpy as np
+
+# wire dtypes are always little-endian, whatever the host byte order
+WIRE_DTYPES = {
+    'float32': '<f4',
+    'float16': '<f2',
+}
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale each row to unit length so cosine similarity becomes a dot product.
+    Zero rows are left as zeros.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def encode_vectors(vectors: np.ndarray, dtype: str = 'float32') -> dict:
+    """
+    Pack a (count, dim) matrix as base64 little-endian floats.
+    """
+    if dtype not in WIRE_DTYPES:
+        raise ValueError(f"Unsupported vector dtype: {dtype}, expected one of {list(WIRE_DTYPES)}")
+    vectors = np.atleast_2d(np.asarray(vectors))
+    data = np.ascontiguousarray(vectors, dtype=WIRE_DTYPES[dtype]).tobytes()
+    return {
+        'data': base64.b64encode(data).decode('ascii'),
+        'dtype': dtype,
+        'dim': int(vectors.shape[1]),
+        'count': int(vectors.shape[0]),
+    }
+
+
+def decode_vectors(data: str, dtype: str, dim: int) -> np.ndarray:
+    """
+    Inverse of encode_vectors, returns a float32 (count, dim) matrix.
+    """
+    if dtype not in WIRE_DTYPES:
+        raise ValueError(f"Unsupported vector dtype: {dtype}, expected one of {list(WIRE_DTYPES)}")
+    flat = np.frombuffer(base64.b64decode(data), dtype=WIRE_DTYPES[dtype])
+    return flat.reshape(-1, dim).astype(np.float32)
+
+
+def decode_embedding_response(body: dict) -> np.ndarray:
+    """
+    Read the vectors out of an embedding lambda response body, whichever
+    format it was sent in. Returns a float32 (count, dim) matrix.
+    """
+    key = 'vectors' if 'vectors' in body else 'vector'
+    if body.get('format') == 'base64':
+        return decode_vectors(body[key], body['dtype'], body['dim'])
+    return np.atleast_2d(np.asarray(body[key], dtype=np.float32))
@@ -2,28 +2,142 @@ import json
 import boto3
 import os
 import time
-from sentence_transformers import SentenceTransformer
+from common.embedding_cache import EmbeddingCache
+from common.vector_codec import WIRE_DTYPES, encode_vectors, l2_normalize
+from common.length_buckets import encode_length_bucketed, token_counts
+from common.model_registry import ModelRegistry, specs_from_environ
 
-os.environ['XDG_CACHE_HOME'] = '/tmp/.cache/'
-os.environ['HF_HOME'] = '/tmp/.cache/huggingface/'
-os.environ['TRANSFORMERS_CACHE'] = '/tmp/.cache/huggingface/'
-os.environ['HF_DATASETS_CACHE'] = '/tmp/.cache/huggingface/'
-# tst
-EMBEDDING_MODEL = os.environ['EMBEDDING_MODEL']
+# Models are named in EMBEDDING_MODELS (see common/model_registry.py), or a
+# single 'default' model comes from EMBEDDING_MODEL / INSTRUCTION.
+# Weights are baked into the image at build time, see dockerfile.
+BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 32))
+NORMALIZE = os.environ.get('EMBEDDING_NORMALIZE', 'false').lower() == 'true'
 
-embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+model_registry = ModelRegistry(specs_from_environ(),
+                               default=os.environ.get('EMBEDDING_DEFAULT_MODEL', ''),
+                               max_bytes=int(os.environ.get('EMBEDDING_MODELS_MAX_MB', 0))*1024*1024,
+                               threads=int(os.environ.get('EMBEDDING_ONNX_THREADS', 0)))
+# load the default model during init, the others on first use
+model_registry.get()
+# set EMBEDDING_DISK_CACHE (e.g. /tmp/embedding-cache) to back the in-memory LRU with /tmp
+embedding_cache = EmbeddingCache(model_registry.spec().cache_name(),
+                                 memory_size=int(os.environ.get('EMBEDDING_CACHE_SIZE', 10000)),
+                                 disk_dir=os.environ.get('EMBEDDING_DISK_CACHE', ''),
+                                 disk_max_bytes=int(os.environ.get('EMBEDDING_DISK_CACHE_MB', 256))*1024*1024)
+
+def parse_queries(payload: dict):
+    """
+    Returns (is_batch, queries). 'queries' encodes a whole batch in one
+    call, 'query' is kept for single strings. Raises ValueError for a
+    'dtype' the base64 format can't send.
+    """
+    dtype = payload.get('dtype', 'float32')
+    if dtype not in WIRE_DTYPES:
+        raise ValueError(f"Unsupported vector dtype: {dtype}, expected one of {list(WIRE_DTYPES)}")
+    if 'queries' in payload:
+        return True, payload['queries']
+    return False, [payload['query']]
+
+def resolve_model(payload: dict):
+    """
+    Returns (model name, instruction) for a request. 'model' picks a
+    registry entry, 'instruction' overrides the entry's instruction.
+    """
+    spec = model_registry.spec(payload.get('model'))
+    return spec.name, payload.get('instruction', spec.instruction)
+
+def model_inputs(texts: list, instruction: str) -> list:
+    if not instruction:
+        return texts
+    return [instruction + ': ' + text for text in texts]
+
+def encode_texts(texts: list, batch_size: int=BATCH_SIZE, model_name: str=None, instruction: str=None, sources: list=None,
+                 counts: list=None):
+    """
+    Returns (vectors, cache_stats), only cache misses reach the model. Misses
+    are encoded in buckets of similar token length, using counts (token_report's
+    token_counts for texts) when given instead of tokenizing them again. A
+    sources list is filled with the cache tier each text came from.
+    """
+    model, spec = model_registry.get(model_name)
+    if instruction is None:
+        instruction = spec.instruction
+    text_counts = dict(zip(texts, counts)) if counts is not None else None
+    def encode_misses(misses):
+        miss_counts = [text_counts[text] for text in misses] if text_counts is not None else None
+        return encode_length_bucketed(model, model_inputs(misses, instruction), batch_size, miss_counts)
+    return embedding_cache.encode(
+        texts,
+        encode_misses,
+        model_name=spec.cache_name(),
+        instruction=instruction,
+        sources=sources,
+    )
+
+def token_report(texts: list, model_name: str=None, instruction: str=None) -> dict:
+    """
+    Per-input token counts, and whether the model truncated the input.
+    """
+    model, spec = model_registry.get(model_name)
+    if instruction is None:
+        instruction = spec.instruction
+    counts = token_counts(model.tokenizer, model_inputs(texts, instruction))
+    truncated = [count > model.max_seq_length for count in counts]
+    if any(truncated):
+        print(f'{sum(truncated)} of {len(texts)} inputs exceed max_seq_length ({model.max_seq_length} tokens) and were truncated')
+    return {
+        'token_counts': counts,
+        'truncated': truncated,
+    }
+
+def format_response(payload: dict, vectors, is_batch: bool) -> dict:
+    # 'json' returns lists of floats, 'base64' returns packed little-endian floats
+    output_format = payload.get('format', 'json')
+    normalize = payload.get('normalize', NORMALIZE)
+    if normalize:
+        vectors = l2_normalize(vectors)
+    key = 'vectors' if is_batch else 'vector'
+    if output_format == 'base64':
+        packed = encode_vectors(vectors, payload.get('dtype', 'float32'))
+        response = {
+            key: packed['data'],
+            'format': 'base64',
+            'dtype': packed['dtype'],
+            'dim': packed['dim'],
+        }
+    else:
+        list_vectors = vectors.tolist()
+        response = {
+            key: list_vectors if is_batch else list_vectors[0]
+        }
+    response['normalized'] = bool(normalize)
+    return response
 
 def lambda_handler(event, context):
     payload = json.loads(event['body'])
-    query = payload['query']
+    try:
+        is_batch, queries = parse_queries(payload)
+        model_name, instruction = resolve_model(payload)
+    except (KeyError, ValueError) as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)})
+        }
+    batch_size = int(payload.get('batch_size', BATCH_SIZE))
     start = time.time()
-    vector = embedding_model.encode(query)
-    list_vector = vector.tolist()
+    # batch requests report token counts, counted once and reused to bucket the misses
+    report = token_report(queries, model_name, instruction) if is_batch else None
+    vectors, cache_stats = encode_texts(queries, batch_size, model_name, instruction,
+                                        counts=report['token_counts'] if report else None)
+    response = format_response(payload, vectors, is_batch)
+    response['model'] = model_name
+    # the model and backend the vectors come from, ingest keys its vector ids on it
+    response['model_id'] = model_registry.spec(model_name).cache_name()
+    response['cache'] = cache_stats
+    if report:
+        response.update(report)
     end = time.time()
-    print(f'Embedding took ({(end-start)*1000}) milliseconds')
-    response = {
-        'vector': list_vector
-    }
+    print(f'Embedding {len(queries)} queries with {model_name} took ({(end-start)*1000}) milliseconds, cache: {cache_stats}')
     return {
         'statusCode': 200,
         'body': json.dumps(response)
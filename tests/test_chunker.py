@@ -0,0 +1,90 @@
+import pytest
+
+from common import chunker
+from common.chunker import Chunker, TiktokenCounter, chunk_text, split_sentences
+
+
+def test_split_sentences_keeps_decimals_and_joins_pieces():
+    assert list(split_sentences("It costs 3.5 dollars. Done! Really?")) == ["It costs 3.5 dollars.", "Done!", "Really?"]
+    assert list(split_sentences(["First sen", "tence. Second", " one.\n"])) == ["First sentence.", "Second one."]
+    assert list(split_sentences(["Ends here.", " Next."])) == ["Ends here.", "Next."]
+
+
+def test_sentences_are_packed_up_to_max_tokens():
+    text = "One two. Three four five. Six. Seven eight nine ten."
+    assert chunk_text(text, max_tokens=5) == ["One two. Three four five.", "Six. Seven eight nine ten."]
+
+
+def test_trailing_partial_chunk_is_kept():
+    assert chunk_text("One two three. Four.", max_tokens=3) == ["One two three.", "Four."]
+
+
+def test_overlap_starts_the_next_chunk_with_the_last_sentences():
+    text = "A b. C d. E f. G h."
+    assert chunk_text(text, max_tokens=4, overlap=1) == ["A b. C d.", "C d. E f.", "E f. G h."]
+
+
+def test_overlap_is_dropped_when_it_does_not_fit():
+    text = "A b c. D e f. G."
+    # "A b c." can't join "D e f." within 4 words, so the second chunk starts fresh
+    assert chunk_text(text, max_tokens=4, overlap=1) == ["A b c.", "D e f. G."]
+
+
+def test_long_sentence_is_cut_into_runs_of_words():
+    text = "Short. " + " ".join(f"w{i}" for i in range(7)) + "."
+    assert chunk_text(text, max_tokens=3) == ["Short.", "w0 w1 w2", "w3 w4 w5", "w6."]
+
+
+def test_text_without_sentence_ends_is_cut_at_a_space(monkeypatch):
+    monkeypatch.setattr(chunker, 'MAX_SENTENCE_CHARS', 20)
+    pieces = list(split_sentences(["aaaa bbbb cccc dddd eeee ", "ffff gggg"]))
+    assert all(len(piece) <= 25 for piece in pieces)
+    assert " ".join(pieces).split() == "aaaa bbbb cccc dddd eeee ffff gggg".split()
+
+
+def test_custom_token_counter():
+    chunks = list(Chunker(max_tokens=10, count_tokens=len).chunks("Abcd. Efgh. Ijkl."))
+    assert chunks == ["Abcd. Efgh.", "Ijkl."]
+
+
+def test_max_tokens_must_be_positive():
+    with pytest.raises(ValueError):
+        Chunker(max_tokens=0)
+
+
+def test_text_without_spaces_is_cut_at_max_sentence_chars(monkeypatch):
+    monkeypatch.setattr(chunker, 'MAX_SENTENCE_CHARS', 20)
+    text = "字" * 25
+    pieces = list(split_sentences([text[:10], text[10:], "字" * 30]))
+    assert all(len(piece) <= 20 for piece in pieces)
+    assert "".join(pieces) == "字" * 55
+
+
+def test_many_small_pieces_without_sentence_ends_are_read_in_linear_time(monkeypatch):
+    monkeypatch.setattr(chunker, 'MAX_SENTENCE_CHARS', 1000)
+    pieces = list(split_sentences("ab " for _ in range(100000)))
+    assert all(len(piece) <= 1000 for piece in pieces)
+    assert sum(len(piece.split()) for piece in pieces) == 100000
+
+
+def test_word_over_max_tokens_is_cut_into_runs_of_characters():
+    chunks = chunk_text("Short. " + "x" * 25, max_tokens=10, count_tokens=len)
+    assert chunks[0] == "Short."
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert "".join(chunks[1:]) == "x" * 25
+
+
+class CharEncoder:
+    # a tiktoken encoding stand-in with one token per character
+    def encode(self, text, disallowed_special=()):
+        return [ord(char) for char in text]
+
+    def decode_with_offsets(self, ids):
+        return ''.join(chr(id) for id in ids), list(range(len(ids)))
+
+
+def test_word_over_max_tokens_is_cut_into_runs_of_tokens():
+    counter = TiktokenCounter(CharEncoder())
+    assert list(counter.split("abcdefg", 3)) == [("abc", 3), ("def", 3), ("g", 1)]
+    chunks = list(Chunker(max_tokens=4, count_tokens=counter).chunks("日本語のテキストです"))
+    assert chunks == ["日本語の", "テキスト", "です"]
@@ -0,0 +1,165 @@
+from common.ingest_manifest import MIGRATED_MARKER, SourceManifest, chunk_vector_id
+
+
+class FakeTable:
+    """
+    The query, get_item, put_item and batch_writer calls SourceManifest
+    makes, over a dict of sourceKey -> {vectorId: item}.
+    """
+
+    def __init__(self):
+        self.items = {}
+
+    def query(self, KeyConditionExpression, **kwargs):
+        expression = KeyConditionExpression.get_expression()
+        prefix = ''
+        if expression['operator'] == 'AND':
+            source_condition, sort_condition = expression['values']
+            prefix = sort_condition.get_expression()['values'][1]
+            expression = source_condition.get_expression()
+        source_key = expression['values'][1]
+        items = self.items.get(source_key, {})
+        return {'Items': [item for vector_id, item in sorted(items.items()) if vector_id.startswith(prefix)]}
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(Key['sourceKey'], {}).get(Key['vectorId'])
+        return {'Item': item} if item is not None else {}
+
+    def batch_writer(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def put_item(self, Item):
+        self.items.setdefault(Item['sourceKey'], {})[Item['vectorId']] = Item
+
+    def delete_item(self, Key):
+        self.items.get(Key['sourceKey'], {}).pop(Key['vectorId'], None)
+
+
+class FakePinecone:
+    def __init__(self, log=None):
+        self.log = log if log is not None else []
+        self.deleted_ids = []
+        self.filters = []
+
+    def delete_ids(self, ids, namespace):
+        self.deleted_ids.extend(ids)
+
+    def delete(self, namespace, ids=None, filter=None):
+        self.log.append('filter delete')
+        self.filters.append((namespace, filter))
+
+
+def ingest(manifest, pinecone, chunks):
+    new_chunks, stale_ids = manifest.diff('twin', 'doc.pdf', chunks)
+    manifest.add('twin', 'doc.pdf', [id for id, _ in new_chunks])
+    manifest.cleanup(pinecone, 'twin', 'doc.pdf', stale_ids)
+    return new_chunks, stale_ids
+
+
+def test_chunk_vector_id_depends_on_namespace_source_kind_model_and_text():
+    id = chunk_vector_id('twin', 'doc.pdf', 'text', 'simple', 'm')
+    assert id == chunk_vector_id('twin', 'doc.pdf', 'text', 'simple', 'm')
+    assert id != chunk_vector_id('other', 'doc.pdf', 'text', 'simple', 'm')
+    assert id != chunk_vector_id('twin', 'other.pdf', 'text', 'simple', 'm')
+    assert id != chunk_vector_id('twin', 'doc.pdf', 'text!', 'simple', 'm')
+    assert id != chunk_vector_id('twin', 'doc.pdf', 'text', 'mr', 'm')
+    assert id != chunk_vector_id('twin', 'doc.pdf', 'text', 'simple', 'n')
+
+
+def test_first_ingest_adds_every_chunk_once_and_clears_pre_manifest_vectors_after_it():
+    table = FakeTable()
+    log = []
+    manifest = SourceManifest(table, 'simple', 'm')
+    pinecone = FakePinecone(log)
+    original_add = manifest.add
+    manifest.add = lambda *args: (log.append('add'), original_add(*args))
+    new_chunks, stale_ids = ingest(manifest, pinecone, ['a', 'b', 'a'])
+    assert [chunk for _, chunk in new_chunks] == ['a', 'b']
+    assert stale_ids == []
+    assert log == ['add', 'filter delete']
+    assert pinecone.filters == [('twin', {'source': 'doc.pdf', 'ingest': {'$exists': False}})]
+    assert MIGRATED_MARKER in table.items['twin#doc.pdf']
+    assert manifest.vector_ids('twin', 'doc.pdf') == {id for id, _ in new_chunks}
+
+
+def test_reingest_adds_new_chunks_and_removes_stale_ones():
+    manifest = SourceManifest(FakeTable(), 'simple', 'm')
+    pinecone = FakePinecone()
+    ingest(manifest, pinecone, ['a', 'b', 'c'])
+    new_chunks, stale_ids = ingest(manifest, pinecone, ['a', 'B', 'c', 'd'])
+    ids = {chunk: chunk_vector_id('twin', 'doc.pdf', chunk, 'simple', 'm') for chunk in 'abcdB'}
+    assert new_chunks == [(ids['B'], 'B'), (ids['d'], 'd')]
+    assert stale_ids == [ids['b']]
+    assert pinecone.deleted_ids == [ids['b']]
+    # the pre-manifest vectors are only deleted once
+    assert len(pinecone.filters) == 1
+    assert manifest.vector_ids('twin', 'doc.pdf') == {ids['a'], ids['B'], ids['c'], ids['d']}
+
+
+def test_legacy_cleanup_can_be_turned_off():
+    manifest = SourceManifest(FakeTable(), 'simple', 'm', legacy_cleanup=False)
+    pinecone = FakePinecone()
+    ingest(manifest, pinecone, ['a'])
+    assert pinecone.filters == []
+
+
+def test_unchanged_document_has_nothing_to_do():
+    manifest = SourceManifest(FakeTable(), 'simple', 'm')
+    pinecone = FakePinecone()
+    ingest(manifest, pinecone, ['a', 'b'])
+    source_diff = manifest.diff_stream('twin', 'doc.pdf')
+    assert list(source_diff.new_chunks(['a', 'b'])) == []
+    assert source_diff.unchanged == 2
+    assert source_diff.stale_ids() == []
+
+
+def test_sources_are_kept_apart():
+    manifest = SourceManifest(FakeTable(), 'simple', 'm')
+    pinecone = FakePinecone()
+    ingest(manifest, pinecone, ['a'])
+    new_chunks, stale_ids = manifest.diff('twin', 'other.pdf', ['a'])
+    assert len(new_chunks) == 1
+    assert stale_ids == []
+
+
+def test_kinds_are_kept_apart():
+    table = FakeTable()
+    pinecone = FakePinecone()
+    simple = SourceManifest(table, 'simple', 'm')
+    mr = SourceManifest(table, 'mr', 'm')
+    simple_chunks, _ = ingest(simple, pinecone, ['a', 'b'])
+    mr_chunks, stale_ids = ingest(mr, pinecone, ['a'])
+    assert len(mr_chunks) == 1
+    assert stale_ids == []
+    assert pinecone.deleted_ids == []
+    assert simple.vector_ids('twin', 'doc.pdf') == {id for id, _ in simple_chunks}
+    # a manifest without a kind sees both, for removing the document
+    assert SourceManifest(table).vector_ids('twin', 'doc.pdf') == {id for id, _ in simple_chunks + mr_chunks}
+
+
+def test_model_change_reembeds_and_deletes_the_old_model_vectors():
+    table = FakeTable()
+    pinecone = FakePinecone()
+    manifest = SourceManifest(table, 'simple', 'old')
+    old_chunks, _ = ingest(manifest, pinecone, ['a', 'b'])
+    new_chunks, stale_ids = ingest(manifest.with_model('new'), pinecone, ['a', 'b'])
+    assert [chunk for _, chunk in new_chunks] == ['a', 'b']
+    assert stale_ids == []
+    assert sorted(pinecone.deleted_ids) == sorted(id for id, _ in old_chunks)
+    assert manifest.vector_ids('twin', 'doc.pdf') == set()
+    assert manifest.with_model('new').vector_ids('twin', 'doc.pdf') == {id for id, _ in new_chunks}
+
+
+def test_remove_source_clears_every_kind_model_and_the_marker():
+    table = FakeTable()
+    pinecone = FakePinecone()
+    ingest(SourceManifest(table, 'simple', 'm'), pinecone, ['a'])
+    ingest(SourceManifest(table, 'mr', 'n'), pinecone, ['b'])
+    SourceManifest(table).remove_source('twin', 'doc.pdf')
+    assert table.items['twin#doc.pdf'] == {}
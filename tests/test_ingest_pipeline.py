@@ -0,0 +1,58 @@
+import io
+
+import pytest
+
+from common.ingest_pipeline import S3RangeFile
+
+
+class FakeS3:
+    """
+    head_object and ranged get_object over an object that can be replaced,
+    answering IfMatch on a stale ETag with an error like S3's 412.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.etag = '"v1"'
+        self.calls = []
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.data), 'ETag': self.etag, 'VersionId': 'version-1'}
+
+    def get_object(self, Bucket, Key, Range, **kwargs):
+        self.calls.append(kwargs)
+        if 'IfMatch' in kwargs and kwargs['IfMatch'] != self.etag:
+            raise RuntimeError('PreconditionFailed')
+        start, end = Range[len('bytes='):].split('-')
+        return {'Body': io.BytesIO(self.data[int(start):int(end) + 1])}
+
+
+def test_reads_the_object_in_pinned_ranged_gets():
+    s3 = FakeS3(bytes(range(256)) * 10)
+    stream = S3RangeFile(s3, 'bucket', 'doc.pdf', block_size=100)
+    assert stream.read() == s3.data
+    assert stream.requests == 26
+    assert all(call == {'IfMatch': '"v1"', 'VersionId': 'version-1'} for call in s3.calls)
+    stream.seek(-5, io.SEEK_END)
+    assert stream.read() == s3.data[-5:]
+
+
+def test_reopen_is_pinned_to_the_same_object():
+    s3 = FakeS3(b'x' * 300)
+    reopened = S3RangeFile(s3, 'bucket', 'doc.pdf', block_size=100).reopen()
+    s3.etag = '"v2"'
+    with pytest.raises(RuntimeError):
+        reopened.read()
+
+
+def test_short_block_raises_instead_of_looping():
+    s3 = FakeS3(b'x' * 300)
+    stream = S3RangeFile(s3, 'bucket', 'doc.pdf', block_size=100)
+    # a GET that comes back short, as if the object had shrunk since head_object
+    s3.data = b'x' * 150
+    stream.seek(100)
+    with pytest.raises(IOError):
+        stream.read()
+    stream.seek(200)
+    with pytest.raises(IOError):
+        stream.read(10)
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from common.llm_executor import LLMExecutor, TokenBucket, retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_bucket(clock, rate_per_minute, capacity=None):
+    return TokenBucket(rate_per_minute, capacity, clock=clock.monotonic, sleep=clock.sleep)
+
+
+def test_bucket_starts_full_and_refills_at_the_rate(clock):
+    bucket = make_bucket(clock, 120)
+    assert bucket.capacity == 120
+    asyncio.run(bucket.acquire(120))
+    assert bucket.tokens == 0
+    clock.now += 1.5
+    bucket._refill()
+    assert bucket.tokens == pytest.approx(3)
+    clock.now += 3600
+    bucket._refill()
+    assert bucket.tokens == 120
+
+
+def test_acquire_waits_for_the_missing_tokens(clock):
+    bucket = make_bucket(clock, 60)
+    asyncio.run(bucket.acquire(50))
+    asyncio.run(bucket.acquire(20))
+    # 10 left, 1 per second
+    assert clock.sleeps == [pytest.approx(10)]
+    assert bucket.tokens == pytest.approx(0)
+
+
+def test_acquire_more_than_capacity_takes_the_capacity(clock):
+    bucket = make_bucket(clock, 60, capacity=10)
+    asyncio.run(bucket.acquire(500))
+    assert clock.sleeps == []
+    assert bucket.tokens == 0
+
+
+def test_refund_is_capped_at_capacity(clock):
+    bucket = make_bucket(clock, 60)
+    asyncio.run(bucket.acquire(30))
+    bucket.refund(20)
+    assert bucket.tokens == pytest.approx(50)
+    bucket.refund(100)
+    assert bucket.tokens == 60
+
+
+def test_retry_after():
+    assert retry_after({'retry-after-ms': '1500', 'Retry-After': '9'}) == 1.5
+    assert retry_after({'Retry-After': '2'}) == 2.0
+    assert retry_after({'retry-after-ms': 'soon', 'Retry-After': '3'}) == 3.0
+    assert retry_after({'Retry-After': 'Wed, 21 Oct 2026 07:28:00 GMT'}) == 0.0
+    assert retry_after({}) == 0.0
+
+
+class FakeResponse:
+    def __init__(self, status, body, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def json(self):
+        return self.body
+
+    async def text(self):
+        return str(self.body)
+
+
+class FakeSession:
+    """
+    Answers each prompt with the next of its scripted (status, headers)
+    responses, a 200 echoing the prompt back.
+    """
+
+    def __init__(self, script):
+        self.script = {prompt: list(responses) for prompt, responses in script.items()}
+        self.posts = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def post(self, url, json):
+        prompt = json['messages'][0]['content']
+        self.posts.append(prompt)
+        responses = self.script.get(prompt)
+        status, headers = responses.pop(0) if responses else (200, {})
+        if status == 200:
+            return FakeResponse(200, {'choices': [{'message': {'role': 'assistant', 'content': prompt.upper()}}],
+                                      'usage': {'total_tokens': 10}})
+        return FakeResponse(status, {'error': 'scripted'}, headers)
+
+
+def executor(session, clock):
+    return LLMExecutor('key', max_retries=2, session_factory=lambda headers: session, sleep=clock.sleep)
+
+
+def prompts(*contents):
+    return [[{'role': 'user', 'content': content}] for content in contents]
+
+
+def test_one_failed_prompt_does_not_drop_the_others(clock):
+    session = FakeSession({'bad': [(400, {})]})
+    results = dict(executor(session, clock).as_completed(prompts('one', 'bad', 'two'), 'model', 50))
+    assert sorted(results) == [0, 1, 2]
+    assert results[0]['message']['content'] == 'ONE'
+    assert results[2]['message']['content'] == 'TWO'
+    assert results[1]['message'] is None
+    assert 'status 400' in results[1]['error']
+    # a 400 isn't retried
+    assert results[1]['attempts'] == 1
+    assert session.posts.count('bad') == 1
+
+
+def test_429_is_retried_after_retry_after(clock):
+    session = FakeSession({'busy': [(429, {'Retry-After': '7'})]})
+    results = dict(executor(session, clock).as_completed(prompts('busy'), 'model', 50))
+    assert results[0]['message']['content'] == 'BUSY'
+    assert results[0]['attempts'] == 2
+    # the jittered backoff of the first retry is at most a second, so Retry-After decides
+    assert clock.sleeps == [7.0]
+    assert session.posts == ['busy', 'busy']
+
+
+def test_retries_give_up_after_max_retries(clock):
+    session = FakeSession({'down': [(503, {})] * 3})
+    results = dict(executor(session, clock).as_completed(prompts('down'), 'model', 50))
+    assert results[0]['attempts'] == 3
+    assert 'status 503' in results[0]['error']
+    assert len(clock.sleeps) == 2
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from benchmarks.mmr_benchmark import candidates, reference_mmr
+from common.mmr import max_marginal_relevance, mmr_select
+
+
+@pytest.mark.parametrize('lambda_param', [0.3, 0.5, 0.8])
+def test_picks_match_the_previous_implementation(lambda_param):
+    matches = candidates(60, 32, seed=7)
+    reranked = reference_mmr(matches, lambda_param)
+    for k in (1, 10, 60):
+        picks = max_marginal_relevance(matches, k, lambda_param)
+        assert [match['id'] for match in picks] == [match['id'] for match in reranked[:k]]
+
+
+def test_lambda_one_is_score_order():
+    rng = np.random.default_rng(0)
+    scores = rng.uniform(0, 1, 20)
+    picks = mmr_select(scores, rng.standard_normal((20, 8)), 20, lambda_param=1.0)
+    assert list(picks) == list(np.argsort(-scores, kind='stable'))
+
+
+def test_a_near_duplicate_loses_to_a_diverse_candidate():
+    vectors = np.array([[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]])
+    picks = mmr_select([0.9, 0.89, 0.8], vectors, 2, lambda_param=0.5)
+    assert list(picks) == [0, 2]
+
+
+def test_k_larger_than_candidates_and_empty():
+    assert len(mmr_select([0.5, 0.4], np.eye(2), 5)) == 2
+    assert len(mmr_select([0.5, 0.4], np.eye(2), 0)) == 0
+    assert max_marginal_relevance([], 3) == []
@@ -0,0 +1,42 @@
+from common.vector_cache import VectorCache
+
+
+def match(id, content):
+    return {'id': id, 'score': 1.0, 'metadata': {'content': content}}
+
+
+class FakeIndex:
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.fetched = []
+
+    def fetch(self, ids, namespace):
+        self.fetched.append(list(ids))
+        return {id: {'values': self.vectors[id]} for id in ids if id in self.vectors}
+
+
+def test_cached_vectors_are_not_fetched_again():
+    cache = VectorCache()
+    index = FakeIndex({'a': [1.0, 0.0], 'b': [0.0, 1.0]})
+    cache.vectors_for('twin', [match('a', 'x'), match('b', 'y')], index.fetch)
+    vectors, stats = cache.vectors_for('twin', [match('a', 'x'), match('b', 'y')], index.fetch)
+    assert stats == {'hits': 2, 'fetched': 0}
+    assert index.fetched == [['a', 'b']]
+    assert list(vectors['b']) == [0.0, 1.0]
+
+
+def test_new_content_under_the_same_id_is_fetched_again():
+    cache = VectorCache()
+    index = FakeIndex({'a': [1.0, 0.0]})
+    cache.vectors_for('twin', [match('a', 'old topic')], index.fetch)
+    index.vectors['a'] = [0.0, 1.0]
+    vectors, stats = cache.vectors_for('twin', [match('a', 'new topic')], index.fetch)
+    assert stats == {'hits': 0, 'fetched': 1}
+    assert list(vectors['a']) == [0.0, 1.0]
+
+
+def test_ids_deleted_from_the_index_are_left_out():
+    cache = VectorCache()
+    vectors, stats = cache.vectors_for('twin', [match('gone', 'x')], FakeIndex({}).fetch)
+    assert vectors == {}
+    assert stats == {'hits': 0, 'fetched': 1}